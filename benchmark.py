@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+配置流程端到端基准测试
+
+在本地模拟路由器 (fake_router.py) 上运行完整流程
+set_system_time → unlock_dropbear → activate_ssh → start_dropbear → reset_system_time,
+统计:
+- 单台路由器: 每次运行的总耗时、各步骤耗时、HTTP 往返次数
+- 扩展性: 同时配置 1 ~ 1000 台路由器时的每分钟完成次数
+- 启动耗时: 导入 main 并执行启动时的依赖检查 (install_dependencies) 相对空解释器的额外耗时
+
+结果保存为 JSON, 可用 --baseline 与历史结果对比, 出现性能回退时以非零状态码退出。
+多台路由器使用 127.0.0.0/8 上的不同地址模拟, 仅适用于 Linux。
+
+用法:
+    python benchmark.py --runs 5 --scale 1,10,100,1000 --output bench.json
+    python benchmark.py --baseline bench.json
+    python benchmark.py --runs 0 --scale "" --max-startup-ms 150
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+from fake_router import FakeRouter
+
+
+def router_address(index):
+    """
+    第 index 台模拟路由器的回环地址, 跳过 .0 与 .255
+    """
+    index += 2
+    octets = []
+    for _ in range(3):
+        octets.append(index % 254 + 1)
+        index //= 254
+    return "127.%d.%d.%d" % tuple(reversed(octets))
+
+
+def summarize(values):
+    """
+    返回一组耗时的统计值
+    """
+    values = sorted(values)
+    if not values:
+        return {}
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return {
+        "min": round(values[0], 4),
+        "median": round(statistics.median(values), 4),
+        "p95": round(p95, 4),
+        "max": round(values[-1], 4),
+    }
+
+
+def run_round(fake, count, engine, router_options, batch=False):
+    """
+    同时配置 count 台模拟路由器
+    :return: (结果列表, 墙钟耗时)
+    """
+    inventory = [{"host": f"{router_address(i)}:{fake.port}", "token": "bench"}
+                 for i in range(count)]
+    started = time.monotonic()
+    if engine == "async":
+        import asyncio
+        import aiohttp
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(count)
+            connector = aiohttp.TCPConnector(limit=count, limit_per_host=4)
+            async with aiohttp.ClientSession(connector=connector) as session:
+                return await asyncio.gather(*(
+                    main.provision_host_async(entry, session, semaphore, router_options)
+                    for entry in inventory))
+
+        results = asyncio.run(run_all())
+    else:
+        output = main._ThreadOutput(sys.stdout)
+        sys.stdout = output
+        try:
+            with ThreadPoolExecutor(max_workers=count) as pool:
+                results = list(pool.map(
+                    lambda entry: main.provision_host(entry, batch, output, router_options),
+                    inventory))
+        finally:
+            sys.stdout = output.stream
+    elapsed = time.monotonic() - started
+
+    for result in results:
+        result.pop("log", None)
+        state = fake.routers.get(result["host"].split(":")[0])
+        result["round_trips"] = state.requests if state else 0
+        result["scenes_left"] = len(state.scenes) if state else 0
+    return results, elapsed
+
+
+def new_fake(args):
+    fake = FakeRouter(host="0.0.0.0", port=0, ssh_port=args.ssh_port, latency=args.latency,
+                      scene_delay=args.scene_delay)
+    fake.start()
+    return fake
+
+
+def bench_single(args, router_options):
+    """
+    单台路由器重复运行 args.runs 次
+    """
+    runs = []
+    for _ in range(args.runs):
+        fake = new_fake(args)
+        try:
+            results, elapsed = run_round(fake, 1, args.engine, router_options, args.batch)
+        finally:
+            fake.stop()
+        result = results[0]
+        runs.append({
+            "ok": result["ok"],
+            "seconds": round(elapsed, 4),
+            "round_trips": result["round_trips"],
+            "scenes_left": result["scenes_left"],
+            "steps": {step["name"]: step["seconds"] for step in result["steps"]},
+            "error": result["failed_step"] or result["error"],
+        })
+        print(f"  单次运行: {'✓' if result['ok'] else '✗'} {elapsed:.3f}s, "
+              f"HTTP 往返 {result['round_trips']} 次, 残留场景 {result['scenes_left']} 个")
+
+    step_names = []
+    for run in runs:
+        step_names += [name for name in run["steps"] if name not in step_names]
+    return {
+        "runs": runs,
+        "total": summarize([run["seconds"] for run in runs]),
+        "steps": {name: summarize([run["steps"][name] for run in runs if name in run["steps"]])
+                  for name in step_names},
+        "round_trips": summarize([run["round_trips"] for run in runs]),
+    }
+
+
+def bench_scale(args, router_options):
+    """
+    同时配置不同数量的路由器, 统计吞吐量
+    """
+    points = []
+    for count in args.scale:
+        fake = new_fake(args)
+        try:
+            results, elapsed = run_round(fake, count, args.engine, router_options, args.batch)
+        finally:
+            fake.stop()
+        ok = sum(1 for r in results if r["ok"])
+        point = {
+            "routers": count,
+            "seconds": round(elapsed, 4),
+            "ok": ok,
+            "failed": count - ok,
+            "runs_per_minute": round(ok / elapsed * 60, 2) if elapsed else 0,
+            "per_router": summarize([r["seconds"] for r in results]),
+            "round_trips": sum(r["round_trips"] for r in results),
+            "scenes_left": sum(r["scenes_left"] for r in results),
+        }
+        points.append(point)
+        print(f"  {count:>5} 台: {elapsed:.3f}s, 成功 {ok}, 每分钟 {point['runs_per_minute']} 次")
+    return points
+
+
+# 命令行启动时必经的路径: 导入 main 并检查依赖; main.py --help 在依赖检查之前就已退出
+STARTUP_CHECK = "import sys, main; sys.exit(0 if main.install_dependencies(assume_yes=False) else 1)"
+
+
+def bench_startup(repeat):
+    """
+    测量命令行的启动耗时 (导入 main 并检查依赖), 扣除空解释器的启动时间
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def measure(args):
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, *args], cwd=here, check=True,
+                           stdout=subprocess.DEVNULL)
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples)
+
+    bare = measure(["-c", "pass"])
+    full = measure(["-c", STARTUP_CHECK])
+    return {
+        "interpreter_ms": round(bare * 1000, 2),
+        "total_ms": round(full * 1000, 2),
+        "overhead_ms": round(max(full - bare, 0) * 1000, 2),
+    }
+
+
+def compare(current, baseline, tolerance):
+    """
+    与基准结果对比, 返回回退项列表
+    """
+    regressions = []
+    old = baseline.get("single", {}).get("total", {}).get("median")
+    new = current.get("single", {}).get("total", {}).get("median")
+    if old and new and new > old * (1 + tolerance):
+        regressions.append(f"单次运行中位耗时 {old}s → {new}s")
+
+    old_rt = baseline.get("single", {}).get("round_trips", {}).get("median")
+    new_rt = current.get("single", {}).get("round_trips", {}).get("median")
+    if old_rt and new_rt and new_rt > old_rt:
+        regressions.append(f"HTTP 往返次数 {old_rt} → {new_rt}")
+
+    old_startup = baseline.get("startup", {}).get("overhead_ms")
+    new_startup = current.get("startup", {}).get("overhead_ms")
+    # 启动耗时本身很小, 额外留出 5ms 的抖动余量
+    if old_startup is not None and new_startup is not None \
+            and new_startup > old_startup * (1 + tolerance) + 5:
+        regressions.append(f"启动耗时 {old_startup}ms → {new_startup}ms")
+
+    old_scale = {p["routers"]: p for p in baseline.get("scale", [])}
+    for point in current.get("scale", []):
+        before = old_scale.get(point["routers"])
+        if before and point["runs_per_minute"] < before["runs_per_minute"] * (1 - tolerance):
+            regressions.append(f"{point['routers']} 台并发吞吐 {before['runs_per_minute']} → "
+                               f"{point['runs_per_minute']} 次/分钟")
+    return regressions
+
+
+def main_cli():
+    import argparse
+    parser = argparse.ArgumentParser(description="配置流程端到端基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="单台路由器的重复次数 (默认 5)")
+    parser.add_argument("--scale", default="1,10,100,1000",
+                        help="扩展性测试的并发路由器数量, 逗号分隔, 留空跳过 (默认 1,10,100,1000)")
+    parser.add_argument("--engine", choices=("thread", "async"), default="thread",
+                        help="使用线程池 (RouterHack) 或 asyncio (AsyncRouterHack) 引擎")
+    parser.add_argument("--batch", action="store_true", help="使用批量模式 (仅线程引擎)")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟路由器的响应延迟(秒)")
+    parser.add_argument("--scene-delay", type=float, default=0.1, help="模拟路由器的场景执行延迟(秒)")
+    parser.add_argument("--settle-delay", type=float, help="RouterHack 的 settle_delay(秒), 默认按型号配置")
+    parser.add_argument("--ssh-port", type=int, default=2222, help="模拟 SSH 端口 (默认 2222)")
+    parser.add_argument("--no-ssh-verify", action="store_true", help="不做 SSH 握手验证")
+    parser.add_argument("--no-pace", action="store_true", help="不限制请求速率")
+    parser.add_argument("--startup-runs", type=int, default=10,
+                        help="启动耗时的测量次数, 0 表示跳过 (默认 10)")
+    parser.add_argument("--max-startup-ms", type=float,
+                        help="启动额外耗时的上限(毫秒), 超过时以非零状态码退出")
+    parser.add_argument("--output", metavar="FILE", help="保存 JSON 结果的路径")
+    parser.add_argument("--baseline", metavar="FILE", help="与之对比的历史 JSON 结果")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的性能波动比例 (默认 0.1)")
+    args = parser.parse_args()
+    args.scale = [int(n) for n in args.scale.split(",") if n.strip()]
+
+    router_options = {"ssh_port": args.ssh_port, "settle_delay": args.settle_delay,
+                      "ssh_verify": not args.no_ssh_verify,
+                      "pacing": False if args.no_pace else None}
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+    }
+
+    if args.runs:
+        print(f"单台路由器, 运行 {args.runs} 次 ({args.engine}):")
+        result["single"] = bench_single(args, router_options)
+    if args.scale:
+        print(f"扩展性测试 ({args.engine}):")
+        result["scale"] = bench_scale(args, router_options)
+
+    if args.startup_runs:
+        result["startup"] = bench_startup(args.startup_runs)
+        print(f"启动耗时: {result['startup']['overhead_ms']}ms "
+              f"(解释器本身 {result['startup']['interpreter_ms']}ms)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.output}")
+
+    regressions = []
+    if args.max_startup_ms is not None and "startup" in result \
+            and result["startup"]["overhead_ms"] > args.max_startup_ms:
+        regressions.append(f"启动耗时 {result['startup']['overhead_ms']}ms 超过上限 {args.max_startup_ms}ms")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions += compare(result, json.load(f), args.tolerance)
+    if args.baseline or args.max_startup_ms is not None:
+        if regressions:
+            print("\n❌ 检测到性能回退:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\n✓ 未检测到性能回退")
+
+
+if __name__ == "__main__":
+    main_cli()
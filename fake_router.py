@@ -0,0 +1,761 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地小米路由器模拟器
+
+模拟 main.py 用到的 MiWiFi 接口, 用于没有真实路由器时的离线测试与压测:
+- /cgi-bin/luci/;stok=.../api/misystem/set_sys_time
+- /cgi-bin/luci/;stok=.../api/xqsmarthome/request_smartcontroller
+  (scene_setting / scene_start_by_crontab / get_scene_setting / scene_delete)
+- /cgi-bin/luci/;stok=.../api/xqsystem/fac_info
+- /cgi-bin/luci/;stok=.../api/misystem/status (CPU 负载)
+- /cgi-bin/luci/;stok=.../api/xqsystem/reboot (模拟重启: 关闭 SSH, 未提交的 nvram 与 dropbear 的修改失效)
+- /cgi-bin/luci/api/xqsystem/init_info (无需 stok)
+- /cgi-bin/luci/web 登录页与 /cgi-bin/luci/api/xqsystem/login 密码登录
+
+每个监听地址代表一台路由器: 服务监听 0.0.0.0 时, 访问 127.0.0.2、127.0.0.3 ...
+即可模拟多台互相独立的路由器 (Linux 下整个 127.0.0.0/8 都指向本机)。
+dropbear 重启成功后, 在该地址的 ssh_port 上开启模拟 SSH 端口: 安装了 paramiko 时
+是可以完成握手、root 密码登录并执行简单命令 (nvram get、echo、uname) 的 SSH 服务,
+并提供把文件保存在内存中的 SFTP 服务与 md5sum、cat > 文件等上传用到的命令;
+否则只返回 SSH 版本号。
+
+用法:
+    python fake_router.py --port 8080 --ssh-port 2222 --latency 0.05
+    python main.py --inventory routers.csv    # host 填写 127.0.0.1:8080
+"""
+
+import hashlib
+import collections
+import json
+import logging
+import random
+import re
+import shlex
+import socket
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SSH_BANNER = b"SSH-2.0-dropbear_2019.78\r\n"
+LOGIN_KEY = "a2ffa5c9be07488bbb04a3a47d3c5f6a"
+DEVICE_ID = "00:11:22:33:44:55"
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><title>小米路由器</title></head><body>
+<script>
+var deviceId = '%(device_id)s';
+var Encrypt = {
+    key: '%(key)s',
+    iv: '64175472480004614961023454661220',
+    newEncryptMode: %(new_mode)d,
+    nonce: null
+};
+</script>
+</body></html>
+"""
+
+
+def dropbear_server(password, execute):
+    """
+    返回模拟 dropbear 的 paramiko ServerInterface, 只接受 root 密码登录
+    :param execute: 执行命令的函数, (command, stdin) -> (stdout, stderr, 退出码);
+                    stdin 为无参函数, 读取客户端发送的全部标准输入
+    """
+    import paramiko
+
+    def run(channel, command):
+        # 只发送 EOF, 由客户端关闭 channel: 命令很快结束时, 服务端主动关闭可能
+        # 先于 exec 请求的应答到达客户端
+        try:
+            stdout, stderr, status = execute(command, lambda: channel.makefile("rb").read())
+            channel.sendall(stdout.encode())
+            channel.sendall_stderr(stderr.encode())
+            channel.send_exit_status(status)
+            channel.shutdown_write()
+        except (OSError, EOFError, paramiko.SSHException):
+            channel.close()
+
+    class DropbearServer(paramiko.ServerInterface):
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_auth_password(self, username, given):
+            if username == "root" and given == password:
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+        def check_channel_request(self, kind, chanid):
+            if kind == "session":
+                return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_exec_request(self, channel, command):
+            threading.Thread(target=run, args=(channel, command.decode("utf-8", "replace")),
+                             daemon=True).start()
+            return True
+
+    return DropbearServer()
+
+
+def memory_sftp(state):
+    """
+    返回把文件保存在 state.files 中的 paramiko SFTPServerInterface 类, 只支持上传用到的操作
+    """
+    import io
+    import os
+    import stat
+    import paramiko
+
+    def attributes(entry):
+        attr = paramiko.SFTPAttributes()
+        attr.st_size = len(entry["data"])
+        attr.st_mode = stat.S_IFREG | entry["mode"]
+        return attr
+
+    class UploadHandle(paramiko.SFTPHandle):
+        def __init__(self, path, flags):
+            super().__init__(flags)
+            self.path = path
+            self.writefile = io.BytesIO()
+
+        def stat(self):
+            return attributes({"data": self.writefile.getvalue(), "mode": 0o644})
+
+        def close(self):
+            with state.lock:
+                entry = state.files.setdefault(self.path, {"data": b"", "mode": 0o644})
+                entry["data"] = self.writefile.getvalue()
+            super().close()
+
+    class MemorySFTP(paramiko.SFTPServerInterface):
+        def open(self, path, flags, attr):
+            if not flags & (os.O_WRONLY | os.O_RDWR):
+                return paramiko.SFTP_OP_UNSUPPORTED
+            return UploadHandle(path, flags)
+
+        def stat(self, path):
+            with state.lock:
+                entry = state.files.get(path)
+            return paramiko.SFTP_NO_SUCH_FILE if entry is None else attributes(entry)
+
+        lstat = stat
+
+        def chattr(self, path, attr):
+            with state.lock:
+                entry = state.files.get(path)
+                if entry is None:
+                    return paramiko.SFTP_NO_SUCH_FILE
+                if attr.st_mode is not None:
+                    entry["mode"] = attr.st_mode & 0o7777
+            return paramiko.SFTP_OK
+
+        def remove(self, path):
+            with state.lock:
+                return paramiko.SFTP_OK if state.files.pop(path, None) else paramiko.SFTP_NO_SUCH_FILE
+
+        def rename(self, oldpath, newpath):
+            # SFTP 的 rename 不覆盖已有文件
+            with state.lock:
+                if oldpath not in state.files:
+                    return paramiko.SFTP_NO_SUCH_FILE
+                if newpath in state.files:
+                    return paramiko.SFTP_FAILURE
+                state.files[newpath] = state.files.pop(oldpath)
+            return paramiko.SFTP_OK
+
+        def posix_rename(self, oldpath, newpath):
+            with state.lock:
+                if oldpath not in state.files:
+                    return paramiko.SFTP_NO_SUCH_FILE
+                state.files[newpath] = state.files.pop(oldpath)
+            return paramiko.SFTP_OK
+
+    return MemorySFTP
+
+
+class RouterState:
+    """
+    一台模拟路由器的状态
+    """
+    def __init__(self, address):
+        self.address = address
+        self.lock = threading.Lock()
+        self.scenes = {}          # 场景 id -> {"id", "name", "launch", "action_list"}
+        self.next_scene_id = 1
+        self.nvram = {}
+        self.committed = {}
+        self.dropbear_unlocked = False
+        self.dropbear_enabled = False
+        self.ssh_listener = None
+        self.sys_time = None
+        self.token_seen_at = {}   # stok -> 首次使用时间
+        self.requests = 0
+        self.recent = collections.deque()  # 最近 1 秒内 smartcontroller 请求的时间
+        self.executed = []        # 已执行的命令, 便于测试断言
+        self.reboots = 0
+        self.files = {}           # 通过 SSH 上传的文件: 路径 -> {"data", "mode"}
+        self.router_id = str(uuid.uuid4())  # init_info 中的 routerId, 重启后不变
+
+
+class FakeRouter:
+    """
+    模拟路由器服务
+
+    :param host: HTTP 监听地址; 0.0.0.0 可同时模拟 127.0.0.0/8 上的多台路由器
+    :param port: HTTP 监听端口
+    :param ssh_port: dropbear 启动后开放的模拟 SSH 端口, 0 表示不模拟
+    :param latency: 每个 HTTP 响应额外增加的延迟(秒)
+    :param scene_delay: 场景触发后命令实际执行前的延迟(秒)
+    :param error_rate: smartcontroller 请求随机返回 -101 的概率
+    :param token: 有效的 stok, 为空时接受任意 stok
+    :param token_ttl: stok 首次使用后的有效期(秒), 过期后返回 3001, 0 表示不过期
+    :param ssh_supported: 模拟的 ROM 是否支持开启 SSH (fac_info 中的 ssh 值)
+    :param hardware: init_info 返回的型号
+    :param rom: init_info 返回的 ROM 版本
+    :param password: 管理后台密码, 用于模拟登录
+    :param new_encrypt_mode: 登录时使用 SHA-256 (新版固件) 还是 SHA-1
+    :param ssh_password: 模拟 SSH 服务的 root 密码
+    :param capacity: smartcontroller 每秒能处理的请求数, 超过时返回 -101, 0 表示不限制;
+                     status 接口报告的 CPU 负载也按它计算
+    :param dropbear_unlocked: dropbear 启动脚本没有 release 检查 (开发版 ROM), 不需要 sed 解锁
+    :param sftp: SSH 服务是否提供 SFTP 子系统; 大多数原厂 ROM 的 dropbear 没有 sftp-server
+    """
+    def __init__(self, host="127.0.0.1", port=8080, ssh_port=2222, latency=0.0,
+                 scene_delay=0.0, error_rate=0.0, token=None, token_ttl=0,
+                 ssh_supported=True, hardware="RM1800", rom="1.0.399", password="admin",
+                 new_encrypt_mode=False, ssh_password="admin", capacity=0, dropbear_unlocked=False,
+                 sftp=True):
+        self.host = host
+        self.port = port
+        self.ssh_port = ssh_port
+        self.latency = latency
+        self.scene_delay = scene_delay
+        self.error_rate = error_rate
+        self.token = token
+        self.token_ttl = token_ttl
+        self.ssh_supported = ssh_supported
+        self.hardware = hardware
+        self.rom = rom
+        self.password = password
+        self.new_encrypt_mode = new_encrypt_mode
+        self.ssh_password = ssh_password
+        self.capacity = capacity
+        self.dropbear_unlocked = dropbear_unlocked
+        self.sftp = sftp
+        self.issued_tokens = set()
+        # 所有模拟路由器共用一个主机密钥; 没有 paramiko 时只返回 SSH 版本号
+        try:
+            import paramiko
+            self.host_key = paramiko.ECDSAKey.generate()
+            # 端口探测只建立连接不握手, 服务端会记录大量异常日志
+            logger = logging.getLogger("paramiko")
+            if not logger.handlers:
+                logger.addHandler(logging.NullHandler())
+        except ImportError:
+            self.host_key = None
+
+        self.routers = {}
+        self._routers_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def router(self, address):
+        """
+        返回监听地址 address 对应的路由器状态, 不存在时创建
+        """
+        with self._routers_lock:
+            state = self.routers.get(address)
+            if state is None:
+                state = self.routers[address] = RouterState(address)
+                state.dropbear_unlocked = self.dropbear_unlocked
+            return state
+
+    def start(self):
+        """
+        在后台线程中启动服务, 返回实际监听的端口
+        """
+        fake = self
+
+        class Handler(RouterRequestHandler):
+            router = fake
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def serve_forever(self):
+        """
+        在当前线程中运行服务, 直到 Ctrl+C
+        """
+        self.start()
+        try:
+            self._thread.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        停止服务并关闭所有模拟 SSH 端口
+        """
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for state in list(self.routers.values()):
+            with state.lock:
+                self.close_ssh(state)
+
+    def close_ssh(self, state):
+        """
+        关闭路由器的模拟 SSH 端口 (调用方需持有 state.lock)
+        """
+        if state.ssh_listener:
+            # 先 shutdown 唤醒阻塞在 accept() 上的线程, 否则端口不会真正释放
+            try:
+                state.ssh_listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            state.ssh_listener.close()
+            state.ssh_listener = None
+
+    # ---- 路由器行为 ----
+
+    def check_token(self, state, token):
+        """
+        :return: 0 表示有效, 否则为错误码
+        """
+        if self.token is not None and token != self.token and token not in self.issued_tokens:
+            return 3001
+        now = time.monotonic()
+        with state.lock:
+            first = state.token_seen_at.setdefault(token, now)
+        if self.token_ttl and now - first > self.token_ttl:
+            return 3001
+        return 0
+
+    def login_page(self):
+        return LOGIN_PAGE % {"device_id": DEVICE_ID, "key": LOGIN_KEY,
+                             "new_mode": 1 if self.new_encrypt_mode else 0}
+
+    def login(self, form):
+        """
+        校验 hash(nonce + hash(password + key)), 成功时签发新的 stok
+        """
+        digest = hashlib.sha256 if self.new_encrypt_mode else hashlib.sha1
+        nonce = form.get("nonce", [""])[0]
+        hashed = digest((self.password + LOGIN_KEY).encode()).hexdigest()
+        expected = digest((nonce + hashed).encode()).hexdigest()
+        if form.get("username", [""])[0] != "admin" or form.get("password", [""])[0] != expected:
+            return {"code": 401, "msg": "not auth"}
+        token = uuid.uuid4().hex
+        self.issued_tokens.add(token)
+        return {"code": 0, "token": token, "url": f"/cgi-bin/luci/;stok={token}/web/home"}
+
+    def init_info(self, state):
+        return {"code": 0, "hardware": self.hardware, "romversion": self.rom,
+                "model": f"xiaomi.router.{self.hardware.lower()}", "routerId": state.router_id,
+                "countrycode": "CN",
+                "inited": 1, "bound": 0}
+
+    def fac_info(self, state):
+        with state.lock:
+            ssh = self.ssh_supported and state.nvram.get("ssh_en") == "1"
+        return {"code": 0, "ssh": ssh, "telnet": False, "uart": False, "wl1_ssid": "", "4kid": False}
+
+    def load(self, state, record=False):
+        """
+        最近 1 秒内 smartcontroller 请求数相对 capacity 的比例
+        :param record: 是否把本次调用计为一次 smartcontroller 请求
+        """
+        now = time.monotonic()
+        with state.lock:
+            if record:
+                state.recent.append(now)
+            while state.recent and now - state.recent[0] > 1:
+                state.recent.popleft()
+            count = len(state.recent)
+        if not self.capacity:
+            return 0.05
+        return count / self.capacity
+
+    def reboot(self, state):
+        """
+        模拟重启: dropbear 停止, /etc 中的修改与未提交的 nvram 丢失, 已提交的 nvram 与场景保留
+        """
+        with state.lock:
+            self.close_ssh(state)
+            state.nvram = dict(state.committed)
+            state.dropbear_unlocked = self.dropbear_unlocked
+            state.dropbear_enabled = False
+            state.reboots += 1
+        return {"code": 0}
+
+    def status(self, state):
+        return {"code": 0, "cpu": {"core": 2, "hz": "1.0GHz", "load": round(min(1.0, self.load(state)), 4)},
+                "mem": {"total": "256MB", "usage": 0.42}}
+
+    def smartcontroller(self, state, payload):
+        if self.error_rate and random.random() < self.error_rate:
+            return {"code": -101, "msg": "Connect to smartcontroller failed"}
+        # 繁忙时拒绝的请求不计入负载
+        if self.capacity and self.load(state) >= 1:
+            return {"code": -101, "msg": "Connect to smartcontroller failed"}
+        self.load(state, record=True)
+        command = payload.get("command")
+        if command == "scene_setting":
+            try:
+                slot = payload["launch"]["timer"]["time"]
+            except (KeyError, TypeError):
+                return {"code": 1, "msg": "invalid scene"}
+            with state.lock:
+                # 同名、同槽位的场景视为修改, 否则新建
+                scene = next((s for s in state.scenes.values()
+                              if s["name"] == payload.get("name", "") and s["launch"]["timer"]["time"] == slot),
+                             None)
+                if scene is None:
+                    scene = {"id": state.next_scene_id}
+                    state.scenes[scene["id"]] = scene
+                    state.next_scene_id += 1
+                scene.update(name=payload.get("name", ""), launch=payload["launch"],
+                             action_list=payload.get("action_list", []))
+            return {"code": 0, "id": scene["id"]}
+        if command == "scene_start_by_crontab":
+            # 与定时器触发一样, 执行该槽位上的全部场景
+            with state.lock:
+                names = [s["name"] for s in state.scenes.values()
+                         if s["launch"]["timer"]["time"] == payload.get("time")]
+            if not names:
+                return {"code": 1, "msg": "scene not found"}
+            for name in names:
+                self.schedule(state, name)
+            return {"code": 0}
+        if command == "get_scene_setting":
+            with state.lock:
+                return {"code": 0, "scene_list": [dict(s) for s in state.scenes.values()]}
+        if command == "scene_delete":
+            with state.lock:
+                if state.scenes.pop(payload.get("id"), None) is None:
+                    return {"code": 1, "msg": "scene not found"}
+            return {"code": 0}
+        return {"code": 1, "msg": f"unknown command {command}"}
+
+    def schedule(self, state, name):
+        """
+        在 scene_delay 秒后执行场景名称中注入的命令
+        """
+        match = re.fullmatch(r"'\$\((.*)\)'", name, re.S)
+        if not match:
+            return
+        script = match.group(1)
+        if self.scene_delay:
+            timer = threading.Timer(self.scene_delay, self.execute, (state, script))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.execute(state, script)
+
+    def execute(self, state, script):
+        """
+        模拟 shell 执行以 && 串联的命令
+        """
+        for command in (part.strip() for part in script.split("&&")):
+            if not self.run_command(state, command):
+                return
+
+    def run_command(self, state, command):
+        with state.lock:
+            state.executed.append(command)
+            if command == "sed -i s/release/XXXXXX/g /etc/init.d/dropbear":
+                state.dropbear_unlocked = True
+                return True
+            match = re.fullmatch(r"nvram set (\w+)=(\S*)", command)
+            if match:
+                state.nvram[match.group(1)] = match.group(2)
+                return True
+            if command == "nvram commit":
+                state.committed = dict(state.nvram)
+                return True
+            if command == "/etc/init.d/dropbear enable":
+                state.dropbear_enabled = state.dropbear_unlocked
+                return state.dropbear_enabled
+            if command in ("/etc/init.d/dropbear restart", "/etc/init.d/dropbear start"):
+                if not (state.dropbear_unlocked and state.nvram.get("ssh_en") == "1"):
+                    return False
+                self.open_ssh(state)
+                return True
+        return True
+
+    def open_ssh(self, state):
+        """
+        在路由器地址上开放模拟 SSH 端口 (调用方需持有 state.lock)
+        """
+        if not self.ssh_port or state.ssh_listener:
+            return
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((state.address, self.ssh_port))
+        listener.listen(64)
+        state.ssh_listener = listener
+        threading.Thread(target=self._serve_ssh, args=(listener,), daemon=True).start()
+
+    def ssh_exec(self, state, command, stdin=None):
+        """
+        模拟通过 SSH 执行的一条命令, 支持 nvram get、echo、uname、true/false、head -c N /dev/zero,
+        以及上传文件用到的 md5sum、mkdir -p、cat > 文件、chmod、mv -f; 多条命令可用 && 连接,
+        单条命令可用 >&2 把标准输出重定向到标准错误
+        :param stdin: 无参函数, 返回命令的标准输入
+        :return: (stdout, stderr, 退出码)
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with state.lock:
+            state.executed.append(command)
+        stdout = stderr = ""
+        for part in command.split(" && "):
+            out, err, status = self._exec_one(state, part, stdin)
+            stdout += out
+            stderr += err
+            if status:
+                return stdout, stderr, status
+        return stdout, stderr, 0
+
+    def _exec_one(self, state, command, stdin):
+        try:
+            words = shlex.split(command)
+        except ValueError as e:
+            return "", f"sh: {e}\n", 2
+        quiet = "2>/dev/null" in words
+        if ">&2" in words:
+            out, err, status = self._exec_one(state, " ".join(shlex.quote(word) for word in words
+                                                           if word != ">&2"), stdin)
+            return "", err + out, status
+        words = [word for word in words if word != "2>/dev/null"]
+        if not words:
+            return "", "", 0
+        with state.lock:
+            nvram = dict(state.nvram)
+        if words[0] == "nvram" and len(words) == 3 and words[1] == "get":
+            value = nvram.get(words[2])
+            return ("" if value is None else value + "\n"), "", 0
+        if words[0] == "echo":
+            return " ".join(words[1:]) + "\n", "", 0
+        if words[0] == "uname":
+            return "Linux XiaoQiang 4.4.198 #0 SMP PREEMPT armv7l GNU/Linux\n", "", 0
+        if words[0] in ("true", "false"):
+            return "", "", int(words[0] == "false")
+        if words[:2] == ["head", "-c"] and len(words) == 4 and words[3] == "/dev/zero":
+            return "\0" * int(words[2]), "", 0
+        if words[0] == "md5sum":
+            stdout, stderr, status = "", "", 0
+            with state.lock:
+                for path in words[1:]:
+                    entry = state.files.get(path)
+                    if entry is None:
+                        stderr += f"md5sum: {path}: No such file or directory\n"
+                        status = 1
+                    else:
+                        stdout += f"{hashlib.md5(entry['data']).hexdigest()}  {path}\n"
+            return stdout, "" if quiet else stderr, status
+        if words[0] == "mkdir":
+            return "", "", 0
+        if words[0] == "cat" and len(words) == 3 and words[1] == ">":
+            data = stdin() if stdin else b""
+            with state.lock:
+                state.files[words[2]] = {"data": data, "mode": 0o644}
+            return "", "", 0
+        if words[0] == "chmod" and len(words) == 3:
+            with state.lock:
+                entry = state.files.get(words[2])
+                if entry is None:
+                    return "", f"chmod: {words[2]}: No such file or directory\n", 1
+                entry["mode"] = int(words[1], 8)
+            return "", "", 0
+        if words[:2] == ["mv", "-f"] and len(words) == 4:
+            with state.lock:
+                if words[2] not in state.files:
+                    return "", f"mv: can't rename '{words[2]}': No such file or directory\n", 1
+                state.files[words[3]] = state.files.pop(words[2])
+            return "", "", 0
+        return "", f"sh: {words[0]}: not found\n", 127
+
+    def _serve_ssh(self, listener):
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            if self.host_key is not None:
+                threading.Thread(target=self._ssh_session, args=(conn,), daemon=True).start()
+                continue
+            try:
+                conn.sendall(SSH_BANNER)
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+    def _ssh_session(self, conn):
+        """
+        处理一个 SSH 连接; 握手完成后由 paramiko 的传输线程继续处理
+        """
+        import paramiko
+        state = self.router(conn.getsockname()[0])
+        transport = paramiko.Transport(conn)
+        transport.local_version = SSH_BANNER.decode().strip()
+        transport.add_server_key(self.host_key)
+        # 与 dropbear 相同, 客户端请求时使用 zlib 压缩
+        transport.use_compression(True)
+        if self.sftp:
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, memory_sftp(state))
+        try:
+            transport.start_server(server=dropbear_server(
+                self.ssh_password, lambda command, stdin: self.ssh_exec(state, command, stdin)))
+        except (paramiko.SSHException, EOFError, OSError):
+            transport.close()
+
+
+class RouterRequestHandler(BaseHTTPRequestHandler):
+    """
+    MiWiFi LuCI 接口的请求处理
+    """
+    protocol_version = "HTTP/1.1"
+    server_version = "nginx"
+    router = None  # FakeRouter, 由 FakeRouter.start() 绑定
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        if self.router.latency:
+            time.sleep(self.router.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_html(self, page):
+        body = page.encode("utf-8")
+        if self.router.latency:
+            time.sleep(self.router.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        """
+        解析请求, 返回 (路由器状态, stok, 接口路径), 无法识别时 stok 与接口路径为 None
+        """
+        state = self.router.router(self.connection.getsockname()[0])
+        with state.lock:
+            state.requests += 1
+        path = urlsplit(self.path).path
+        if path.startswith("/cgi-bin/luci/api/") or path == "/cgi-bin/luci/web":
+            return state, None, path[len("/cgi-bin/luci"):]
+        match = re.match(r"/cgi-bin/luci/;stok=([^/]*)(/.*)$", path)
+        if not match:
+            return state, None, None
+        return state, match.group(1), match.group(2)
+
+    def do_GET(self):
+        state, token, endpoint = self._route()
+        if endpoint is None:
+            return self._send_json({"code": 404, "msg": "not found"}, 404)
+        if token is None:
+            # 无需登录的接口
+            if endpoint == "/api/xqsystem/init_info":
+                return self._send_json(self.router.init_info(state))
+            if endpoint == "/web":
+                return self._send_html(self.router.login_page())
+            return self._send_json({"code": 401, "msg": "Invalid token"})
+        code = self.router.check_token(state, token)
+        if code:
+            return self._send_json({"code": code, "msg": "Invalid token"})
+        if endpoint == "/api/misystem/set_sys_time":
+            query = parse_qs(urlsplit(self.path).query)
+            with state.lock:
+                state.sys_time = query.get("time", [None])[0]
+            return self._send_json({"code": 0})
+        if endpoint == "/api/xqsystem/fac_info":
+            return self._send_json(self.router.fac_info(state))
+        if endpoint == "/api/misystem/status":
+            return self._send_json(self.router.status(state))
+        if endpoint == "/api/xqsystem/reboot":
+            return self._send_json(self.router.reboot(state))
+        return self._send_json({"code": 404, "msg": "not found"}, 404)
+
+    def do_POST(self):
+        state, token, endpoint = self._route()
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if endpoint is None:
+            return self._send_json({"code": 404, "msg": "not found"}, 404)
+        if token is None:
+            if endpoint == "/api/xqsystem/login":
+                return self._send_json(self.router.login(form))
+            return self._send_json({"code": 401, "msg": "Invalid token"})
+        code = self.router.check_token(state, token)
+        if code:
+            return self._send_json({"code": code, "msg": "Invalid token"})
+        if endpoint == "/api/xqsmarthome/request_smartcontroller":
+            try:
+                payload = json.loads(form.get("payload", ["{}"])[0])
+            except ValueError:
+                return self._send_json({"code": 1, "msg": "invalid payload"})
+            return self._send_json(self.router.smartcontroller(state, payload))
+        return self._send_json({"code": 404, "msg": "not found"}, 404)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="本地小米路由器模拟器")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="监听地址, 0.0.0.0 可在 127.0.0.0/8 上模拟多台路由器 (默认 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="HTTP 端口 (默认 8080)")
+    parser.add_argument("--ssh-port", type=int, default=2222,
+                        help="dropbear 启动后开放的模拟 SSH 端口, 0 表示不模拟 (默认 2222)")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个响应的额外延迟(秒)")
+    parser.add_argument("--scene-delay", type=float, default=0.0, help="场景触发后命令执行前的延迟(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="smartcontroller 随机返回 -101 的概率 (0~1)")
+    parser.add_argument("--token", help="有效的 stok, 不填时接受任意 stok")
+    parser.add_argument("--token-ttl", type=float, default=0,
+                        help="stok 有效期(秒), 过期后返回 3001, 0 表示不过期")
+    parser.add_argument("--unsupported", action="store_true",
+                        help="模拟不支持开启 SSH 的 ROM (fac_info 中 ssh 始终为 false)")
+    parser.add_argument("--hardware", default="RM1800", help="init_info 返回的型号 (默认 RM1800)")
+    parser.add_argument("--rom", default="1.0.399", help="init_info 返回的 ROM 版本 (默认 1.0.399)")
+    parser.add_argument("--password", default="admin", help="管理后台密码 (默认 admin)")
+    parser.add_argument("--new-encrypt-mode", action="store_true", help="登录使用 SHA-256 (新版固件)")
+    parser.add_argument("--ssh-password", default="admin", help="模拟 SSH 服务的 root 密码 (默认 admin)")
+    parser.add_argument("--capacity", type=float, default=0,
+                        help="smartcontroller 每秒能处理的请求数, 超过时返回 -101, 0 表示不限制")
+    parser.add_argument("--dropbear-unlocked", action="store_true",
+                        help="模拟 dropbear 启动脚本没有 release 检查的 ROM, 不需要 sed 解锁")
+    parser.add_argument("--no-sftp", action="store_true",
+                        help="模拟没有 sftp-server 的 dropbear, SSH 服务不提供 SFTP 子系统")
+    args = parser.parse_args()
+
+    fake = FakeRouter(args.host, args.port, args.ssh_port, args.latency, args.scene_delay,
+                      args.error_rate, args.token, args.token_ttl, not args.unsupported,
+                      args.hardware, args.rom, args.password, args.new_encrypt_mode,
+                      args.ssh_password, args.capacity, args.dropbear_unlocked, not args.no_sftp)
+    print(f"模拟路由器已启动: http://{args.host}:{args.port}/cgi-bin/luci/;stok=<任意>/web/home")
+    sys.stdout.flush()
+    fake.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
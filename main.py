@@ -2,20 +2,27 @@
 # -*- coding: utf-8 -*-
 
 
-# 只导入基本模块
+# 只导入基本模块, 其余模块在用到时再导入, 保证启动速度
 import sys
-import subprocess
-from importlib import import_module
 
-def install_dependencies():
+# 依赖包名 -> 导入模块名
+DEPENDENCIES = {
+    'requests': 'requests',
+    'paramiko': 'paramiko',
+    'aiohttp': 'aiohttp',
+}
+
+def install_dependencies(extra=(), assume_yes=None):
     """
     检查并安装必要的依赖包
+    只通过 find_spec 查找模块位置, 不导入模块, 也不扫描全部已安装包的元数据
+    :param extra: 当前功能额外需要的依赖包
+    :param assume_yes: None 表示询问用户; True/False 表示不询问, 直接安装/不安装
     """
     try:
-        from importlib.metadata import distributions
-        required = {'requests', 'paramiko'}
-        installed = {dist.metadata['Name'] for dist in distributions()}
-        missing = required - installed
+        from importlib.util import find_spec
+        required = {'requests', *extra}
+        missing = sorted(pkg for pkg in required if find_spec(DEPENDENCIES.get(pkg, pkg)) is None)
 
         if missing:
             print("\n=== 检测到缺少必要依赖包 ===")
@@ -23,9 +30,13 @@ def install_dependencies():
             for pkg in missing:
                 print(f"- {pkg}")
             
-            response = input("\n是否现在安装? [Y/n]: ").lower() or 'y'
+            if assume_yes is None:
+                response = input("\n是否现在安装? [Y/n]: ").lower() or 'y'
+            else:
+                response = 'y' if assume_yes else 'n'
             if response == 'y':
                 print("\n正在安装依赖包...")
+                import subprocess
                 subprocess.check_call([sys.executable, '-m', 'pip', 'install', *missing])
                 print("依赖包安装完成！\n")
                 return True
@@ -56,403 +67,2930 @@ def extract_host_token(url):
     except Exception:
         return None, None
 
-class RouterHack:
-    def __init__(self, host, token):
+# 第3~5步的场景表: 每个场景通过 smartcontroller 注入, 以 root 身份执行一条命令
+#   id:      场景标识
+#   group:   所属步骤 (RouterHack 中对应的方法名)
+#   no:      显示用的步骤编号
+#   slot:    默认定时器槽位, 仅在无法读取路由器场景列表、不能分配空闲槽位时使用
+#   after:   触发前必须已生效的场景
+#   check:   可用于确认执行结果的检查项 (None 表示无法直接观测)
+#   checkpoint: 确认生效后是否写入检查点, 续跑时可以跳过
+#            (dropbear 进程在路由器重启后不会保留, 因此重启 dropbear 每次都要执行)
+SCENE_STEPS = [
+    {"id": "dropbear_unlock", "group": "unlock_dropbear", "no": 3, "name": "解锁dropbear配置",
+     "command": "sed -i s/release/XXXXXX/g /etc/init.d/dropbear", "slot": "3:1",
+     "after": [], "check": None, "checkpoint": True, "verify": "ssh_port"},
+    {"id": "ssh_en", "group": "activate_ssh", "no": 4, "name": "设置 ssh_en=1",
+     "command": "nvram set ssh_en=1", "slot": "3:2",
+     "after": [], "check": None, "checkpoint": True, "verify": "fac_info"},
+    {"id": "nvram_commit", "group": "activate_ssh", "no": 4, "name": "nvram commit",
+     "command": "nvram commit", "slot": "3:3",
+     "after": ["ssh_en"], "check": "fac_info", "checkpoint": True, "verify": "fac_info"},
+    {"id": "dropbear_enable", "group": "start_dropbear", "no": 5, "name": "启用 dropbear",
+     "command": "/etc/init.d/dropbear enable", "slot": "3:4",
+     "after": ["dropbear_unlock"], "check": None, "checkpoint": True, "verify": "ssh_port"},
+    {"id": "dropbear_restart", "group": "start_dropbear", "no": 5, "name": "重启 dropbear",
+     "command": "/etc/init.d/dropbear restart", "slot": "3:5",
+     "after": ["dropbear_enable", "nvram_commit"], "check": "ssh_port", "checkpoint": False, "verify": None},
+]
+
+def scene_name(command):
+    """
+    场景名称: smartcontroller 以 root 身份在 shell 中展开名称, 其中的命令因此被执行
+    """
+    return f"'$({command})'"
+
+def scene_payload(command, slot, action_delay=17):
+    """
+    构建在指定定时器槽位上执行 command 的 scene_setting 请求
+    :param action_delay: 场景中 wan_block 动作的 delay
+    """
+    return {
+        "command": "scene_setting",
+        "name": scene_name(command),
+        "action_list": [{
+            "thirdParty": "xmrouter",
+            "delay": action_delay,
+            "type": "wan_block",
+            "payload": {
+                "command": "wan_block",
+                "mac": "00:00:00:00:00:00"
+            }
+        }],
+        "launch": {
+            "timer": {
+                "time": slot,
+                "repeat": "0",
+                "enabled": True
+            }
+        }
+    }
+
+# 请求模板中代表定时器槽位的占位符
+SLOT_MARK = "@SLOT@"
+# 序列化后的 scene_setting 请求模板: (命令, action_delay) -> JSON
+_SCENE_TEMPLATES = {}
+TRIGGER_TEMPLATE = '{"command": "scene_start_by_crontab", "time": "%s", "week": 0}' % SLOT_MARK
+
+def scene_request(command, slot, action_delay=17):
+    """
+    返回序列化后的 scene_setting 请求, 与 json.dumps(scene_payload(...)) 相同
+    同一命令只序列化一次, 之后每次只替换其中的槽位
+    """
+    key = (command, action_delay)
+    template = _SCENE_TEMPLATES.get(key)
+    if template is None:
+        import json
+        template = _SCENE_TEMPLATES[key] = json.dumps(scene_payload(command, SLOT_MARK, action_delay))
+    return template.replace(SLOT_MARK, slot)
+
+def trigger_request(slot):
+    """
+    返回序列化后的 scene_start_by_crontab 请求
+    """
+    return TRIGGER_TEMPLATE.replace(SLOT_MARK, slot)
+
+# 注入场景可以使用的定时器槽位: 凌晨 3 点的每一分钟
+SCENE_SLOTS = [f"3:{minute}" for minute in range(1, 60)]
+
+def scene_time(scene):
+    """
+    返回 get_scene_setting 场景列表中一个场景的定时器槽位
+    """
+    return ((scene.get("launch") or {}).get("timer") or {}).get("time")
+
+def allocate_slots(scenes, count, seed=None):
+    """
+    从 SCENE_SLOTS 中挑选 count 个没有被现有场景占用的槽位
+    从随机位置开始连续挑选, 同一路由器上同时运行的两个实例不容易选中相同的槽位
+    :param scenes: get_scene_setting 返回的场景列表
+    :param seed: 随机数种子, 回放时使用录制的值
+    :return: 槽位列表; 空闲槽位不足时返回 None
+    """
+    import random
+    used = {scene_time(scene) for scene in scenes}
+    free = [slot for slot in SCENE_SLOTS if slot not in used]
+    if len(free) < count:
+        return None
+    start = random.Random(seed).randrange(len(free))
+    return (free[start:] + free[:start])[:count]
+
+def error_hint(result):
+    """
+    返回 smartcontroller 错误响应对应的说明文字(按行)
+    """
+    if result.get('code') == 3001:
+        return ["\n❌ stok 代币值已过期",
+                "请重新登录 Web 管理后台获取新的 stok 值"]
+    if result.get('code') == -101:
+        return ["\n❌ 连接到小米智能场景控制器服务 smartcontroller.service 失败",
+                "建议尝试以下操作：",
+                "1. 重启路由器",
+                "2. 恢复出厂设置"]
+    return [f"请求错误: {result.get('msg', '未知错误')}"]
+
+# 失败类别 -> 进程退出码 (无人值守模式使用)
+EXIT_CODES = {
+    "ok": 0,
+    "error": 1,           # 未归类的错误
+    "usage": 2,           # 参数错误
+    "dependency": 3,      # 缺少依赖包
+    "auth": 4,            # stok 无效/过期且无法登录
+    "unsupported": 5,     # 型号或 ROM 不支持开启 SSH
+    "smartcontroller": 6, # smartcontroller 服务不可用
+    "router": 7,          # 路由器返回其他错误码
+    "network": 8,         # 无法连接路由器
+    "not_ready": 9,       # 命令已下发但 SSH 端口未开放或无法完成握手
+    "ssh": 10,            # SSH 密码验证失败
+    "timeout": 11,        # 超出运行或单个步骤的时间预算 (--run-timeout / --step-timeout)
+}
+
+def failure_for_code(code):
+    """
+    路由器接口错误码对应的失败类别
+    """
+    if code == 3001:
+        return "auth"
+    if code == -101:
+        return "smartcontroller"
+    return "router"
+
+def classify_exception(e):
+    """
+    异常对应的失败类别
+    """
+    if isinstance(e, LoginError):
+        return "auth"
+    if isinstance(e, DeadlineExceeded):
+        return "timeout"
+    if isinstance(e, CircuitOpenError):
+        return "network" if e.kind == "timeout" else failure_for_code(e.kind)
+    if isinstance(e, (OSError, TimeoutError)):
+        return "network"
+    # requests/aiohttp 只在已导入时才可能抛出对应异常, 不为分类而导入
+    requests = sys.modules.get("requests")
+    if requests and isinstance(e, requests.RequestException):
+        return "network"
+    aiohttp = sys.modules.get("aiohttp")
+    if aiohttp and isinstance(e, aiohttp.ClientError):
+        return "network"
+    return "error"
+
+# 已知可以开启 SSH 的型号与 ROM 版本 (取自 README)
+# 键为 /api/xqsystem/init_info 返回的 hardware 字段
+COMPATIBILITY = {
+    "RA71": {"name": "小米万兆路由器", "roms": ["1.0.53"]},
+    "R2100": {"name": "小米路由器 AC2100", "roms": ["2.0.743"]},
+    "RM1800": {"name": "小米路由器 AX1800", "roms": ["1.0.399"]},
+    "RA80": {"name": "小米路由器 AX3000", "roms": ["1.0.48", "1.0.46"]},
+    "R3600": {"name": "小米 AIoT 物联路由器 AX3600", "roms": ["1.1.21"]},
+    "RA70": {"name": "小米路由器 AX9000", "roms": ["1.0.165"]},
+    "R2350": {"name": "小米 AIoT 物联路由器 AC2350", "roms": ["1.3.8"]},
+    "RB04": {"name": "红米路由器 AX5400 电竞版", "roms": ["1.0.95"]},
+    "RA81": {"name": "红米路由器 AX3000", "roms": ["1.0.33"]},
+    "RA67": {"name": "红米路由器 AX1800", "roms": []},
+}
+
+# 按型号/ROM 调整的执行参数
+#   settle_delay / ready_timeout: 见 RouterHack 的同名参数
+#   max_rate:     每台路由器的最高请求速率(次/秒)
+#   action_delay: 注入场景中 wan_block 动作的 delay
+#   skip:         该固件不需要执行的场景 (SCENE_STEPS 中的 id)
+# 未知型号与跳过兼容性预检时使用 DEFAULT_PROFILE
+DEFAULT_PROFILE = {"settle_delay": 0.5, "ready_timeout": 30, "commit_delay": 3, "max_rate": 50,
+                   "action_delay": 17, "skip": []}
+
+# 档位: fast 用于处理器较强、场景执行快的 AX 机型; safe 用于较早的 AC 机型, 放慢节奏避免 -101
+PROFILE_TIERS = {
+    "fast": {"settle_delay": 0.3, "ready_timeout": 20, "commit_delay": 2},
+    "safe": {"settle_delay": 1.0, "ready_timeout": 60, "commit_delay": 5, "max_rate": 10},
+}
+
+# nvram commit 完成 (commit_delay) 之后, fac_info 连续多少次明确返回 ssh 为 false 即判定 ROM 不支持
+SSH_REFUSED_POLLS = 2
+
+# 型号 -> {"tier": 档位, 其他参数..., "roms": {ROM 版本: 参数}}
+PROFILES = {
+    "RA71": {"tier": "fast"},
+    "R2100": {"tier": "safe"},
+    "RM1800": {"tier": "fast"},
+    "RA80": {"tier": "fast"},
+    "R3600": {"tier": "fast"},
+    "RA70": {"tier": "fast"},
+    "R2350": {"tier": "safe"},
+    "RB04": {"tier": "fast"},
+    "RA81": {"tier": "fast"},
+}
+
+def model_profile(hardware=None, rom=None, overrides=None):
+    """
+    合并得到一台路由器的执行参数, 优先级从低到高:
+    DEFAULT_PROFILE、档位、型号、型号下的 ROM、overrides 中的 "型号" 与 "型号/ROM"
+    :param overrides: load_profiles() 读取的自定义参数
+    :return: dict, name 为说明参数来源的名称
+    """
+    overrides = overrides or {}
+    entry = PROFILES.get(hardware, {})
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(PROFILE_TIERS.get(entry.get("tier"), {}))
+    profile.update({key: value for key, value in entry.items() if key not in ("tier", "roms")})
+    profile.update(entry.get("roms", {}).get(rom, {}))
+    profile.update(overrides.get(hardware, {}))
+    profile.update(overrides.get(f"{hardware}/{rom}", {}))
+    if hardware is None:
+        profile["name"] = "default"
+    else:
+        custom = hardware in overrides or f"{hardware}/{rom}" in overrides
+        profile["name"] = f"{hardware}/{rom} ({entry.get('tier', 'default')}{', 自定义' if custom else ''})"
+    return profile
+
+def load_profiles(path):
+    """
+    读取自定义的型号参数 (JSON): {"型号" 或 "型号/ROM": {参数名: 值}}
+    """
+    import json
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        profiles = json.load(f)
+    known = set(DEFAULT_PROFILE)
+    for key, values in profiles.items():
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"{path}: {key} 中有未知参数 {', '.join(sorted(unknown))}")
+    return profiles
+
+def default_cache_path(name):
+    """
+    本工具缓存文件的默认路径: $XDG_CACHE_HOME/xiaomi-router-ssh/<name>
+    """
+    import os
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "xiaomi-router-ssh", name)
+
+class JsonFileCache:
+    """
+    保存在 JSON 文件中的键值缓存, 多线程共用一个实例是安全的
+    """
+    # 缓存文件的权限, 保存敏感信息的子类可以收紧
+    file_mode = 0o644
+
+    def __init__(self, path):
+        import threading
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _load(self):
+        import json
+        if self._data is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def _save(self):
         """
-        初始化路由器操作类
-        :param host: 路由器IP地址
-        :param token: 路由器stok令牌
+        先写临时文件再替换, 避免进程中断时留下损坏的缓存 (调用方需持有锁)
         """
-        # 导入必要的模块
-        import requests
         import json
-        import time  # 在类中导入time模块
-        from datetime import datetime  # 添加 datetime 导入
-        
-        self.requests = requests
-        self.json = json
-        self.time = time  # 保存time模块引用
-        self.datetime = datetime  # 保存 datetime 引用
-        
-        self.host = host
-        self.token = token
-        self.base_url = f"http://{host}/cgi-bin/luci/;stok={token}"
+        import os
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, self.file_mode)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
 
-    def set_system_time(self):
+class CapabilityCache(JsonFileCache):
+    """
+    按 型号/ROM版本 缓存是否支持开启 SSH 的检测结果
+
+    "不支持" 的结论可能来自偶发的慢提交或网络问题, 需要至少 min_failures 次检测印证,
+    并且只在 negative_ttl 秒内有效; 成功的结论一直有效。
+    """
+    def __init__(self, path=None, negative_ttl=7 * 24 * 3600, min_failures=2):
+        super().__init__(path or default_cache_path("capabilities.json"))
+        self.negative_ttl = negative_ttl
+        self.min_failures = min_failures
+
+    def get(self, hardware, rom):
         """
-        第2步: 设置系统时间
+        :return: 可以作为结论的检测结果 dict; 没有记录, 或 "不支持" 的记录未经印证/已过期时返回 None
         """
+        with self._lock:
+            entry = self._load().get(f"{hardware}/{rom}")
+        if entry is None or entry["ssh"]:
+            return entry
+        if entry.get("failures", 1) < self.min_failures or self._expired(entry):
+            return None
+        return entry
+
+    def _expired(self, entry):
+        from datetime import datetime
         try:
-            # 获取当前时间并格式化
-            current_time = self.datetime.now()
-            formatted_time = current_time.strftime("%Y-%-m-%-d%%20%-H:%-M:%-S")  # 修改格式化方式，去掉前导零
-            
-            # 构建URL
-            url = f"{self.base_url}/api/misystem/set_sys_time?time={formatted_time}&timezone=CST-8"
-            
-            print("步骤 2.1: 发送系统时间设置请求...")
-            response = self.requests.get(url)
-            result = response.json()
-            print(f"响应数据: {self.json.dumps(result, ensure_ascii=False, separators=(',', ':'))}")
-            
-            if result.get('code') == 0:
-                print("操作成功")
-                self.time.sleep(3)
-                return True
-            else:
-                print(f"请求错误: {result.get('msg', '未知错误')}")
-                # print("❌ 检测到错误，终止操作")
-                return False
+            age = (datetime.now() - datetime.fromisoformat(entry["checked_at"])).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            return True
+        return age >= self.negative_ttl
 
-        except Exception as e:
-            print(f"❌ 发生错误: {str(e)}")
-            return False
+    def set(self, hardware, rom, ssh):
+        """
+        记录检测结果并立即写回文件; 连续的 "不支持" 结论累计次数, 一次成功即清零
+        """
+        from datetime import datetime
+        key = f"{hardware}/{rom}"
+        with self._lock:
+            data = self._load()
+            entry = {"ssh": ssh, "checked_at": datetime.now().isoformat(timespec="seconds")}
+            if not ssh:
+                previous = data.get(key)
+                counted = previous and not previous["ssh"] and not self._expired(previous)
+                failures = previous.get("failures", 1) if counted else 0
+                entry["failures"] = failures + 1
+            data[key] = entry
+            self._save()
 
-    def unlock_dropbear(self):
+class TokenCache(JsonFileCache):
+    """
+    按路由器缓存登录得到的 stok 及其过期时间
+
+    stok 等同于管理员登录状态, 缓存文件只有当前用户可读。
+    """
+    file_mode = 0o600
+
+    def __init__(self, path=None, ttl=1800):
         """
-        第3步: 解锁dropbear配置
-        
-        功能说明:
-        1. 通过注入漏洞在路由器上以 root 身份执行命令
-        2. 使用 sed 命令将 /etc/init.d/dropbear 中的所有 release 替换为 XXXXXX
-        3. 这个步骤是为了绕过系统对 dropbear 服务的限制
+        :param ttl: stok 的有效期(秒); 路由器提前使其失效时会返回 3001, 此时调用 invalidate()
         """
-        try:           
-            url = f"{self.base_url}/api/xqsmarthome/request_smartcontroller"
-
-            # 步骤 3.1: 发送解锁请求
-            print("步骤 3.1: 发送解锁请求...")
-            payload_data1 = {
-                "command": "scene_setting",
-                "name": "'$(sed -i s/release/XXXXXX/g /etc/init.d/dropbear)'",  # 使用 sed 替换命令
-                "action_list": [{
-                    "thirdParty": "xmrouter",
-                    "delay": 17,
-                    "type": "wan_block",
-                    "payload": {
-                        "command": "wan_block",
-                        "mac": "00:00:00:00:00:00"
-                    }
-                }],
-                "launch": {
-                    "timer": {
-                        "time": "3:1",
-                        "repeat": "0",
-                        "enabled": True
-                    }
-                }
-            }
-            
-            response1 = self.requests.post(url, data={"payload": self.json.dumps(payload_data1)})
-            result1 = response1.json()
-            print(f"响应数据: {self.json.dumps(result1, ensure_ascii=False, separators=(',', ':'))}")
-            
-            # 详细的错误判断
-            if result1.get('code') == 0:
-                print("操作成功")
-            elif result1.get('code') == 3001:
-                print("\n❌ stok 代币值已过期")
-                print("请重新登录 Web 管理后台获取新的 stok 值")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            elif result1.get('code') == -101:
-                print("\n❌ 连接到小米智能场景控制器服务 smartcontroller.service 失败")
-                print("建议尝试以下操作：")
-                print("1. 重启路由器")
-                print("2. 恢复出厂设置")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            else:
-                print(f"请求错误: {result1.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
-            
-            # 步骤 3.2: 启动场景
-            print("步骤 3.2: 启动场景...")
-            payload_data2 = {
-                "command": "scene_start_by_crontab",
-                "time": "3:1",
-                "week": 0
-            }
-            
-            response2 = self.requests.post(url, data={"payload": self.json.dumps(payload_data2)})
-            result2 = response2.json()
-            print(f"响应数据: {self.json.dumps(result2, ensure_ascii=False, separators=(',', ':'))}")
-            if result2.get('code') == 0:
-                print("操作成功")
-            else:
-                print(f"请求错误: {result2.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
-            
-            # 最终结果判断
-            print()
-            print("##解锁dropbear配置 操作全部完成")
-            return True
+        super().__init__(path or default_cache_path("tokens.json"))
+        self.ttl = ttl
 
-        except Exception as e:
-            print(f"\n❌ 发生错误: {str(e)}")
-            return False
+    def get(self, host):
+        """
+        :return: 未过期的 stok, 没有时返回 None
+        """
+        import time
+        with self._lock:
+            entry = self._load().get(host)
+        if entry and entry["expires_at"] > time.time():
+            return entry["token"]
+        return None
 
-    def activate_ssh(self):
+    def set(self, host, token):
+        import time
+        now = time.time()
+        with self._lock:
+            self._load()[host] = {"token": token, "obtained_at": now, "expires_at": now + self.ttl}
+            self._save()
+
+    def invalidate(self, host):
+        with self._lock:
+            if self._load().pop(host, None) is not None:
+                self._save()
+
+class LoginError(Exception):
+    """
+    登录路由器 Web 管理后台失败
+    """
+
+# 可恢复的失败 -> 最多重试次数
+# 未列出的错误码 (以及 fac_info 中 ssh 为 false 之类的确定性结果) 不重试, 直接失败;
+# stok 过期 (3001) 由 _request 重新登录处理
+RETRY_POLICY = {
+    -101: 3,        # smartcontroller 繁忙, 场景触发后短时间内常见
+    "timeout": 2,   # 请求超时或连接被重置
+}
+
+def retry_delay(attempt, base=0.5, cap=8.0):
+    """
+    第 attempt 次重试前的等待时间(秒)
+    指数退避, 并在后一半区间内随机抖动, 避免大量路由器同时重试
+    """
+    import random
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class Pacer:
+    """
+    按 AIMD 调整向一台路由器发送请求的速率
+
+    响应正常时速率约每秒增加 increase (次/秒), 出现拥塞信号时降为最近 1 秒实际发送速率的
+    decrease 倍。拥塞信号:
+    smartcontroller 繁忙 (-101)、请求超时、某接口延迟明显高于该接口的历史最低延迟,
+    以及 (启用 load_interval 时) status 接口报告的 CPU 负载超过 high_load。
+    空闲的路由器一直保持 max_rate, 不会额外等待; 繁忙的路由器自动放慢。
+    """
+    def __init__(self, max_rate=50.0, min_rate=0.5, increase=0.5, decrease=0.5,
+                 slow_factor=3.0, slow_margin=0.2, load_interval=None, high_load=0.8):
         """
-        第4步: 使用 nvram 激活 ssh_en 配置项
+        :param max_rate: 最高请求速率(次/秒), 也是初始速率
+        :param min_rate: 最低请求速率(次/秒)
+        :param slow_factor: 延迟超过该接口历史最低延迟的多少倍视为拥塞
+        :param slow_margin: 同时还要比历史最低延迟高出的秒数, 避免局域网内的正常抖动被当作拥塞
+        :param load_interval: 读取路由器负载的间隔(秒), None 表示不读取
+        :param high_load: 视为拥塞的 CPU 负载 (0~1)
         """
-        try:
-            url = f"{self.base_url}/api/xqsmarthome/request_smartcontroller"
-
-            # 步骤 4.1: 设置 ssh_en=1
-            print("步骤 4.1: 设置 ssh_en=1...")
-            payload_data1 = {
-                "command": "scene_setting",
-                "name": "'$(nvram set ssh_en=1)'",
-                "action_list": [{
-                    "thirdParty": "xmrouter",
-                    "delay": 17,
-                    "type": "wan_block",
-                    "payload": {
-                        "command": "wan_block",
-                        "mac": "00:00:00:00:00:00"
-                    }
-                }],
-                "launch": {
-                    "timer": {
-                        "time": "3:2",
-                        "repeat": "0",
-                        "enabled": True
-                    }
-                }
-            }
-            
-            response1 = self.requests.post(url, data={"payload": self.json.dumps(payload_data1)})
-            result1 = response1.json()
-            print(f"响应数据: {self.json.dumps(result1, ensure_ascii=False, separators=(',', ':'))}")
-            if result1.get('code') == 0:
-                print("操作成功")
-            else:
-                print(f"请求错误: {result1.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
-            
-            # 步骤 4.2: 启动第一个场景
-            print("步骤 4.2: 启动场景...")
-            payload_data2 = {
-                "command": "scene_start_by_crontab",
-                "time": "3:2",
-                "week": 0
-            }
-            response2 = self.requests.post(url, data={"payload": self.json.dumps(payload_data2)})
-            result2 = response2.json()
-            print(f"响应数据: {self.json.dumps(result2, ensure_ascii=False, separators=(',', ':'))}")
-            if result2.get('code') == 0:
-                print("操作成功")
-            else:
-                print(f"请求错误: {result2.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
-
-            # 步骤 4.3: 执行 nvram commit
-            print("步骤 4.3: 执行 nvram commit...")
-            payload_data3 = {
-                "command": "scene_setting",
-                "name": "'$(nvram commit)'",
-                "action_list": [{
-                    "thirdParty": "xmrouter",
-                    "delay": 17,
-                    "type": "wan_block",
-                    "payload": {
-                        "command": "wan_block",
-                        "mac": "00:00:00:00:00:00"
-                    }
-                }],
-                "launch": {
-                    "timer": {
-                        "time": "3:3",
-                        "repeat": "0",
-                        "enabled": True
-                    }
-                }
-            }
-            response3 = self.requests.post(url, data={"payload": self.json.dumps(payload_data3)})
-            result3 = response3.json()
-            print(f"响应数据: {self.json.dumps(result3, ensure_ascii=False, separators=(',', ':'))}")
-            if result3.get('code') == 0:
-                print("操作成功")
-            else:
-                print(f"请求错误: {result3.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
-
-            # 步骤 4.4: 启动第二个场景
-            print("步骤 4.4: 启动第二个场景...")
-            payload_data4 = {
-                "command": "scene_start_by_crontab",
-                "time": "3:3",
-                "week": 0
-            }
-            response4 = self.requests.post(url, data={"payload": self.json.dumps(payload_data4)})
-            result4 = response4.json()
-            print(f"响应数据: {self.json.dumps(result4, ensure_ascii=False, separators=(',', ':'))}")
-            if result4.get('code') == 0:
-                print("操作成功")
-            else:
-                print(f"请求错误: {result4.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
-
-            # 步骤 4.5: 检查SSH支持
-            print("步骤 4.5: 检查路由器SSH支持...")
-            check_url = f"{self.base_url}/api/xqsystem/fac_info"
-            response = self.requests.get(check_url)
-            result = response.json()
-            print(f"响应数据: {self.json.dumps(result, ensure_ascii=False, separators=(',', ':'))}")
-
-            # 检查响应中的 ssh 值
-            if result.get('ssh') == True:  # 明确检查 ssh 值是否为 True
-                print("✓  恭喜，检测到路由器支持开启SSH功能")
-                self.time.sleep(5)
-                print("\n##使用 nvram 激活 ssh_en 配置项 操作全部完成")
-                return True
-            else:
-                print("\n❌ 太可惜了，此路由器当前ROM不支持开启SSH")
-                print("检测到 ssh 值为 false")
-                print("建议更新路由器固件后重试")
-                print("\n❌ 检测到错误，终止操作")
-                return False
+        import collections
+        import time
+        self.time = time
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.slow_factor = slow_factor
+        self.slow_margin = slow_margin
+        self.load_interval = load_interval
+        self.high_load = high_load
+        self.rate = max_rate
+        # 最近 1 秒内的发送时间: 顺序执行的流程往往达不到 rate, 拥塞时以实际速率为基准减速
+        self._sent = collections.deque()
+        self.latency = {}  # 接口 -> {"ewma": 平滑后的延迟, "best": 最低延迟}
+        self.load = None
+        self._load_at = None
+        self._next = 0.0
 
-        except Exception as e:
-            print(f"\n❌ 发生错误: {str(e)}")
+    def reserve(self):
+        """
+        预留下一次请求的发送时间
+        :return: 需要等待的秒数
+        """
+        now = self.time.monotonic()
+        at = max(now, self._next)
+        self._next = at + 1 / self.rate
+        self._sent.append(at)
+        while self._sent and at - self._sent[0] > 1:
+            self._sent.popleft()
+        return at - now
+
+    def observe(self, endpoint, seconds, congested=False):
+        """
+        记录一次响应的延迟; congested 为真时视为拥塞
+        """
+        stats = self.latency.get(endpoint)
+        if stats is None:
+            stats = self.latency[endpoint] = {"ewma": seconds, "best": seconds}
+        stats["ewma"] = 0.8 * stats["ewma"] + 0.2 * seconds
+        stats["best"] = min(stats["best"], seconds)
+        if congested or seconds > max(stats["best"] * self.slow_factor, stats["best"] + self.slow_margin):
+            self.congested()
+        else:
+            # 与 TCP 拥塞避免相同, 每个响应增加 increase / rate, 约每秒增加 increase
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def congested(self):
+        actual = max(len(self._sent), 1)
+        self.rate = max(self.min_rate, min(self.rate, actual) * self.decrease)
+
+    def load_due(self):
+        """
+        是否应该重新读取路由器负载
+        """
+        return self.load_interval is not None and (
+            self._load_at is None or self.time.monotonic() - self._load_at >= self.load_interval)
+
+    def observe_load(self, load):
+        """
+        记录 status 接口报告的 CPU 负载; load 为 None 表示读取失败
+        """
+        self._load_at = self.time.monotonic()
+        self.load = load
+        if load is not None and load >= self.high_load:
+            self.congested()
+
+def cpu_load(status):
+    """
+    从 /api/misystem/status 的响应中取出 CPU 负载 (0~1), 取不到时返回 None
+    """
+    try:
+        return float(status["cpu"]["load"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class CircuitOpenError(Exception):
+    """
+    路由器连续失败, 熔断期间不再发送请求
+    """
+    def __init__(self, host, kind):
+        super().__init__(f"{host} 连续失败, 已暂停向其发送请求 (最后一次失败: {kind})")
+        self.host = host
+        self.kind = kind
+
+class CircuitBreaker:
+    """
+    按路由器统计可恢复失败 (见 RETRY_POLICY) 的连续次数
+
+    达到 threshold 次后熔断 cooldown 秒, 期间对该路由器的请求直接失败, 不再占用工作线程;
+    冷却结束后放行一次试探请求, 成功则恢复, 失败则重新熔断。可在多个线程之间共享。
+    """
+    def __init__(self, threshold=5, cooldown=30):
+        import threading
+        import time
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.time = time
+        self._lock = threading.Lock()
+        self._hosts = {}  # host -> {"failures", "opened_at", "kind"}
+
+    def allow(self, host):
+        """
+        是否可以向 host 发送请求
+        """
+        with self._lock:
+            return self._allow(host)
+
+    def _allow(self, host):
+        # 调用方需持有 self._lock
+        state = self._hosts.get(host)
+        if state is None or state["opened_at"] is None:
+            return True
+        if self.time.monotonic() - state["opened_at"] < self.cooldown:
             return False
+        # 半开: 放行一次试探, 再失败一次就重新熔断
+        state["opened_at"] = None
+        state["failures"] = self.threshold - 1
+        return True
+
+    def check(self, host):
+        """
+        熔断中时抛出 CircuitOpenError
+        """
+        with self._lock:
+            if self._allow(host):
+                return
+            # 与判断在同一把锁内读取, 避免其他线程 success() 后 KeyError
+            kind = self._hosts.get(host, {}).get("kind")
+        raise CircuitOpenError(host, kind)
+
+    def success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failure(self, host, kind):
+        with self._lock:
+            state = self._hosts.setdefault(host, {"failures": 0, "opened_at": None, "kind": None})
+            state["failures"] += 1
+            state["kind"] = kind
+            if state["failures"] >= self.threshold:
+                state["opened_at"] = self.time.monotonic()
+
+class DeadlineExceeded(Exception):
+    """
+    超出运行或单个步骤的时间预算, 配置流程被取消
+    """
+    def __init__(self, scope):
+        super().__init__("本次运行超出时间预算" if scope == "run" else "当前步骤超出时间预算")
+        self.scope = scope
+
+# 超出时间预算后, 留给重置路由器时间与清理场景的时间(秒)
+DEADLINE_GRACE = 15
+
+class Deadline:
+    """
+    一次运行的时间预算: 整体截止时间与当前步骤的截止时间, 以较早者为准
+
+    RouterHack 的每个 HTTP 请求、SSH 连接与等待都按剩余时间收紧超时;
+    预算用尽时抛出 DeadlineExceeded, 由所在步骤按失败处理, 不强行中断线程
+    """
+    def __init__(self, run_timeout=None, step_timeout=None, clock=None):
+        import time
+        self.time = clock or time
+        self.run_timeout = run_timeout
+        self.step_timeout = step_timeout
+        self._run_at = None if run_timeout is None else self.time.monotonic() + run_timeout
+        self._step_at = None
+
+    def start_step(self):
+        """
+        开始一个新步骤, 重新计算步骤的截止时间
+        """
+        self._step_at = None if self.step_timeout is None else self.time.monotonic() + self.step_timeout
+
+    def grace(self, seconds=DEADLINE_GRACE):
+        """
+        预算用尽后, 再给收尾操作 seconds 秒
+        """
+        self._run_at = self.time.monotonic() + seconds
+        self._step_at = None
+
+    def _nearest(self):
+        limits = [(at, scope) for at, scope in ((self._run_at, "run"), (self._step_at, "step")) if at is not None]
+        return min(limits) if limits else None
+
+    def remaining(self):
+        """
+        剩余的时间(秒), 不限时返回 None
+        """
+        nearest = self._nearest()
+        return None if nearest is None else nearest[0] - self.time.monotonic()
+
+    def check(self):
+        """
+        预算已用尽时抛出 DeadlineExceeded
+        """
+        nearest = self._nearest()
+        if nearest is not None and nearest[0] <= self.time.monotonic():
+            raise DeadlineExceeded(nearest[1])
+
+    def clamp(self, timeout):
+        """
+        把超时时间收紧到剩余预算以内
+        :param timeout: 秒数, 或 requests 的 (connect, read)
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        self.check()
+        if isinstance(timeout, tuple):
+            return tuple(min(value, remaining) for value in timeout)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def sleep(self, seconds):
+        """
+        等待 seconds 秒; 预算不足时等到截止时间后抛出 DeadlineExceeded
+        """
+        nearest = self._nearest()
+        if nearest is not None and self.time.monotonic() + seconds >= nearest[0]:
+            self.time.sleep(max(nearest[0] - self.time.monotonic(), 0))
+            raise DeadlineExceeded(nearest[1])
+        self.time.sleep(seconds)
+
+    async def sleep_async(self, seconds):
+        """
+        sleep 的 asyncio 版本
+        """
+        import asyncio
+        nearest = self._nearest()
+        if nearest is not None and self.time.monotonic() + seconds >= nearest[0]:
+            await asyncio.sleep(max(nearest[0] - self.time.monotonic(), 0))
+            raise DeadlineExceeded(nearest[1])
+        await asyncio.sleep(seconds)
+
+def login_form(page, password, username="admin"):
+    """
+    根据登录页 /cgi-bin/luci/web 中的加密参数生成登录表单
+    算法与 Web 管理后台的 JS 相同: hash(nonce + hash(password + key)),
+    新版固件 (newEncryptMode) 使用 SHA-256, 旧版使用 SHA-1
+    """
+    import hashlib
+    import random
+    import re
+    import time
+
+    key = re.search(r"key:\s*'([^']*)'", page)
+    device_id = re.search(r"deviceId\s*=\s*'([^']*)'", page)
+    if not key:
+        raise LoginError("登录页中没有找到加密参数")
+    new_mode = re.search(r"newEncryptMode\W+1", page) is not None
+    digest = hashlib.sha256 if new_mode else hashlib.sha1
+
+    nonce = f"0_{device_id.group(1) if device_id else ''}_{int(time.time())}_{random.randint(0, 9999)}"
+    hashed = digest((password + key.group(1)).encode()).hexdigest()
+    return {
+        "username": username,
+        "password": digest((nonce + hashed).encode()).hexdigest(),
+        "logtype": "2",
+        "nonce": nonce,
+    }
+
+def compatibility_verdict(fingerprint, cache=None):
+    """
+    根据路由器指纹判断是否支持开启 SSH
+    :param fingerprint: {"hardware", "rom", "ssh"}, ssh 为当前 fac_info 中的值(可为空)
+    :return: (结论, 说明); 结论为 supported / unsupported / untested / unknown
+    """
+    hardware, rom = fingerprint.get("hardware"), fingerprint.get("rom")
+    known = COMPATIBILITY.get(hardware)
+    name = known["name"] if known else hardware
+    if fingerprint.get("ssh") == True:
+        return "supported", f"{name} 已开启 ssh_en"
+
+    # 内置列表中已验证的版本优先于本地缓存, 避免一次误判的缓存长期拦截
+    if known is not None and rom in known["roms"]:
+        return "supported", f"{name} ROM {rom} 已验证可以开启 SSH"
+
+    cached = cache.get(hardware, rom) if cache else None
+    if cached is not None:
+        if cached["ssh"]:
+            return "supported", f"{name} ROM {rom} 曾成功开启 SSH ({cached['checked_at']})"
+        return "unsupported", (f"{name} ROM {rom} 曾 {cached.get('failures', 1)} 次检测到不支持开启 SSH "
+                               f"({cached['checked_at']})")
+
+    if known is None:
+        return "unknown", f"未收录的型号 {hardware}, ROM {rom}, 可以尝试开启"
+    verified = " / ".join(known["roms"]) or "无"
+    return "untested", f"{name} ROM {rom} 未经验证 (已验证版本: {verified})"
+
+class CheckpointStore:
+    """
+    基于 SQLite 的步骤检查点, 记录每台路由器已经确认生效的场景
+
+    多线程共用一个实例是安全的。
+    """
+    def __init__(self, path=None):
+        import os
+        import sqlite3
+        import threading
+        path = path or default_cache_path("checkpoints.db")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " host TEXT NOT NULL,"
+            " step TEXT NOT NULL,"
+            " completed_at TEXT NOT NULL,"
+            " PRIMARY KEY (host, step))")
+
+    def completed(self, host):
+        """
+        :return: 该路由器已完成的场景 id 集合
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT step FROM checkpoints WHERE host = ?", (host,))
+            return {row[0] for row in rows}
+
+    def mark(self, host, step):
+        from datetime import datetime
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (host, step, completed_at) VALUES (?, ?, ?)",
+                (host, step, datetime.now().isoformat(timespec="seconds")))
+
+    def clear(self, host):
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE host = ?", (host,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def router_fingerprint(info):
+    """
+    从 init_info 的响应中提取路由器指纹
+    id 为路由器 ID (routerId, 旧固件为序列号 id), 用作检查点的键
+    """
+    return {"hardware": info.get("hardware"), "rom": info.get("romversion"), "model": info.get("model"),
+            "id": info.get("routerId") or info.get("id"), "ssh": None}
+
+def resumed_scenes(done, verified):
+    """
+    按检查点构建初始场景状态
+    :param done: 检查点中已完成的场景 id
+    :param verified: 当前在路由器上仍然成立的复核项 (SCENE_STEPS 中的 verify) 集合;
+                     重启会还原 /etc, 检查点中的步骤只有复核通过才跳过
+    :return: 可以跳过的场景状态 dict
+    """
+    return {step["id"]: {"registered_at": 0, "confirmed": True, "resumed": True}
+            for step in SCENE_STEPS
+            if step["checkpoint"] and step["id"] in done and step["verify"] in verified}
+
+class Tracer:
+    """
+    记录步骤、HTTP 请求与等待的耗时区间 (span)
+
+    可导出为 JSON Lines (每行一个 span) 或 Chrome trace-event 格式,
+    后者可直接在 https://ui.perfetto.dev 或 chrome://tracing 中打开, 每台路由器显示为一行。
+    """
+    def __init__(self):
+        import threading
+        import time
+        self.time = time
+        self.spans = []
+        self._lock = threading.Lock()
+        # perf_counter 精度高但没有绝对时间, 记录两者的差值用于换算
+        self._epoch = time.time() - time.perf_counter()
+
+    def span(self, name, cat, host=None, **args):
+        """
+        返回一个上下文管理器, 退出时记录 span
+        with 语句得到 args 字典, 可在其中补充响应码、字节数等信息
+        """
+        return _Span(self, name, cat, host, args)
+
+    def record(self, name, cat, host, start, end, args):
+        span = {
+            "name": name,
+            "cat": cat,
+            "host": host,
+            "start": round(self._epoch + start, 6),
+            "end": round(self._epoch + end, 6),
+            "duration_ms": round((end - start) * 1000, 3),
+            "args": args,
+        }
+        with self._lock:
+            self.spans.append(span)
+
+    def write_jsonl(self, path):
+        import json
+        with open(path, "w", encoding="utf-8") as f:
+            for span in self.spans:
+                f.write(json.dumps(span, ensure_ascii=False) + "\n")
+
+    def write_chrome(self, path):
+        """
+        导出 Chrome trace-event 格式, 每台路由器对应一个 tid
+        """
+        import json
+        tids = {}
+        events = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0,
+                   "args": {"name": "XiaoMi Router SSH Tool"}}]
+        for span in sorted(self.spans, key=lambda s: s["start"]):
+            tid = tids.setdefault(span["host"] or "-", len(tids) + 1)
+            events.append({
+                "name": span["name"],
+                "cat": span["cat"],
+                "ph": "X",
+                "ts": round(span["start"] * 1e6, 1),
+                "dur": round(span["duration_ms"] * 1e3, 1),
+                "pid": 1,
+                "tid": tid,
+                "args": span["args"],
+            })
+        for host, tid in tids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                           "args": {"name": host}})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+class _Span:
+    def __init__(self, tracer, name, cat, host, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.host = host
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.tracer.time.perf_counter()
+        return self.args
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args.setdefault("error", exc_type.__name__)
+        self.tracer.record(self.name, self.cat, self.host, self.start,
+                           self.tracer.time.perf_counter(), self.args)
+        return False
+
+class _NoSpan:
+    """
+    未启用追踪时使用的空 span
+    """
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+def trace_span(tracer, name, cat, host=None, **args):
+    """
+    tracer 为空时返回空 span, 便于在调用处统一使用 with 语句
+    """
+    if tracer is None:
+        return _NoSpan()
+    return tracer.span(name, cat, host, **args)
+
+# 导出的指标: 名称 -> (类型, 说明)
+METRICS = {
+    "miwifi_runs": ("counter", "按结果 (EXIT_CODES 中的失败原因) 统计的配置运行次数"),
+    "miwifi_run_duration_seconds": ("histogram", "单台路由器完整配置流程的耗时"),
+    "miwifi_step_duration_seconds": ("histogram", "RouterHack 各步骤的耗时"),
+    "miwifi_request_duration_seconds": ("histogram", "各接口 HTTP 请求的耗时"),
+    "miwifi_request_errors": ("counter", "各接口请求超时或无法连接的次数"),
+    "miwifi_smartcontroller_responses": ("counter", "smartcontroller 响应码计数 (0、3001、-101, 其余计为 other)"),
+    "miwifi_watch_recoveries": ("counter", "看门狗发现 SSH 失效后的恢复次数, 按结果统计"),
+    "miwifi_recovery_seconds": ("histogram", "看门狗从发现 SSH 失效到恢复完成的耗时"),
+}
+
+def metric_endpoint(endpoint):
+    """
+    指标中使用的接口路径: 去掉协议、地址与 /cgi-bin/luci 前缀, 不同路由器的同一接口合并统计
+    """
+    from urllib.parse import urlsplit
+    if "://" in endpoint:
+        endpoint = urlsplit(endpoint).path
+    prefix = "/cgi-bin/luci"
+    return endpoint[len(prefix):] if endpoint.startswith(prefix) else endpoint
+
+class Metrics:
+    """
+    配置运行的统计指标, 导出为 Prometheus 文本格式或 OpenMetrics 格式
+
+    每个线程只写自己的分片, 分片的锁只有导出时才会有竞争; 导出时再合并全部分片。
+    可通过 serve() 提供 HTTP 抓取接口, 或用 write() 写入 node_exporter 的 textfile 目录。
+    """
+    # 直方图的桶上限(秒)
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        import threading
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+
+    def _shard(self):
+        """
+        当前线程的分片: (计数器, 直方图, 锁); 只有线程第一次记录时需要加锁登记
+        """
+        import threading
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = ({}, {}, threading.Lock())
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name, labels=(), value=1):
+        counters, _, lock = self._shard()
+        key = (name, labels)
+        with lock:
+            counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels=()):
+        import bisect
+        _, histograms, lock = self._shard()
+        key = (name, labels)
+        with lock:
+            entry = histograms.get(key)
+            if entry is None:
+                # [各桶的计数 (最后一个为 +Inf), 总和]
+                entry = histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(self.buckets, seconds)] += 1
+            entry[1] += seconds
+
+    def response(self, method, endpoint, seconds, code=None):
+        """
+        记录一次 HTTP 响应; code 为响应 JSON 中的 code
+        """
+        endpoint = metric_endpoint(endpoint)
+        self.observe("miwifi_request_duration_seconds", seconds,
+                     (("endpoint", endpoint), ("method", method)))
+        if endpoint.endswith("/request_smartcontroller"):
+            label = str(code) if code in (0, 3001, -101) else "other"
+            self.inc("miwifi_smartcontroller_responses", (("code", label),))
+
+    def request_error(self, method, endpoint):
+        self.inc("miwifi_request_errors", (("endpoint", metric_endpoint(endpoint)), ("method", method)))
+
+    def step(self, name, seconds, hardware=None):
+        self.observe("miwifi_step_duration_seconds", seconds,
+                     (("hardware", hardware or "unknown"), ("step", name)))
+
+    def run(self, result, hardware=None):
+        """
+        记录一台路由器的配置结果 (provision_host 的返回值)
+        """
+        self.inc("miwifi_runs", (("hardware", hardware or "unknown"), ("outcome", result["failure"] or "ok")))
+        self.observe("miwifi_run_duration_seconds", result["seconds"])
+
+    def recovery(self, result, seconds):
+        """
+        记录看门狗的一次恢复; seconds 为从发现 SSH 失效到恢复完成的耗时
+        """
+        self.inc("miwifi_watch_recoveries", (("outcome", result["failure"] or "ok"),))
+        if result["ok"]:
+            self.observe("miwifi_recovery_seconds", seconds)
+
+    def _merged(self):
+        with self._lock:
+            shards = list(self._shards)
+        counters, histograms = {}, {}
+        for shard_counters, shard_histograms, lock in shards:
+            # 持有分片的锁复制快照, 合并时不再阻塞写入的线程
+            with lock:
+                items = list(shard_counters.items())
+                entries = [(key, list(value[0]), value[1]) for key, value in shard_histograms.items()]
+            for key, value in items:
+                counters[key] = counters.get(key, 0) + value
+            for key, counts, total in entries:
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+        return counters, histograms
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+    def render(self, openmetrics=False):
+        """
+        :param openmetrics: True 时输出 OpenMetrics 格式, 否则输出 Prometheus 文本格式
+        """
+        counters, histograms = self._merged()
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            family = name if openmetrics or kind != "counter" else f"{name}_total"
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}_total{self._labels(labels)} {value}")
+                continue
+            for (metric, labels), (counts, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {round(total, 6)}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        写入 textfile (Prometheus 文本格式); 先写临时文件再替换, 避免被读到一半的内容
+        """
+        import os
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def serve(self, port, host=""):
+        """
+        在后台线程中提供 /metrics 抓取接口, 按 Accept 头选择 OpenMetrics 或 Prometheus 文本格式
+        :return: HTTP 服务实例, 调用 shutdown() 停止
+        """
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = metrics.render(openmetrics).encode("utf-8")
+                content_type = ("application/openmetrics-text; version=1.0.0" if openmetrics
+                                else "text/plain; version=0.0.4")
+                self.send_response(200)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+# 录制时替换为占位符的字段: 敏感信息, 以及每次运行都不同、不能用于匹配请求的值
+REDACTED_FIELDS = ("password", "nonce", "time")
+
+def redact_text(text):
+    """
+    将文本中的 stok 与登录接口返回的 token 替换为占位符
+    """
+    import re
+    text = re.sub(r";stok=[^/?&\"'\s]*", ";stok=<stok>", text)
+    return re.sub(r'("token"\s*:\s*")[^"]*"', r'\1<stok>"', text)
+
+def redact_fields(encoded):
+    """
+    解析 query string 或表单内容, 替换 REDACTED_FIELDS 中的字段
+    :return: dict
+    """
+    from urllib.parse import parse_qsl
+    if isinstance(encoded, bytes):
+        encoded = encoded.decode("utf-8", "replace")
+    return {key: "<redacted>" if key in REDACTED_FIELDS else redact_text(value)
+            for key, value in parse_qsl(encoded or "", keep_blank_values=True)}
+
+class VirtualClock:
+    """
+    回放时代替 time 模块: sleep 只推进虚拟时间, 等待与重试不再真正耗时
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+class Cassette:
+    """
+    一台路由器一次运行的 HTTP 会话记录, 用于离线回放
+
+    录制时通过 requests 适配器保存每个请求与响应, stok 与登录表单中的密码等字段替换为占位符;
+    SSH 端口探测、握手等非 HTTP 的结果以 probe 的形式一并保存。
+    回放时按 (方法, 路径, 参数) 依次返回录制的响应; 同一请求重复出现 (轮询) 时按录制顺序返回,
+    用完后重复最后一个。
+
+    文件为 JSON Lines: 第一行是录制信息 (meta), 其后每行一条记录; 文件名以 .gz 结尾时压缩保存。
+    """
+    version = 1
+
+    def __init__(self, path=None, replaying=False):
+        self.path = path
+        self.replaying = replaying
+        self.meta = {}
+        self.interactions = []
+        self._queues = None
+
+    @classmethod
+    def load(cls, path):
+        import gzip
+        import json
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        cassette = cls(path, replaying=True)
+        cassette.meta = lines[0] if lines else {}
+        cassette.interactions = lines[1:]
+        return cassette
+
+    def save(self):
+        import gzip
+        import json
+        import os
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "wt", encoding="utf-8") as f:
+            for item in [dict(self.meta, version=self.version)] + self.interactions:
+                f.write(json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    @staticmethod
+    def _key(item):
+        import json
+        if "probe" in item:
+            return json.dumps(["probe", item["probe"]])
+        return json.dumps([item["method"], item["path"], item["query"], item["form"]], sort_keys=True)
+
+    @staticmethod
+    def _describe(request):
+        """
+        将 PreparedRequest 转换为去除了敏感字段的记录
+        """
+        from urllib.parse import urlsplit
+        url = urlsplit(request.url)
+        return {
+            "method": request.method,
+            "path": redact_text(url.path),
+            "query": redact_fields(url.query),
+            "form": redact_fields(request.body) if request.body else {},
+        }
+
+    def _next(self, item):
+        """
+        回放: 返回与 item 匹配的下一条记录, 没有录制过时返回 None
+        """
+        if self._queues is None:
+            self._queues = {}
+            for recorded in self.interactions:
+                self._queues.setdefault(self._key(recorded), []).append(recorded)
+        queue = self._queues.get(self._key(item))
+        if not queue:
+            return None
+        return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    def record(self, request, response=None, error=None):
+        item = self._describe(request)
+        if error is not None:
+            item["error"] = type(error).__name__
+        else:
+            item["status"] = response.status_code
+            item["body"] = redact_text(response.content.decode("utf-8", "replace"))
+        self.interactions.append(item)
+
+    def probe(self, name, check):
+        """
+        包装非 HTTP 的探测函数: 录制时保存返回值, 回放时直接返回录制的值
+        """
+        import functools
+
+        @functools.wraps(check)
+        def probed():
+            if self.replaying:
+                recorded = self._next({"probe": name}) or {}
+                if "error" in recorded:
+                    raise OSError(recorded["error"])
+                return recorded.get("result")
+            try:
+                result = check()
+            except Exception as e:
+                self.interactions.append({"probe": name, "error": str(e)})
+                raise
+            self.interactions.append({"probe": name, "result": result})
+            return result
+        return probed
+
+    def adapter(self, **pool_options):
+        """
+        返回挂载到 requests.Session 上的适配器: 录制时转发并保存, 回放时只读记录
+        """
+        import requests
+        from datetime import timedelta
+        from requests.adapters import BaseAdapter, HTTPAdapter
+        from requests.structures import CaseInsensitiveDict
+        cassette = self
+
+        class RecordingAdapter(HTTPAdapter):
+            def send(self, request, **kwargs):
+                try:
+                    response = super().send(request, **kwargs)
+                except requests.RequestException as e:
+                    cassette.record(request, error=e)
+                    raise
+                cassette.record(request, response)
+                return response
+
+        class ReplayAdapter(BaseAdapter):
+            def send(self, request, **kwargs):
+                item = cassette._describe(request)
+                recorded = cassette._next(item)
+                if recorded is None:
+                    raise requests.ConnectionError(
+                        f"回放记录中没有该请求: {item['method']} {item['path']}", request=request)
+                if "error" in recorded:
+                    error = getattr(requests.exceptions, recorded["error"], requests.ConnectionError)
+                    raise error(f"录制时该请求失败: {recorded['error']}", request=request)
+                response = requests.Response()
+                response.status_code = recorded["status"]
+                response._content = recorded["body"].encode("utf-8")
+                response.encoding = "utf-8"
+                response.headers = CaseInsensitiveDict()
+                response.url = request.url
+                response.request = request
+                response.elapsed = timedelta(0)
+                return response
+
+            def close(self):
+                pass
+
+        if self.replaying:
+            return ReplayAdapter()
+        return RecordingAdapter(**pool_options)
+
+    def finish(self, router, batch, result):
+        """
+        录制结束: 保存回放所需的运行参数与本次结果
+        """
+        from datetime import datetime
+        logged_in = any(item.get("path", "").endswith("/api/xqsystem/login") for item in self.interactions[:2])
+        self.meta.update({
+            "host": router.host,
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "fingerprint": {key: value for key, value in (router.fingerprint or {}).items()
+                            if key in ("hardware", "rom", "model")},
+            "options": {
+                "batch": batch,
+                "preflight": router.capability_cache is not None,
+                "checkpoints": router.checkpoints is not None,
+                "login": logged_in,
+                "password": bool(router.password),
+                "ssh_port": router.ssh_port,
+                "settle_delay": router.settle_delay,
+                "ready_timeout": router.ready_timeout,
+                "ssh_verify": router.ssh_verify,
+                "ssh_password": router.ssh_password is not None,
+                "ssh_commands": router.ssh_commands,
+                "deploy": [{key: file[key] for key in ("dest", "mode", "md5")} for file in router.deploy_manifest],
+                "profile": {key: value for key, value in router.profile.items() if key != "name"},
+                "run_timeout": router.deadline.run_timeout,
+                "step_timeout": router.deadline.step_timeout,
+            },
+            "result": replay_outcome(result),
+        })
+        self.save()
+
+def replay_outcome(result):
+    """
+    provision_host 结果中用于比较录制与回放是否一致的部分
+    """
+    return {
+        "ok": result["ok"],
+        "failed_step": result["failed_step"],
+        "failure": result["failure"],
+        "steps": [[step["name"], step["ok"]] for step in result["steps"]],
+    }
+
+def ssh_transport(address, port, timeout, legacy=False, compress=False):
+    """
+    连接路由器 SSH 端口并创建尚未握手的 paramiko Transport
+    :param legacy: 是否允许旧版 dropbear 使用的 ssh-rsa 主机密钥
+    :param compress: 是否请求 zlib 压缩 (服务端不支持时不压缩)
+    """
+    import logging
+    import socket
+    import paramiko
+
+    # 轮询期间握手失败是预期内的, 不让 paramiko 把异常堆栈打印到标准错误
+    logger = logging.getLogger("paramiko")
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+    sock = socket.create_connection((address, port), timeout=timeout)
+    transport = paramiko.Transport(sock)
+    transport.use_compression(compress)
+    if legacy:
+        options = transport.get_security_options()
+        options.key_types = tuple(options.key_types) + ("ssh-rsa",)
+    return transport
+
+def legacy_host_key_supported():
+    """
+    本地 paramiko 是否仍支持 ssh-rsa 主机密钥 (paramiko 5 已移除)
+    """
+    import paramiko
+    return "ssh-rsa" in paramiko.Transport._key_info
+
+def ssh_handshake(address, port, timeout, username="root", password=None, legacy=False):
+    """
+    与路由器上的 dropbear 完成一次 SSH 握手, 提供了 password 时再验证密码登录
+    :param legacy: 是否允许旧版 dropbear 使用的 ssh-rsa 主机密钥
+    :return: dict, 包含 banner、host_key、legacy、negotiated、authenticated;
+             服务端只提供本地 paramiko 不接受的主机密钥时 negotiated 为 False
+    """
+    import paramiko
+
+    transport = ssh_transport(address, port, timeout, legacy)
+    info = {"banner": None, "host_key": None, "legacy": legacy, "negotiated": False,
+            "authenticated": None}
+    try:
+        try:
+            transport.start_client(timeout=timeout)
+        except paramiko.SSHException as e:
+            # 旧版 dropbear 只提供 ssh-rsa 主机密钥, 新版 paramiko 默认不接受
+            if "host key" not in str(e):
+                raise
+            info.update(banner=transport.remote_version, host_key="ssh-rsa", legacy=True)
+            return info
+        info.update(banner=transport.remote_version, negotiated=True,
+                    host_key=transport.get_remote_server_key().get_name())
+        if password is not None:
+            try:
+                transport.auth_password(username, password)
+                info["authenticated"] = True
+            except paramiko.AuthenticationException:
+                info["authenticated"] = False
+        return info
+    finally:
+        transport.close()
+
+def verify_ssh_handshake(address, port, timeout, username="root", password=None):
+    """
+    ssh_handshake, 默认主机密钥协商失败时改用 ssh-rsa 重试
+    (仅当本地 paramiko 仍支持 ssh-rsa 时)
+    """
+    info = ssh_handshake(address, port, timeout, username, password)
+    if not info["negotiated"] and legacy_host_key_supported():
+        info = ssh_handshake(address, port, timeout, username, password, legacy=True)
+    return info
+
+class SSHPool:
+    """
+    按路由器缓存已登录的 paramiko Transport
+
+    每台路由器只保持一条 SSH 连接, 命令通过同一连接上的多个 channel 并行执行;
+    连接断开后下次使用时自动重连。可在多个线程、多台路由器之间共享。
+    """
+    def __init__(self, timeout=10, keepalive=30, compress=False):
+        """
+        :param timeout: 建立连接与握手的超时时间(秒)
+        :param keepalive: 空闲时发送 keepalive 的间隔(秒), 避免连接被路由器断开
+        :param compress: 新建的连接是否请求 zlib 压缩, 适合传输文本文件
+        """
+        import threading
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.compress = compress
+        self._lock = threading.Lock()
+        self._transports = {}
+        self._connect_locks = {}
+
+    def transport(self, address, port, username, password):
+        """
+        返回 (address, port, username) 对应的已登录 Transport, 没有或已断开时新建
+        """
+        import threading
+        key = (address, port, username)
+        with self._lock:
+            connect_lock = self._connect_locks.setdefault(key, threading.Lock())
+        # 同一台路由器同时只建立一条连接, 其余线程等待复用
+        with connect_lock:
+            with self._lock:
+                transport = self._transports.get(key)
+            if transport is not None and transport.is_active() and transport.is_authenticated():
+                return transport
+            if transport is not None:
+                transport.close()
+            transport = self._connect(address, port, username, password)
+            with self._lock:
+                self._transports[key] = transport
+            return transport
+
+    def _connect(self, address, port, username, password):
+        import paramiko
+        legacy = False
+        while True:
+            transport = ssh_transport(address, port, self.timeout, legacy, self.compress)
+            try:
+                transport.start_client(timeout=self.timeout)
+                transport.auth_password(username, password)
+            except paramiko.SSHException as e:
+                transport.close()
+                if "host key" in str(e) and not legacy and legacy_host_key_supported():
+                    legacy = True
+                    continue
+                raise
+            except Exception:
+                transport.close()
+                raise
+            transport.set_keepalive(self.keepalive)
+            return transport
+
+    def discard(self, address, port, username):
+        """
+        关闭并移除一台路由器的连接
+        """
+        with self._lock:
+            transport = self._transports.pop((address, port, username), None)
+        if transport is not None:
+            transport.close()
+
+    def close(self):
+        """
+        关闭全部连接
+        """
+        with self._lock:
+            transports = list(self._transports.values())
+            self._transports.clear()
+        for transport in transports:
+            transport.close()
+
+class SSHExecutor:
+    """
+    在一台路由器上通过 SSH 执行命令与上传文件
+
+    所有命令共用 SSHPool 中的同一条连接, 每条命令占用一个 channel,
+    run_many() 在同一连接上并行执行多条命令, deploy() 在同一连接上上传部署清单。
+    """
+    def __init__(self, address, port=22, username="root", password=None, pool=None,
+                 timeout=30, max_channels=8, compress=False):
+        """
+        :param address: 路由器地址 (不含端口)
+        :param pool: 共享的 SSHPool; 为空时自行创建, close() 时关闭
+        :param timeout: 单条命令的超时时间(秒)
+        :param max_channels: 同时打开的 channel 数上限
+        :param compress: 自行创建 SSHPool 时是否请求 zlib 压缩
+        """
+        self.address = address
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.max_channels = max_channels
+        self._owns_pool = pool is None
+        self.pool = SSHPool(compress=compress) if pool is None else pool
+
+    def run(self, command, timeout=None):
+        """
+        执行一条命令
+        :return: dict, 包含 command、exit_code、stdout、stderr、seconds、error;
+                 连接或超时错误时 exit_code 为 None, error 为错误信息
+        """
+        import time
+        import paramiko
+
+        timeout = self.timeout if timeout is None else timeout
+        result = {"command": command, "exit_code": None, "stdout": "", "stderr": "",
+                  "seconds": 0, "error": None}
+        started = time.monotonic()
+        channel = None
+        try:
+            transport = self.pool.transport(self.address, self.port, self.username, self.password)
+            channel = transport.open_session(timeout=timeout)
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            # timeout 限制整条命令, 而不是两次输出之间的间隔
+            status, stdout, stderr = self._drain(channel, None if timeout is None else started + timeout)
+            result["exit_code"] = status
+            result["stdout"] = stdout.decode("utf-8", "replace")
+            result["stderr"] = stderr.decode("utf-8", "replace")
+        except (paramiko.SSHException, OSError, EOFError) as e:
+            result["error"] = str(e) or type(e).__name__
+            # 连接可能已不可用, 下次使用时重新建立
+            if not isinstance(e, paramiko.AuthenticationException):
+                self.pool.discard(self.address, self.port, self.username)
+        finally:
+            if channel is not None:
+                channel.close()
+            result["seconds"] = round(time.monotonic() - started, 3)
+        return result
+
+    @staticmethod
+    def _drain(channel, deadline):
+        """
+        读取命令的全部输出并等待退出码
+        :param deadline: 截止时间 (time.monotonic()), 超过时抛出 socket.timeout; None 表示不限
+        :return: (退出码, stdout, stderr)
+        """
+        import select
+        import socket
+        import time
+
+        def remaining():
+            if deadline is None:
+                return None
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise socket.timeout("命令执行超时")
+            return left
+
+        # 两个流共用一个接收窗口, 必须同时读取: 先读完 stdout 再读 stderr 时,
+        # 大量 stderr 会占满窗口, 远端阻塞在写入上, stdout 永远等不到 EOF
+        stdout, stderr = [], []
+        while True:
+            # 输出一直不断时同样要检查截止时间
+            wait = remaining()
+            if channel.recv_ready():
+                stdout.append(channel.recv(32768))
+            elif channel.recv_stderr_ready():
+                stderr.append(channel.recv_stderr(32768))
+            elif channel.eof_received or channel.closed:
+                break
+            else:
+                select.select([channel], [], [], wait)
+        # recv_exit_status() 不限时, 远端发送 EOF 后迟迟不发送退出状态时会一直阻塞
+        while not channel.exit_status_ready():
+            channel.status_event.wait(remaining())
+        return channel.recv_exit_status(), b"".join(stdout), b"".join(stderr)
+
+    def run_many(self, commands, timeout=None):
+        """
+        在同一连接上并行执行多条命令
+        :return: 结果列表, 顺序与 commands 相同
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        commands = list(commands)
+        if not commands:
+            return []
+        # 先建立连接, 避免各线程同时重连
+        self.pool.transport(self.address, self.port, self.username, self.password)
+        with ThreadPoolExecutor(max_workers=min(self.max_channels, len(commands))) as pool:
+            return list(pool.map(lambda command: self.run(command, timeout), commands))
+
+    def checksums(self, paths, timeout=None):
+        """
+        一次 md5sum 读取路由器上多个文件的校验值 (busybox 都带有 md5sum)
+        :return: {路径: md5}, 不存在的文件不在其中
+        """
+        import shlex
+        result = self.run("md5sum " + " ".join(shlex.quote(path) for path in paths) + " 2>/dev/null", timeout)
+        if result["error"]:
+            raise OSError(result["error"])
+        sums = {}
+        for line in result["stdout"].splitlines():
+            digest, _, path = line.partition("  ")
+            if path:
+                sums[path] = digest
+        return sums
+
+    def deploy(self, files, timeout=None):
+        """
+        按部署清单上传文件
+
+        1. 先读取路由器上已有文件的 md5, 与本地一致的文件跳过
+        2. 其余文件通过 SFTP 写入临时文件后改名; 写入使用流水线模式, 不逐块等待确认。
+           路由器的 dropbear 没有 sftp-server 时, 改为在多个 channel 上并行执行 cat 写入
+        3. 最后再读取一次 md5, 确认上传的文件完整
+        :param files: load_manifest() 的返回值
+        :return: 每个文件的结果 [{"dest", "status" (skipped/uploaded/failed), "bytes", "seconds", "error"}],
+                 顺序与 files 相同
+        """
+        import posixpath
+        import shlex
+        import paramiko
+        from concurrent.futures import ThreadPoolExecutor
+
+        timeout = self.timeout if timeout is None else timeout
+        results = [{"dest": file["dest"], "status": "skipped", "bytes": 0, "seconds": 0, "error": None}
+                   for file in files]
+        remote = self.checksums([file["dest"] for file in files], timeout)
+        pending = [(file, result) for file, result in zip(files, results) if remote.get(file["dest"]) != file["md5"]]
+        if not pending:
+            return results
+
+        directories = sorted({posixpath.dirname(file["dest"]) for file, _ in pending} - {"", "/"})
+        if directories:
+            self.run("mkdir -p " + " ".join(shlex.quote(path) for path in directories), timeout)
+        transport = self.pool.transport(self.address, self.port, self.username, self.password)
+        try:
+            sftp = paramiko.SFTPClient.from_transport(transport)
+        except (paramiko.SSHException, EOFError):
+            sftp = None
+        if sftp is not None:
+            sftp.get_channel().settimeout(timeout)
+            try:
+                for file, result in pending:
+                    self._upload(lambda: self._sftp_write(sftp, file), file, result)
+            finally:
+                sftp.close()
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_channels, len(pending))) as pool:
+                list(pool.map(lambda item: self._upload(
+                    lambda: self._cat_write(transport, item[0], timeout), *item), pending))
+
+        uploaded = [(file, result) for file, result in pending if result["status"] == "uploaded"]
+        if uploaded:
+            remote = self.checksums([file["dest"] for file, _ in uploaded], timeout)
+            for file, result in uploaded:
+                if remote.get(file["dest"]) != file["md5"]:
+                    result.update(status="failed", error="上传后 md5 不一致")
+        return results
+
+    @staticmethod
+    def _upload(write, file, result):
+        import time
+        import paramiko
+        started = time.monotonic()
+        try:
+            write()
+            result.update(status="uploaded", bytes=len(file["data"]))
+        except (paramiko.SSHException, OSError, EOFError) as e:
+            result.update(status="failed", error=str(e) or type(e).__name__)
+        result["seconds"] = round(time.monotonic() - started, 3)
+
+    @staticmethod
+    def _sftp_write(sftp, file):
+        temporary = file["dest"] + ".tmp"
+        with sftp.open(temporary, "wb") as remote:
+            remote.set_pipelined(True)
+            remote.write(file["data"])
+        sftp.chmod(temporary, file["mode"])
+        try:
+            sftp.posix_rename(temporary, file["dest"])
+        except IOError:
+            # 服务端不支持 posix-rename 扩展, SFTP 的 rename 不能覆盖已有文件
+            try:
+                sftp.remove(file["dest"])
+            except IOError:
+                pass
+            sftp.rename(temporary, file["dest"])
+
+    @staticmethod
+    def _cat_write(transport, file, timeout):
+        import shlex
+        import time
+        temporary = shlex.quote(file["dest"] + ".tmp")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        channel = transport.open_session(timeout=timeout)
+        try:
+            channel.settimeout(timeout)
+            channel.exec_command(f"cat > {temporary} && chmod {file['mode']:o} {temporary} && "
+                                 f"mv -f {temporary} {shlex.quote(file['dest'])}")
+            channel.sendall(file["data"])
+            channel.shutdown_write()
+            status, _, stderr = SSHExecutor._drain(channel, deadline)
+        finally:
+            channel.close()
+        if status != 0:
+            raise OSError(stderr.decode("utf-8", "replace").strip() or f"退出码 {status}")
+
+    def close(self):
+        """
+        关闭自行创建的连接池
+        """
+        if self._owns_pool:
+            self.pool.close()
+
+class RouterCore:
+    """
+    RouterHack 与 AsyncRouterHack 共用的配置流程
+
+    流程方法 (_flow_*) 是生成器: 需要 IO 时 yield 一个操作, 由引擎执行后把结果 send 回来,
+    执行出错时把异常 throw 回生成器。同步引擎直接执行阻塞调用, asyncio 引擎 await 对应的协程,
+    两个引擎因此共用同一份重试、轮询、场景编排与确认逻辑, 各自只需实现以下操作:
+        ("request", method, url, data)  发送请求, 返回解析后的 JSON
+        ("sleep", seconds)              等待
+        ("port_open",)                  探测 SSH 端口
+        ("blocking", func, *args)       执行会阻塞的本地调用 (缓存、检查点、paramiko)
+        ("sample_load",)                采样路由器 CPU 负载
+    """
+    def __init__(self, host, token, connect_timeout=3.05, read_timeout=10, settle_delay=None,
+                 ready_timeout=None, ssh_port=22, tracer=None, capability_cache=None,
+                 checkpoints=None, resume=False, password=None, token_cache=None,
+                 ssh_verify=True, ssh_username="root", ssh_password=None,
+                 ssh_commands=None, ssh_pool=None, retry_policy=None, circuit_breaker=None,
+                 pacing=None, cassette=None, metrics=None, profile_overrides=None,
+                 run_timeout=None, step_timeout=None, deploy_manifest=None, deploy_compress=False,
+                 clock=None):
+        """
+        参数说明见 RouterHack
+        :param clock: 提供 monotonic()/sleep() 的时钟, 默认 time 模块
+        """
+        import json
+        import time
+        from datetime import datetime
+
+        self.json = json
+        self.time = clock or time
+        self.datetime = datetime
+
+        self.host = host
+        self.password = password
+        self.token_cache = token_cache
+        self._set_token(token)
+        self.timeout = (connect_timeout, read_timeout)
+        self.ssh_port = ssh_port
+        self.ssh_verify = ssh_verify
+        self.ssh_username = ssh_username
+        self.ssh_password = ssh_password
+        # SSH 验证结果与从触发 dropbear 启动到 SSH 可用的耗时(秒)
+        self.ssh_info = None
+        self.ssh_ready_seconds = None
+        self.ssh_commands = list(ssh_commands or [])
+        self.ssh_pool = ssh_pool
+        self.command_results = None
+        self.deploy_manifest = list(deploy_manifest or [])
+        self.deploy_compress = deploy_compress
+        self.deploy_results = None
+        self._ssh_executor = None
+        self.retry_policy = RETRY_POLICY if retry_policy is None else retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.pacer = None if pacing is False else Pacer(**(pacing or {}))
+        self.cassette = cassette
+        self.metrics = metrics
+        self.deadline = Deadline(run_timeout, step_timeout, self.time)
+        self.tracer = tracer
+        self.capability_cache = capability_cache
+        self.fingerprint = None
+        self.checkpoints = checkpoints
+        self.resume = resume
+        # 检查点的键 (路由器 ID), 第一次读取或记录检查点时识别路由器后设置; 没有 ID 时为空字符串
+        self.checkpoint_key = None
+        # 第一个导致失败的原因, 取值见 EXIT_CODES
+        self.failure = None
+        # 场景执行状态: id -> {registered_at, ready_at, confirmed}
+        self._scenes = {}
+        # 本次运行分配的定时器槽位 (id -> 槽位) 与注册过的场景 (名称, 槽位)
+        self._slots = None
+        self._created = []
+        # 显式传入的参数优先于型号配置; 预检识别出型号后再换成对应的配置
+        self._explicit = {key: value for key, value in (
+            ("settle_delay", settle_delay), ("ready_timeout", ready_timeout),
+            ("max_rate", (pacing or {}).get("max_rate"))) if value is not None}
+        self.profile_overrides = profile_overrides or {}
+        self.apply_profile(model_profile(overrides=self.profile_overrides))
+
+    def _set_token(self, token):
+        self.token = token
+        self.base_url = f"http://{self.host}/cgi-bin/luci/;stok={token}"
+
+    def apply_profile(self, profile):
+        """
+        使用 model_profile() 得到的型号参数: 等待时间、请求速率上限, 以及跳过不需要的场景
+        """
+        self.profile = profile
+        self.settle_delay = self._explicit.get("settle_delay", profile["settle_delay"])
+        self.ready_timeout = self._explicit.get("ready_timeout", profile["ready_timeout"])
+        if self.pacer is not None and "max_rate" not in self._explicit:
+            self.pacer.max_rate = profile["max_rate"]
+            self.pacer.rate = min(self.pacer.rate, profile["max_rate"])
+        for scene_id in profile["skip"]:
+            state = self._scenes.setdefault(scene_id, {})
+            if "registered_at" not in state:
+                state.update(registered_at=0, confirmed=True, skipped=True)
+
+    def _fail(self, kind):
+        """
+        记录失败原因, 只保留第一个
+        """
+        if self.failure is None:
+            self.failure = kind
+
+    def _say(self, message):
+        """
+        输出过程信息, 由引擎决定输出方式
+        """
+        print(message)
+
+    def trace(self, name, cat="step", **args):
+        """
+        返回记录该路由器一个 span 的上下文管理器, 未启用追踪时为空操作
+        """
+        return trace_span(self.tracer, name, cat, self.host, **args)
+
+    def _probe(self, name, check):
+        """
+        非 HTTP 的探测 (SSH 端口、握手等) 同样经过 cassette 录制或回放
+        """
+        if self.cassette is None:
+            return check
+        return self.cassette.probe(name, check)
+
+    def _dump(self, result):
+        return self.json.dumps(result, ensure_ascii=False, separators=(',', ':'))
+
+    def ssh_executor(self):
+        """
+        返回在这台路由器上执行 SSH 命令的 SSHExecutor, 同一实例内复用
+        """
+        if self._ssh_executor is None:
+            self._ssh_executor = SSHExecutor(self.host.split(':')[0], self.ssh_port, self.ssh_username,
+                                             self.ssh_password, pool=self.ssh_pool,
+                                             timeout=self.timeout[1], compress=self.deploy_compress)
+        return self._ssh_executor
+
+    def _check_result(self, result):
+        """
+        检查 smartcontroller 响应, 失败时输出对应的错误说明
+        :return: 是否成功
+        """
+        # 详细的错误判断
+        if result.get('code') == 0:
+            self._say("操作成功")
+            return True
+        for line in error_hint(result):
+            self._say(line)
+        self._say("\n❌ 检测到错误，终止操作")
+        self._fail(failure_for_code(result.get('code')))
+        return False
+
+    # ---- 请求与等待 ----
+
+    def _flow_request(self, method, url, data=None):
+        return (yield ("request", method, url, data))
+
+    def _flow_call(self, request, what):
+        """
+        执行一次接口调用, 按 retry_policy 重试可恢复的失败
+        :param request: 无参函数, 返回发送请求的流程; 每次重试重新调用 (重新登录后 stok 会变化)
+        :param what: 输出重试信息时使用的名称
+        :return: 最后一次的响应数据; 超时重试用尽时抛出最后一次的异常
+        """
+        attempt = 0
+        while True:
+            self.deadline.check()
+            if self.circuit_breaker:
+                self.circuit_breaker.check(self.host)
+            if self.pacer is not None and self.pacer.load_due():
+                yield ("sample_load",)
+            error = None
+            try:
+                result = yield from request()
+                kind = result.get("code")
+            except self._timeout_errors as e:
+                result, kind, error = None, "timeout", e
+            if kind not in self.retry_policy:
+                # 不重试的错误码 (如 401 stok 无效) 同样算作一次失败, 只有成功的响应才重置熔断计数
+                if self.circuit_breaker and kind == 0:
+                    self.circuit_breaker.success(self.host)
+                elif self.circuit_breaker:
+                    self.circuit_breaker.failure(self.host, kind)
+                return result
+            if self.circuit_breaker:
+                self.circuit_breaker.failure(self.host, kind)
+            if attempt >= self.retry_policy[kind]:
+                if error is not None:
+                    raise error
+                return result
+            if self.circuit_breaker:
+                self.circuit_breaker.check(self.host)
+            attempt += 1
+            delay = retry_delay(attempt)
+            reason = "请求超时" if error is not None else f"错误码 {kind}"
+            self._say(f"[!] {what}: {reason}, {delay:.1f} 秒后第 {attempt} 次重试...")
+            with self.trace("retry", "wait", kind=str(kind), attempt=attempt):
+                yield ("sleep", delay)
+
+    def _flow_wait_until(self, check, timeout=None, initial=0.2, max_interval=2.0, factor=2.0, stop=None):
+        """
+        按指数退避轮询 check, 直到返回真值或超过截止时间
+        :param check: 无参函数, 返回检查流程; 流程返回真值表示已就绪
+        :param timeout: 最长等待时间(秒), 默认使用 ready_timeout
+        :param stop: 无参函数, check 未就绪后调用, 返回真值时不再等待 (结果已经确定)
+        :return: check 的最后一个真值, 超时或提前停止时返回 None
+        """
+        deadline = self.time.monotonic() + (self.ready_timeout if timeout is None else timeout)
+        interval = initial
+        name = getattr(check, '__name__', 'check').removeprefix("_flow_")
+        with self.trace(f"wait_until {name}", "wait") as span:
+            polls = 0
+            while True:
+                polls += 1
+                span["polls"] = polls
+                self.deadline.check()
+                try:
+                    result = yield from check()
+                except self._check_errors:
+                    result = None
+                if result:
+                    return result
+                if stop is not None and stop():
+                    span["stopped"] = True
+                    return None
+                remaining = deadline - self.time.monotonic()
+                if remaining <= 0:
+                    span["timeout"] = True
+                    return None
+                yield ("sleep", min(interval, remaining))
+                interval = min(interval * factor, max_interval)
+
+    def _flow_settle(self):
+        """
+        等待场景生效; 用于无法通过接口确认结果的步骤
+        """
+        if self.settle_delay:
+            with self.trace("settle", "wait"):
+                yield ("sleep", self.settle_delay)
+
+    def _flow_sleep_until(self, when):
+        """
+        等待到 monotonic 时间点 when
+        """
+        delay = when - self.time.monotonic()
+        if delay > 0:
+            with self.trace("settle", "wait"):
+                yield ("sleep", delay)
+
+    def _flow_fetch_fac_info(self):
+        """
+        读取 /api/xqsystem/fac_info
+        """
+        return (yield from self._flow_request("GET", f"{self.base_url}/api/xqsystem/fac_info"))
+
+    def _flow_fetch_init_info(self):
+        """
+        读取 /api/xqsystem/init_info (无需 stok)
+        """
+        return (yield from self._flow_request("GET", f"http://{self.host}/cgi-bin/luci/api/xqsystem/init_info"))
+
+    def _flow_ssh_port_open(self):
+        return (yield ("port_open",))
+
+    def _ssh_refused(self, answers, committed_at):
+        """
+        判断 fac_info 是否已经确定 ROM 不支持开启 SSH
+        :param answers: 轮询 fac_info 的记录 [(时间, ssh 值)]
+        :param committed_at: nvram commit 预计完成的时间; 之前的 false 可能只是尚未提交
+        :return: committed_at 之后最近 SSH_REFUSED_POLLS 次是否都明确返回 false
+        """
+        recent = [ssh for at, ssh in answers if at >= committed_at][-SSH_REFUSED_POLLS:]
+        return len(recent) == SSH_REFUSED_POLLS and all(ssh is False for ssh in recent)
+
+    # ---- 预检与检查点 ----
+
+    def _flow_preflight(self):
+        """
+        兼容性预检
+
+        功能说明:
+        1. 在修改路由器之前读取型号、ROM 版本 (init_info) 与 fac_info
+        2. 对照内置兼容性列表与本地缓存, 已知不支持的固件直接终止
+        3. 缓存中已有结论时只需一次请求
+        """
+        try:
+            self._say("步骤 1.1: 读取路由器型号与ROM版本...")
+            self.fingerprint = router_fingerprint((yield from self._flow_fetch_init_info()))
+            self._say(f"型号: {self.fingerprint['hardware']}  ROM: {self.fingerprint['rom']}")
+            self.apply_profile(model_profile(self.fingerprint["hardware"], self.fingerprint["rom"],
+                                             self.profile_overrides))
+            self._say(f"执行参数: {self.profile['name']}, 等待 {self.settle_delay}s, "
+                      f"超时 {self.ready_timeout}s")
+
+            # 结论取决于本地缓存 (读文件), 回放时使用录制时的结论
+            judge = self._probe("compatibility",
+                                lambda: compatibility_verdict(self.fingerprint, self.capability_cache))
+            verdict, reason = yield ("blocking", judge)
+            if verdict == "unknown" or verdict == "untested":
+                # 缓存与列表都无法确定时, 再读取一次 fac_info
+                self._say("步骤 1.2: 读取 fac_info...")
+                self.fingerprint["ssh"] = (yield from self._flow_fetch_fac_info()).get("ssh")
+                verdict, reason = yield ("blocking", judge)
+            self.fingerprint["verdict"] = verdict
+
+            if verdict == "unsupported":
+                self._fail("unsupported")
+                self._say(f"\n❌ {reason}")
+                self._say("建议更新路由器固件后重试")
+                self._say("\n❌ 检测到错误，终止操作")
+                return False
+            if verdict == "supported":
+                self._say(f"✓ {reason}")
+            else:
+                self._say(f"[!] {reason}")
+            return True
+
+        except Exception as e:
+            self._fail(classify_exception(e))
+            self._say(f"\n❌ 发生错误: {str(e)}")
+            return False
+
+    def _flow_load_checkpoints(self):
+        """
+        识别路由器并读取步骤检查点
+
+        检查点按 init_info 中的路由器 ID 记录, 同一 IP 换了一台路由器不会误用;
+        续跑时检查点中的步骤还要在路由器上复核 (fac_info 与 SSH 端口), 重启后失效的步骤重新执行
+        """
+        try:
+            if not (yield from self._flow_checkpoint_key()) or not self.resume:
+                return True
+
+            done = yield ("blocking", self.checkpoints.completed, self.checkpoint_key)
+            needed = {step["verify"] for step in SCENE_STEPS if step["checkpoint"] and step["id"] in done}
+            verified = set()
+            if "fac_info" in needed and (yield from self._flow_fetch_fac_info()).get("ssh") == True:
+                verified.add("fac_info")
+            if "ssh_port" in needed and (yield from self._flow_ssh_port_open()):
+                verified.add("ssh_port")
+            for scene_id, state in resumed_scenes(done, verified).items():
+                self._scenes.setdefault(scene_id, state)
+            for step in SCENE_STEPS:
+                if step["checkpoint"] and step["id"] in done and step["verify"] not in verified:
+                    self._say(f"[{step['name']}] 检查点已在路由器上失效 (可能已重启), 重新执行")
+            return True
+
+        except Exception as e:
+            self._fail(classify_exception(e))
+            self._say(f"\n❌ 读取检查点失败: {str(e)}")
+            return False
+
+    def _flow_checkpoint_key(self):
+        """
+        返回检查点的键 (init_info 中的路由器 ID), 第一次调用时识别路由器
+        不续跑时没有读取检查点的步骤, 在第一次记录检查点时才读取 init_info
+        """
+        if self.checkpoint_key is None:
+            if self.fingerprint is None:
+                self.fingerprint = router_fingerprint((yield from self._flow_fetch_init_info()))
+            self.checkpoint_key = self.fingerprint.get("id") or ""
+            if not self.checkpoint_key:
+                self._say("[!] init_info 中没有路由器 ID, 本次运行不使用检查点")
+        return self.checkpoint_key
+
+    def _flow_clear_checkpoints(self):
+        """
+        配置成功后清除该路由器的检查点, 下次运行从头执行
+        """
+        if self.checkpoints is not None and self.checkpoint_key:
+            yield ("blocking", self.checkpoints.clear, self.checkpoint_key)
+
+    def _flow_checkpoint(self, step):
+        """
+        记录已确认生效的场景
+        """
+        if self.checkpoints is not None and step["checkpoint"] and (yield from self._flow_checkpoint_key()):
+            yield ("blocking", self.checkpoints.mark, self.checkpoint_key, step["id"])
+
+    def _flow_record_capability(self, ssh):
+        """
+        将 fac_info 的检测结果写入兼容性缓存
+        """
+        if self.capability_cache and self.fingerprint and self.fingerprint.get("hardware"):
+            yield ("blocking", self.capability_cache.set, self.fingerprint["hardware"],
+                   self.fingerprint["rom"], bool(ssh))
+
+    def _flow_plan_recovery(self):
+        """
+        看门狗恢复: 根据 fac_info 判断重启后需要重新执行的步骤
+
+        ssh_en 已写入并提交的 nvram 重启后仍然有效, 此时只需重新解锁、启用并启动 dropbear;
+        否则执行完整流程
+        """
+        try:
+            ssh = (yield from self._flow_fetch_fac_info()).get("ssh")
+        except Exception as e:
+            self._fail(classify_exception(e))
+            self._say(f"\n❌ 读取 fac_info 失败: {str(e)}")
+            return False
+        if ssh is True:
+            for scene_id in ("ssh_en", "nvram_commit"):
+                self._scenes[scene_id] = {"registered_at": 0, "confirmed": True, "resumed": True}
+            self._say("✓ SSH 开关仍然有效, 只需重新启动 dropbear")
+        else:
+            self._say("[!] SSH 开关已失效, 重新执行完整流程")
+        return True
+
+    # ---- 系统时间 ----
+
+    def _flow_set_time(self, what):
+        """
+        把路由器时间设置为当前时间
+        :return: (设置的时间, 响应数据)
+        """
+        # 获取当前时间并格式化
+        current_time = self.datetime.now()
+        formatted_time = current_time.strftime("%Y-%-m-%-d%%20%-H:%-M:%-S")  # 去掉前导零
+        path = f"/api/misystem/set_sys_time?time={formatted_time}&timezone=CST-8"
+        # 重新登录后 stok 会变化, 每次重试时重新拼接
+        result = yield from self._flow_call(lambda: self._flow_request("GET", self.base_url + path), what)
+        self._say(f"响应数据: {self._dump(result)}")
+        return current_time, result
+
+    def _flow_set_system_time(self):
+        try:
+            self._say("步骤 2.1: 发送系统时间设置请求...")
+            _, result = yield from self._flow_set_time("设置系统时间")
+            if result.get('code') == 0:
+                self._say("操作成功")
+                yield from self._flow_settle()
+                return True
+            self._say(f"请求错误: {result.get('msg', '未知错误')}")
+            self._fail(failure_for_code(result.get('code')))
+            return False
+
+        except Exception as e:
+            self._fail(classify_exception(e))
+            self._say(f"❌ 发生错误: {str(e)}")
+            return False
+
+    def _flow_reset_system_time(self):
+        try:
+            self._say("\n第8步: 重置路由器时间")
+            self._say("-" * 40)
+            self._say("步骤 8.1: 发送时间重置请求...")
+            current_time, result = yield from self._flow_set_time("重置路由器时间")
+            if result.get('code') == 0:
+                self._say("✓ 时间重置成功")
+                self._say(f"当前时间已设置为: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
+                return True
+            self._say(f"\n❌ 时间重置失败: {result.get('msg', '未知错误')}")
+            self._fail(failure_for_code(result.get('code')))
+            return False
+
+        except Exception as e:
+            self._fail(classify_exception(e))
+            self._say(f"\n❌ 发生错误: {str(e)}")
+            return False
+
+    # ---- smartcontroller 场景 ----
+
+    def _flow_request_smartcontroller(self, payload):
+        """
+        向 smartcontroller 发送一个请求
+        :param payload: 请求内容(dict), 或已经序列化的 JSON 字符串
+        :return: 响应数据(dict)
+        """
+        data = {"payload": payload if isinstance(payload, str) else self.json.dumps(payload)}
+        return (yield from self._flow_call(
+            lambda: self._flow_request("POST", f"{self.base_url}/api/xqsmarthome/request_smartcontroller", data),
+            "smartcontroller"))
+
+    def _flow_smartcontroller(self, payload):
+        """
+        向 smartcontroller 发送一个请求并输出响应
+        """
+        result = yield from self._flow_request_smartcontroller(payload)
+        self._say(f"响应数据: {self._dump(result)}")
+        return result
+
+    def _flow_list_scenes(self):
+        """
+        读取路由器上的场景列表
+        :return: 场景列表; 固件不支持时返回 None
+        """
+        result = yield from self._flow_request_smartcontroller({"command": "get_scene_setting"})
+        if result.get("code") != 0:
+            return None
+        return result.get("scene_list") or []
+
+    def _flow_scene_slot(self, scene_id):
+        """
+        返回场景使用的定时器槽位
+        第一次调用时读取场景列表, 为本次运行的全部场景分配没有被占用的槽位
+        """
+        if self._slots is None:
+            import random
+            self._slots = {step["id"]: step["slot"] for step in SCENE_STEPS}
+            scenes = yield from self._flow_list_scenes()
+            seed = self._probe("slot_seed", lambda: random.getrandbits(32))()
+            slots = allocate_slots(scenes, len(SCENE_STEPS), seed) if scenes is not None else None
+            if slots is None:
+                self._say("[!] 无法读取场景列表或没有足够的空闲槽位, 使用默认槽位")
+            else:
+                self._slots = dict(zip(self._slots, slots))
+        return self._slots[scene_id]
+
+    def _flow_cleanup_scenes(self):
+        """
+        删除本次运行注册的场景
+
+        无论配置成功与否都要执行, 避免重复运行后路由器上残留的定时场景越来越多;
+        清理失败只输出提示, 不影响配置结果
+        :return: 是否全部删除
+        """
+        if not self._created:
+            return True
+        try:
+            self._say(f"清理本次注册的 {len(self._created)} 个场景...")
+            scenes = yield from self._flow_list_scenes()
+            if scenes is None:
+                self._say("[!] 无法读取场景列表, 场景未清理")
+                return False
+            created = set(self._created)
+            removed = []
+            for scene in scenes:
+                key = (scene.get("name"), scene_time(scene))
+                if key in created:
+                    result = yield from self._flow_request_smartcontroller(
+                        {"command": "scene_delete", "id": scene.get("id")})
+                    if result.get("code") == 0:
+                        removed.append(key)
+            self._created = [key for key in self._created if key not in removed]
+            if self._created:
+                self._say(f"[!] 有 {len(self._created)} 个场景未能删除")
+                return False
+            self._say(f"✓ 已删除 {len(removed)} 个场景")
+            return True
+        except Exception as e:
+            self._say(f"[!] 清理场景失败: {str(e) or type(e).__name__}")
+            return False
+
+    def _flow_register_scene(self, step):
+        """
+        注册场景; 已注册过的场景直接跳过
+        """
+        state = self._scenes.setdefault(step["id"], {})
+        if "registered_at" in state:
+            return True
+        slot = yield from self._flow_scene_slot(step["id"])
+        result = yield from self._flow_smartcontroller(
+            scene_request(step["command"], slot, self.profile["action_delay"]))
+        if not self._check_result(result):
+            return False
+        self._created.append((scene_name(step["command"]), slot))
+        state["registered_at"] = self.time.monotonic()
+        return True
+
+    def _flow_confirm_scene(self, step):
+        """
+        确认场景已生效: 有检查项的轮询检查项, 否则等待 settle_delay 到期
+        """
+        state = self._scenes[step["id"]]
+        if state.get("confirmed"):
+            return True
+        check = step.get("check")
+        if check is None:
+            yield from self._flow_sleep_until(state["ready_at"])
+        elif check == "fac_info":
+            self._say("检查路由器SSH支持...")
+            last = {}
+            answers = []
+
+            def ssh_enabled():
+                last.clear()
+                last.update((yield from self._flow_fetch_fac_info()))
+                answers.append((self.time.monotonic(), last.get('ssh')))
+                return last.get('ssh') == True
+
+            # nvram commit 较慢的路由器要过一会儿 ssh 才变为 true; commit_delay 过后仍连续返回 false 才提前结束
+            committed_at = state.get("triggered_at", self.time.monotonic()) + self.profile["commit_delay"]
+            ready = bool((yield from self._flow_wait_until(
+                ssh_enabled, stop=lambda: self._ssh_refused(answers, committed_at))))
+            self._say(f"响应数据: {self._dump(last)}")
+            if not ready and [ssh for _, ssh in answers[-SSH_REFUSED_POLLS:]] != [False] * SSH_REFUSED_POLLS:
+                # 没有连续明确返回 ssh 为 false, 不能断定 ROM 不支持
+                self._fail("not_ready")
+                self._say(f"\n❌ 等待 {self.ready_timeout} 秒后仍无法确认 SSH 开关状态")
+                self._say("\n❌ 检测到错误，终止操作")
+                return False
+            yield from self._flow_record_capability(ready)
+            if not ready:
+                self._fail("unsupported")
+                self._say("\n❌ 太可惜了，此路由器当前ROM不支持开启SSH")
+                self._say("检测到 ssh 值为 false")
+                self._say("建议更新路由器固件后重试")
+                self._say("\n❌ 检测到错误，终止操作")
+                return False
+            self._say("✓  恭喜，检测到路由器支持开启SSH功能")
+        elif check == "ssh_port":
+            self._say(f"等待 SSH 端口 {self.ssh_port} 就绪...")
+            if not (yield from self._flow_wait_until(self._flow_ssh_port_open)):
+                self._fail("not_ready")
+                self._say(f"\n❌ 等待 {self.ready_timeout} 秒后 SSH 端口仍未开放")
+                self._say("\n❌ 检测到错误，终止操作")
+                return False
+            self._say("操作成功")
+        state["confirmed"] = True
+        yield from self._flow_checkpoint(step)
+        return True
+
+    def _flow_run_scenes(self, group, title):
+        """
+        按 SCENE_STEPS 执行一组场景
+
+        功能说明:
+        1. 场景触发前, 先确认其依赖的场景已经生效
+        2. 某个场景执行期间, 提前在下一个槽位上注册下一个场景
+        3. 注册与触发之间至少间隔 settle_delay
+        :param group: 要执行的步骤组, 对应 SCENE_STEPS 中的 group
+        :param title: 完成时输出的步骤名称
+        """
+        try:
+            steps = [step for step in SCENE_STEPS if step["group"] == group]
+            by_id = {step["id"]: step for step in SCENE_STEPS}
+            sub = 0
+            for step in steps:
+                if self._scenes.get(step["id"], {}).get("resumed"):
+                    self._say(f"[{step['name']}] 已在之前的运行中完成, 跳过")
+                    continue
+                if self._scenes.get(step["id"], {}).get("skipped"):
+                    self._say(f"[{step['name']}] 此型号不需要执行, 跳过")
+                    continue
+                if "registered_at" not in self._scenes.get(step["id"], {}):
+                    sub += 1
+                    slot = yield from self._flow_scene_slot(step["id"])
+                    self._say(f"步骤 {step['no']}.{sub}: 注册场景 [{step['name']}] (槽位 {slot})...")
+                    if not (yield from self._flow_register_scene(step)):
+                        return False
+
+                for dep in step["after"]:
+                    if not (yield from self._flow_confirm_scene(by_id[dep])):
+                        return False
+                yield from self._flow_sleep_until(self._scenes[step["id"]]["registered_at"] + self.settle_delay)
+
+                sub += 1
+                self._say(f"步骤 {step['no']}.{sub}: 触发场景 [{step['name']}]...")
+                slot = yield from self._flow_scene_slot(step["id"])
+                result = yield from self._flow_smartcontroller(trigger_request(slot))
+                if not self._check_result(result):
+                    return False
+                self._scenes[step["id"]]["triggered_at"] = self.time.monotonic()
+                self._scenes[step["id"]]["ready_at"] = self.time.monotonic() + self.settle_delay
+
+                # 场景执行期间, 提前注册下一个场景
+                index = SCENE_STEPS.index(step)
+                if index + 1 < len(SCENE_STEPS):
+                    following = SCENE_STEPS[index + 1]
+                    if "registered_at" not in self._scenes.get(following["id"], {}):
+                        slot = yield from self._flow_scene_slot(following["id"])
+                        self._say(f"预先注册下一个场景 [{following['name']}] (槽位 {slot})...")
+                        if not (yield from self._flow_register_scene(following)):
+                            return False
+
+            for step in steps:
+                if not (yield from self._flow_confirm_scene(step)):
+                    return False
+
+            # 最终结果判断
+            self._say("")
+            self._say(f"##{title} 操作全部完成")
+            return True
+
+        except Exception as e:
+            self._fail(classify_exception(e))
+            self._say(f"\n❌ 发生错误: {str(e)}")
+            return False
+
+    def _flow_run_batch(self, steps=None, slot=None):
+        """
+        批量模式: 第3~5步合并执行
+
+        功能说明:
+        1. 将全部 root 命令用 && 串联为一个场景, 只注册、触发各一次
+        2. 任一子命令失败时后续命令不再执行
+        3. 触发后依次轮询各子命令的可观测结果, 定位失败的子命令
+        4. 每条子命令的状态保存在 self.batch_report 中
+        :param slot: 批量场景的定时器槽位, 为空时使用为第一条命令分配的槽位
+        """
+        if steps is None:
+            steps = [step for step in SCENE_STEPS
+                     if not {"resumed", "skipped"} & set(self._scenes.get(step["id"], {}))]
+        self.batch_report = [{"name": step["name"], "command": step["command"], "status": "pending"}
+                             for step in steps]
+        try:
+            script = " && ".join(step["command"] for step in steps)
+
+            slot = slot or (yield from self._flow_scene_slot(steps[0]["id"]))
+            self._say(f"步骤 3.1: 注册批量场景 (共 {len(steps)} 条命令, 槽位 {slot})...")
+            result = yield from self._flow_smartcontroller(scene_request(script, slot, self.profile["action_delay"]))
+            if not self._check_result(result):
+                return False
+            self._created.append((scene_name(script), slot))
+            yield from self._flow_settle()
+
+            self._say("步骤 3.2: 触发批量场景...")
+            result = yield from self._flow_smartcontroller(trigger_request(slot))
+            if not self._check_result(result):
+                return False
+            triggered_at = self.time.monotonic()
+            for step in steps:
+                self._scenes.setdefault(step["id"], {})["triggered_at"] = triggered_at
+
+            # 命令以 && 串联: 某条命令的结果可观测, 说明它之前的命令都已成功
+            self._say("步骤 3.3: 确认各子命令执行结果...")
+
+            answers = []
+
+            def ssh_enabled():
+                ssh = (yield from self._flow_fetch_fac_info()).get('ssh')
+                answers.append((self.time.monotonic(), ssh))
+                return ssh == True
+            checks = {"fac_info": ssh_enabled, "ssh_port": self._flow_ssh_port_open}
+            # fac_info 在 commit_delay 过后连续返回 false 时不再等满 ready_timeout
+            stops = {"fac_info": lambda: self._ssh_refused(answers, triggered_at + self.profile["commit_delay"])}
+            unconfirmed = []
+            for index, step in enumerate(steps):
+                entry = self.batch_report[index]
+                check = step.get("check")
+                if check is None:
+                    unconfirmed.append(entry)
+                    continue
+                ready = yield from self._flow_wait_until(checks[check], stop=stops.get(check))
+                if check == "fac_info" and ready:
+                    # 失败时无法区分是 ROM 不支持还是之前的命令失败, 只记录成功的结论
+                    yield from self._flow_record_capability(True)
+                if ready:
+                    for item in unconfirmed + [entry]:
+                        item["status"] = "ok"
+                    unconfirmed = []
+                    continue
+
+                entry["status"] = "failed"
+                self._fail("unsupported" if check == "fac_info" and not unconfirmed else "not_ready")
+                for item in unconfirmed:
+                    item["status"] = "unknown"
+                for item in self.batch_report[index + 1:]:
+                    item["status"] = "skipped"
+                self._say(f"\n❌ 子命令执行失败: {step['name']}")
+                if unconfirmed:
+                    self._say(f"   也可能是之前的命令失败: {', '.join(item['name'] for item in unconfirmed)}")
+                if check == "fac_info":
+                    self._say("   若命令均已执行, 说明此路由器当前ROM不支持开启SSH")
+                self._say("\n❌ 检测到错误，终止操作")
+                return False
+
+            for item in unconfirmed:
+                item["status"] = "unverified"
+            for step, item in zip(steps, self.batch_report):
+                if item["status"] == "ok":
+                    yield from self._flow_checkpoint(step)
+            for item in self.batch_report:
+                self._say(f"  [{item['status']}] {item['name']}")
+            self._say("")
+            self._say("##批量执行 root 命令 操作全部完成")
+            return True
+
+        except Exception as e:
+            self._fail(classify_exception(e))
+            self._say(f"\n❌ 发生错误: {str(e)}")
+            return False
+
+    # ---- SSH ----
+
+    def _flow_verify_ssh(self):
+        """
+        验证 SSH 连接
+
+        功能说明:
+        1. 轮询 SSH 端口, 直到 dropbear 完成 SSH 握手, 而不是只看接口返回的 code
+        2. 服务端只提供 ssh-rsa 主机密钥时, 放开 ssh-rsa 后重试
+        3. 提供了 SSH 密码时验证登录
+        4. 记录从触发 dropbear 启动到 SSH 可用的耗时
+        """
+        try:
+            address = self.host.split(':')[0]
+            self._say(f"步骤 6.1: 等待 dropbear 完成 SSH 握手 ({address}:{self.ssh_port})...")
+            started = self._scenes.get("dropbear_restart", {}).get("triggered_at", self.time.monotonic())
+
+            def handshake():
+                import paramiko
+                try:
+                    return verify_ssh_handshake(address, self.ssh_port, self.deadline.clamp(self.timeout[0]),
+                                                self.ssh_username, self.ssh_password)
+                except (paramiko.SSHException, EOFError):
+                    return None
+            probed = self._probe("ssh_handshake", handshake)
+
+            def ssh_handshake_done():
+                # paramiko 是阻塞库
+                return (yield ("blocking", probed))
+
+            info = yield from self._flow_wait_until(ssh_handshake_done)
+            if not info:
+                self._fail("not_ready")
+                self._say(f"\n❌ 等待 {self.ready_timeout} 秒后仍无法完成 SSH 握手")
+                self._say("\n❌ 检测到错误，终止操作")
+                return False
+            self.ssh_info = info
+            self.ssh_ready_seconds = round(self.time.monotonic() - started, 3)
+            self._say(f"SSH 服务: {info['banner']}  主机密钥: {info['host_key']}")
+            if info["legacy"]:
+                self._say("[!] 路由器只提供 ssh-rsa 主机密钥, 连接时需要加 -oHostKeyAlgorithms=+ssh-rsa")
+
+            if info["authenticated"] is False:
+                self._fail("ssh")
+                self._say(f"\n❌ SSH 密码验证失败 (用户 {self.ssh_username})")
+                self._say("\n❌ 检测到错误，终止操作")
+                return False
+            if info["authenticated"]:
+                self._say(f"✓ 已使用密码登录 {self.ssh_username}@{address}")
+            elif self.ssh_password is not None:
+                self._say("[!] 本地 paramiko 不支持 ssh-rsa, 未验证密码登录")
+            self._say(f"SSH 就绪耗时: {self.ssh_ready_seconds}s")
+            return True
+
+        except Exception as e:
+            self._fail(classify_exception(e))
+            self._say(f"\n❌ 发生错误: {str(e)}")
+            return False
+
+    def _flow_deploy(self):
+        """
+        上传部署清单中的文件
+
+        功能说明:
+        1. 与执行命令共用同一条 SSH 连接, 优先使用 SFTP 流水线写入
+        2. 路由器上 md5 已一致的文件跳过, 上传的文件最后重新校验
+        3. 每个文件的结果保存在 self.deploy_results 中
+        """
+        try:
+            if self.ssh_password is None:
+                self._fail("usage")
+                self._say("\n❌ 上传文件需要提供 SSH 密码")
+                return False
+            self._say(f"步骤 6.2: 上传 {len(self.deploy_manifest)} 个文件...")
+            # 超时收紧到剩余的时间预算以内
+            timeout = self.deadline.clamp(self.timeout[1])
+            self.deploy_results = yield ("blocking", self._probe(
+                "deploy", lambda: self.ssh_executor().deploy(self.deploy_manifest, timeout)))
+            for item in self.deploy_results:
+                if item["status"] == "uploaded":
+                    self._say(f"↑ {item['dest']}  ({item['bytes']} 字节, {item['seconds']}s)")
+                elif item["status"] == "failed":
+                    self._say(f"✗ {item['dest']}  ({item['error']})")
+            counts = {status: sum(1 for item in self.deploy_results if item["status"] == status)
+                      for status in ("uploaded", "skipped", "failed")}
+            self._say(f"上传 {counts['uploaded']} 个, 已是最新 {counts['skipped']} 个, 失败 {counts['failed']} 个")
+            if counts["failed"]:
+                self._fail("ssh")
+                self._say(f"\n❌ {counts['failed']} 个文件上传失败")
+                return False
+            return True
+
+        except Exception as e:
+            self._fail("ssh" if classify_exception(e) == "error" else classify_exception(e))
+            self._say(f"\n❌ 发生错误: {str(e)}")
+            return False
+
+    def _flow_run_ssh_commands(self):
+        """
+        通过 SSH 执行 ssh_commands
+
+        功能说明:
+        1. 所有命令共用一条 SSH 连接, 在多个 channel 上并行执行
+        2. 每条命令的输出、退出码与耗时保存在 self.command_results 中
+        3. 命令返回非零退出码不算失败, 无法执行 (连接、超时) 才算失败
+        """
+        try:
+            if self.ssh_password is None:
+                self._fail("usage")
+                self._say("\n❌ 通过 SSH 执行命令需要提供 SSH 密码")
+                return False
+            self._say(f"步骤 6.3: 通过 SSH 执行 {len(self.ssh_commands)} 条命令...")
+            timeout = self.deadline.clamp(self.timeout[1])
+            self.command_results = yield ("blocking", self._probe(
+                "ssh_commands", lambda: self.ssh_executor().run_many(self.ssh_commands, timeout)))
+            for item in self.command_results:
+                status = item["error"] or f"退出码 {item['exit_code']}"
+                self._say(f"$ {item['command']}  ({status}, {item['seconds']}s)")
+                for line in (item["stdout"] + item["stderr"]).splitlines():
+                    self._say(f"  {line}")
+            errors = [item for item in self.command_results if item["error"]]
+            if errors:
+                self._fail("ssh")
+                self._say(f"\n❌ {len(errors)} 条命令无法执行")
+                return False
+            return True
+
+        except Exception as e:
+            self._fail("ssh" if classify_exception(e) == "error" else classify_exception(e))
+            self._say(f"\n❌ 发生错误: {str(e)}")
+            return False
+
+class RouterHack(RouterCore):
+    def __init__(self, host, token, connect_timeout=3.05, read_timeout=10,
+                 pool_connections=1, pool_maxsize=4, cassette=None, **options):
+        """
+        初始化路由器操作类
+        :param host: 路由器IP地址
+        :param token: 路由器stok令牌; 为空且提供了 password 时自动登录获取
+        :param connect_timeout: 建立TCP连接的超时时间(秒)
+        :param read_timeout: 等待路由器响应的超时时间(秒)
+        :param pool_connections: 连接池缓存的主机数
+        :param pool_maxsize: 每个主机保持的最大长连接数
+        :param settle_delay: 无法直接观测结果的场景, 触发后的最短等待时间(秒); 为空时按型号配置
+        :param ready_timeout: 轮询等待路由器就绪的最长时间(秒); 为空时按型号配置
+        :param ssh_port: 路由器 SSH 端口, 用于确认 dropbear 已启动
+        :param tracer: Tracer 实例, 为空时不记录追踪信息
+        :param capability_cache: CapabilityCache 实例, 用于兼容性预检与记录检测结果;
+                                 为空时批量流程不做兼容性预检
+        :param checkpoints: CheckpointStore 实例, 按路由器 ID 记录已确认生效的场景
+        :param resume: 是否跳过检查点中已完成且在路由器上复核通过的场景
+        :param password: 管理后台密码; 提供后 stok 过期 (3001) 时自动重新登录
+        :param token_cache: TokenCache 实例, 登录得到的 stok 按路由器缓存复用
+        :param ssh_verify: 启动 dropbear 后是否通过 SSH 握手验证 (需要 paramiko)
+        :param ssh_username: 验证 SSH 登录使用的用户名
+        :param ssh_password: SSH 登录密码; 为空时只验证握手, 不验证登录
+        :param ssh_commands: SSH 开启后通过 SSH 执行的命令列表 (需要 ssh_password)
+        :param ssh_pool: 共享的 SSHPool, 为空时按需自行创建
+        :param retry_policy: 可恢复失败 -> 最多重试次数, 默认 RETRY_POLICY
+        :param circuit_breaker: 共享的 CircuitBreaker, 为空时不熔断
+        :param pacing: Pacer 的参数 (dict), 为空时使用默认参数; False 表示不限制请求速率
+        :param cassette: Cassette 实例; 录制本次会话, 或在录制的会话上回放 (不连接路由器)
+        :param metrics: 共享的 Metrics, 记录各接口的耗时与 smartcontroller 响应码
+        :param profile_overrides: load_profiles() 读取的自定义型号参数
+        :param run_timeout: 整个运行 (从创建实例开始) 的时间预算(秒), 为空时不限
+        :param step_timeout: 每个步骤的时间预算(秒), 由调用方在步骤开始时调用 deadline.start_step()
+        :param deploy_manifest: load_manifest() 读取的部署清单, SSH 开启后上传 (需要 ssh_password)
+        :param deploy_compress: 上传时是否请求 SSH 压缩
+        """
+        # 导入必要的模块
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.requests = requests
+        # 接口调用按超时重试的异常, 与轮询时视为 "尚未就绪" 的异常
+        self._timeout_errors = (requests.Timeout, requests.ConnectionError)
+        self._check_errors = (requests.RequestException, OSError, ValueError)
+
+        # 回放时不真正等待
+        clock = VirtualClock() if cassette is not None and cassette.replaying else None
+        super().__init__(host, token, connect_timeout, read_timeout, cassette=cassette, clock=clock, **options)
+
+        # 所有请求共用一个 Session, 复用与路由器之间的 TCP 长连接
+        self.session = requests.Session()
+        self.session.headers.update({"Connection": "keep-alive"})
+        if cassette is not None:
+            adapter = cassette.adapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        else:
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        if token is None and self.password:
+            cached = self.token_cache.get(host) if self.token_cache else None
+            self._set_token(cached or self.login())
+
+    def _drive(self, flow):
+        """
+        执行 RouterCore 的流程: 逐个执行流程 yield 的操作, 把结果或异常交回流程
+        :return: 流程的返回值
+        """
+        value, error = None, None
+        while True:
+            try:
+                op = flow.throw(error) if error is not None else flow.send(value)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                value = self._perform(op)
+            except Exception as e:
+                error = e
+
+    def _perform(self, op):
+        kind = op[0]
+        if kind == "request":
+            _, method, url, data = op
+            return self._request(method, url, data=data).json()
+        if kind == "sleep":
+            return self.deadline.sleep(op[1])
+        if kind == "port_open":
+            return self._probe("ssh_port", self.ssh_port_open)()
+        if kind == "blocking":
+            return op[1](*op[2:])
+        if kind == "sample_load":
+            return self.sample_load()
+        raise ValueError(f"未知操作: {kind}")
+
+    def login(self):
+        """
+        使用管理后台密码登录, 返回新的 stok 并写入缓存
+        """
+        page = self._send("GET", f"http://{self.host}/cgi-bin/luci/web").text
+        form = login_form(page, self.password)
+        result = self._send("POST", f"http://{self.host}/cgi-bin/luci/api/xqsystem/login", data=form).json()
+        if result.get("code") != 0 or not result.get("token"):
+            raise LoginError(f"登录失败: {result.get('msg', result.get('code'))}")
+        if self.token_cache:
+            self.token_cache.set(self.host, result["token"])
+        return result["token"]
+
+    def refresh_token(self):
+        """
+        stok 过期后重新登录
+        """
+        print("stok 已过期, 正在重新登录...")
+        if self.token_cache:
+            self.token_cache.invalidate(self.host)
+        self._set_token(self.login())
+        print("✓ 已获取新的 stok")
+
+    def _request(self, method, url, **kwargs):
+        """
+        发送请求; 提供了密码时, stok 过期 (3001) 会自动重新登录并重发一次
+        """
+        response = self._send(method, url, **kwargs)
+        if self.password and url.startswith(self.base_url) and self._token_expired(response):
+            old_base = self.base_url
+            self.refresh_token()
+            response = self._send(method, self.base_url + url[len(old_base):], **kwargs)
+        return response
+
+    @staticmethod
+    def _token_expired(response):
+        try:
+            return response.json().get("code") == 3001
+        except (ValueError, AttributeError):
+            return False
+
+    def _send(self, method, url, **kwargs):
+        """
+        通过共享连接池发送请求, 默认带超时
+        """
+        kwargs["timeout"] = self.deadline.clamp(kwargs.get("timeout", self.timeout))
+        if self.tracer is None and self.pacer is None and self.metrics is None:
+            try:
+                return self.session.request(method, url, **kwargs)
+            except (self.requests.Timeout, self.requests.ConnectionError):
+                # 超时被收紧到剩余预算时, 按超出预算处理
+                self.deadline.check()
+                raise
+
+        # 记录的接口路径不包含 stok
+        endpoint = (url[len(self.base_url):] if url.startswith(self.base_url) else url).split('?')[0]
+        if self.pacer is not None:
+            delay = self.pacer.reserve()
+            if delay > 0:
+                with self.trace("pace", "wait", rate=round(self.pacer.rate, 2)):
+                    self.deadline.sleep(delay)
+        with self.trace(f"{method} {endpoint}", "http", method=method) as span:
+            started = self.time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (self.requests.Timeout, self.requests.ConnectionError):
+                if self.pacer is not None:
+                    self.pacer.congested()
+                if self.metrics is not None:
+                    self.metrics.request_error(method, endpoint)
+                self.deadline.check()
+                raise
+            seconds = self.time.monotonic() - started
+            span["status"] = response.status_code
+            span["bytes"] = len(response.content)
+            # elapsed 为发出请求到收到响应头的时间, 与 span 总时长的差值即本地开销
+            span["response_ms"] = round(response.elapsed.total_seconds() * 1000, 3)
+            code = None
+            try:
+                code = span["code"] = response.json().get("code")
+            except (ValueError, AttributeError):
+                pass
+            if self.pacer is not None:
+                self.pacer.observe(endpoint, seconds, congested=code == -101)
+            if self.metrics is not None:
+                self.metrics.response(method, endpoint, seconds, code)
+            return response
+
+    def sample_load(self):
+        """
+        读取 /api/misystem/status 中的 CPU 负载并交给 pacer; 读取失败时忽略
+        不经过 pacer 与重试, 避免负载采样本身加重路由器负担
+        """
+        try:
+            response = self.session.get(f"{self.base_url}/api/misystem/status",
+                                        timeout=self.deadline.clamp(self.timeout))
+            load = cpu_load(response.json())
+        except (self.requests.RequestException, ValueError):
+            load = None
+        self.pacer.observe_load(load)
+        if load is not None:
+            print(f"路由器 CPU 负载: {load:.0%}, 请求速率上限: {self.pacer.rate:.1f} 次/秒")
+
+    def ssh_port_open(self):
+        """
+        探测路由器 SSH 端口是否已经可以连接
+        """
+        import socket
+        try:
+            with socket.create_connection((self.host.split(':')[0], self.ssh_port),
+                                          timeout=self.deadline.clamp(self.timeout[0])):
+                return True
+        except OSError:
+            return False
+
+    def fetch_fac_info(self):
+        """
+        读取 /api/xqsystem/fac_info
+        """
+        return self._drive(self._flow_fetch_fac_info())
+
+    def close(self):
+        """
+        关闭连接池, 释放与路由器之间的长连接
+        """
+        self.session.close()
+        if self._ssh_executor is not None:
+            self._ssh_executor.close()
+
+    def plan_recovery(self):
+        """
+        看门狗恢复: 根据 fac_info 判断重启后需要重新执行的步骤
+        """
+        return self._drive(self._flow_plan_recovery())
+
+    def preflight(self):
+        """
+        第1步补充: 兼容性预检
+        """
+        return self._drive(self._flow_preflight())
+
+    def load_checkpoints(self):
+        """
+        第1步补充: 识别路由器并读取步骤检查点
+        """
+        return self._drive(self._flow_load_checkpoints())
+
+    def clear_checkpoints(self):
+        """
+        配置成功后清除该路由器的检查点, 下次运行从头执行
+        """
+        self._drive(self._flow_clear_checkpoints())
+
+    def record_capability(self, ssh):
+        """
+        将 fac_info 的检测结果写入兼容性缓存
+        """
+        self._drive(self._flow_record_capability(ssh))
+
+    def set_system_time(self):
+        """
+        第2步: 设置系统时间
+        """
+        return self._drive(self._flow_set_system_time())
+
+    def unlock_dropbear(self):
+        """
+        第3步: 解锁dropbear配置
+
+        功能说明:
+        1. 通过注入漏洞在路由器上以 root 身份执行命令
+        2. 使用 sed 命令将 /etc/init.d/dropbear 中的所有 release 替换为 XXXXXX
+        3. 这个步骤是为了绕过系统对 dropbear 服务的限制
+        """
+        return self._drive(self._flow_run_scenes("unlock_dropbear", "解锁dropbear配置"))
+
+    def activate_ssh(self):
+        """
+        第4步: 使用 nvram 激活 ssh_en 配置项
+        """
+        return self._drive(self._flow_run_scenes("activate_ssh", "使用 nvram 激活 ssh_en 配置项"))
+
+    def start_dropbear(self):
+        """
+        第5步: 启动 dropbear 服务
+        """
+        return self._drive(self._flow_run_scenes("start_dropbear", "启动 dropbear 服务"))
+
+    def run_batch(self, steps=None, slot=None):
+        """
+        批量模式: 第3~5步合并执行, 流程见 RouterCore._flow_run_batch
+        """
+        return self._drive(self._flow_run_batch(steps, slot))
 
-    def start_dropbear(self):
+    def verify_ssh(self):
         """
-        第5步: 启动 dropbear 服务
+        第6步: 验证 SSH 连接
         """
-        try:
+        return self._drive(self._flow_verify_ssh())
 
-            url = f"{self.base_url}/api/xqsmarthome/request_smartcontroller"
-
-            # 步骤 5.1: 启用 dropbear
-            print("步骤 5.1: 启用 dropbear...")
-            payload_data1 = {
-                "command": "scene_setting",
-                "name": "'$(/etc/init.d/dropbear enable)'",  # 启用 dropbear
-                "action_list": [{
-                    "thirdParty": "xmrouter",
-                    "delay": 17,
-                    "type": "wan_block",
-                    "payload": {
-                        "command": "wan_block",
-                        "mac": "00:00:00:00:00:00"
-                    }
-                }],
-                "launch": {
-                    "timer": {
-                        "time": "3:4",  # 时间设置为 3:4
-                        "repeat": "0",
-                        "enabled": True
-                    }
-                }
-            }
-            
-            response1 = self.requests.post(url, data={"payload": self.json.dumps(payload_data1)})
-            # print("步骤 5.1 请��结果 ===")
-            result1 = response1.json()
-            print(f"响应数据: {self.json.dumps(result1, ensure_ascii=False, separators=(',', ':'))}")
-            if result1.get('code') == 0:
-                print("操作成功")
-            else:
-                print(f"请求错误: {result1.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
-            
-            # 步骤 5.2: 启动第一个场景
-            print("步骤 5.2: 启动场景...")
-            payload_data2 = {
-                "command": "scene_start_by_crontab",
-                "time": "3:4",  # 与上一步时间一致
-                "week": 0
-            }
-            response2 = self.requests.post(url, data={"payload": self.json.dumps(payload_data2)})
-            # print("步骤 5.2 请求结果 ===")
-            result2 = response2.json()
-            print(f"响应数据: {self.json.dumps(result2, ensure_ascii=False, separators=(',', ':'))}")
-            if result2.get('code') == 0:
-                print("操作成功")
-            else:
-                print(f"请求错误: {result2.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
-
-            # 步骤 5.3: 重启 dropbear
-            print("步骤 5.3: 重启 dropbear...")
-            payload_data3 = {
-                "command": "scene_setting",
-                "name": "'$(/etc/init.d/dropbear restart)'",  # 重启 dropbear
-                "action_list": [{
-                    "thirdParty": "xmrouter",
-                    "delay": 17,
-                    "type": "wan_block",
-                    "payload": {
-                        "command": "wan_block",
-                        "mac": "00:00:00:00:00:00"
-                    }
-                }],
-                "launch": {
-                    "timer": {
-                        "time": "3:5",  # 时间变更为 3:5
-                        "repeat": "0",
-                        "enabled": True
-                    }
-                }
-            }
-            response3 = self.requests.post(url, data={"payload": self.json.dumps(payload_data3)})
-            # print("步骤 5.3 请求结果 ===")
-            result3 = response3.json()
-            print(f"响应数据: {self.json.dumps(result3, ensure_ascii=False, separators=(',', ':'))}")
-            if result3.get('code') == 0:
-                print("操作成功")
-            else:
-                print(f"请求错误: {result3.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
-
-            # 步骤 5.4: 启动第二个场景
-            print("步骤 5.4: 启动第二个场景...")
-            payload_data4 = {
-                "command": "scene_start_by_crontab",
-                "time": "3:5",  # 与上一步时间一致
-                "week": 0
-            }
-            response4 = self.requests.post(url, data={"payload": self.json.dumps(payload_data4)})
-            # print("步骤 5.4 请求结果 ===")
-            result4 = response4.json()
-            print(f"响应数据: {self.json.dumps(result4, ensure_ascii=False, separators=(',', ':'))}")
-            if result4.get('code') == 0:
-                print("操作成功")
-            else:
-                print(f"请求错误: {result4.get('msg', '未知错误')}")
-                print("\n❌ 检测到错误，终止操作")
-                return False
-            self.time.sleep(3)
+    def deploy(self):
+        """
+        第6步补充: 上传部署清单中的文件
+        """
+        return self._drive(self._flow_deploy())
 
-            # 最终结果判断
-            print()
-            print("##启动 dropbear 服务 操作全部完成")
-            return True
+    def run_ssh_commands(self):
+        """
+        第6步补充: 通过 SSH 执行 ssh_commands
+        """
+        return self._drive(self._flow_run_ssh_commands())
 
-        except Exception as e:
-            print(f"\n❌ 发生错误: {str(e)}")
-            return False
+    def cleanup_scenes(self):
+        """
+        删除本次运行注册的场景, 失败只打印提示
+        """
+        return self._drive(self._flow_cleanup_scenes())
 
     def show_ssh_tips(self):
         """
@@ -465,18 +3003,21 @@ class RouterHack:
         print("   → 获取的密码即为SSH登录密码")
         
         print("\n2. 使用以下命令连接路由器:")
-        print(f"   ssh root@{self.host}")
-        print("   如果无法登录考虑实用:")
-        print(f"   ssh -oHostKeyAlgorithms=+ssh-rsa root@{self.host}")
+        if self.ssh_info and self.ssh_info["legacy"]:
+            print(f"   ssh -oHostKeyAlgorithms=+ssh-rsa root@{self.host}")
+        else:
+            print(f"   ssh root@{self.host}")
+            print("   如果无法登录考虑实用:")
+            print(f"   ssh -oHostKeyAlgorithms=+ssh-rsa root@{self.host}")
         
 
 
     def show_ssh_guide(self):
         """
-        第6步: SSH连接说明
+        第7步: SSH连接说明
         """
         try:
-            print("\n第6步: SSH连接说明")
+            print("\n第7步: SSH连接说明")
             print("-" * 40)
 
             # 显示SSH连接提示
@@ -493,46 +3034,17 @@ class RouterHack:
 
     def reset_system_time(self):
         """
-        第7步: 重置路由器时间为当前时间
+        第8步: 重置路由器时间为当前时间
         """
-        try:
-            print("\n第7步: 重置路由器时间")
-            print("-" * 40)
-            self.time.sleep(2)
-
-            # 获取当前时间并格式化
-            current_time = self.datetime.now()
-            formatted_time = current_time.strftime("%Y-%-m-%-d%%20%-H:%-M:%-S")
-            
-            # 构建URL
-            url = f"{self.base_url}/api/misystem/set_sys_time?time={formatted_time}&timezone=CST-8"
-            
-            print("步骤 7.1: 发送时间重置请求...")
-            response = self.requests.get(url)
-            result = response.json()
-            print(f"响应数据: {self.json.dumps(result, ensure_ascii=False, separators=(',', ':'))}")
-            
-            if result.get('code') == 0:
-                print("✓ 时间重置成功")
-                print(f"当前时间已设置为: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                self.time.sleep(2)
-                return True
-            else:
-                print(f"\n❌ 时间重置失败: {result.get('msg', '未知错误')}")
-                return False
-
-        except Exception as e:
-            print(f"\n❌ 发生错误: {str(e)}")
-            return False
+        return self._drive(self._flow_reset_system_time())
 
     def show_hardening_notice(self):
         """
-        第8步: 显示硬固化提示信息
+        第9步: 显示硬固化提示信息
         """
         try:
-            print("\n第8步: SSH硬固化说明")
+            print("\n第9步: SSH硬固化说明")
             print("-" * 40)
-            self.time.sleep(2)
 
             print("\n[!] 重要提示")
             print("1. 路由器重启后，SSH访问权限会丢失")
@@ -556,6 +3068,847 @@ class RouterHack:
             print(f"\n❌ 发生错误: {str(e)}")
             return False
 
+class AsyncRouterHack(RouterCore):
+    """
+    RouterHack 的 asyncio 版本
+
+    步骤方法均为协程, 使用 aiohttp 非阻塞请求, 等待使用 asyncio.sleep,
+    单个事件循环即可同时处理大量路由器。流程与 RouterHack 共用 RouterCore, 只有 IO 不同;
+    任务被取消时 CancelledError 会直接向上传递。
+    """
+    def __init__(self, host, token, session=None, verbose=True, **options):
+        """
+        :param host: 路由器IP地址
+        :param token: 路由器stok令牌; 为空且提供了 password 时, 由 ensure_token() 登录获取
+        :param session: 共享的 aiohttp.ClientSession; 为空时自行创建, close() 时关闭
+        :param verbose: 是否输出每个请求的响应, 大批量并发时建议关闭
+        :param run_timeout / step_timeout: 时间预算, 由 provision_host_async 按 deadline 取消超时的步骤
+        其余参数与 RouterHack 相同 (不支持 cassette)
+        """
+        import asyncio
+        import aiohttp
+
+        self.asyncio = asyncio
+        self.aiohttp = aiohttp
+        self._timeout_errors = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+        self._check_errors = (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError)
+        super().__init__(host, token, **options)
+        self.verbose = verbose
+        self.session = session
+        self._owns_session = session is None
+
+    def _say(self, message):
+        if self.verbose and message.strip():
+            print(f"[{self.host}] {message.strip()}")
+
+    async def _drive(self, flow):
+        """
+        执行 RouterCore 的流程, 与 RouterHack._drive 相同, 操作以协程执行
+        """
+        value, error = None, None
+        while True:
+            try:
+                op = flow.throw(error) if error is not None else flow.send(value)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                value = await self._perform(op)
+            except Exception as e:
+                error = e
+
+    async def _perform(self, op):
+        kind = op[0]
+        if kind == "request":
+            _, method, url, data = op
+            return await self._request(method, url, data)
+        if kind == "sleep":
+            return await self.deadline.sleep_async(op[1])
+        if kind == "port_open":
+            return await self.ssh_port_open()
+        if kind == "blocking":
+            return await self._offload(op[1], *op[2:])
+        if kind == "sample_load":
+            return await self.sample_load()
+        raise ValueError(f"未知操作: {kind}")
+
+    async def _offload(self, func, *args):
+        """
+        在线程池中执行会阻塞的调用 (缓存文件、SQLite 检查点、paramiko)
+        """
+        return await self.asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _client(self):
+        """
+        返回 aiohttp 会话, 没有传入共享会话时在第一次使用时创建
+        """
+        if self.session is None:
+            self.session = self.aiohttp.ClientSession()
+        return self.session
+
+    def _client_timeout(self):
+        # 超时收紧到剩余的时间预算以内
+        connect, read = self.deadline.clamp(self.timeout)
+        return self.aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+    async def ensure_token(self):
+        """
+        没有 stok 时, 从缓存读取或使用密码登录
+        """
+        if self.token is None and self.password:
+            cached = self.token_cache.get(self.host) if self.token_cache else None
+            self._set_token(cached or await self.login())
+
+    async def login(self):
+        """
+        使用管理后台密码登录, 返回新的 stok 并写入缓存
+        """
+        page = (await self._send("GET", f"http://{self.host}/cgi-bin/luci/web")).decode("utf-8", "replace")
+        form = login_form(page, self.password)
+        result = self.json.loads(await self._send(
+            "POST", f"http://{self.host}/cgi-bin/luci/api/xqsystem/login", form))
+        if result.get("code") != 0 or not result.get("token"):
+            raise LoginError(f"登录失败: {result.get('msg', result.get('code'))}")
+        if self.token_cache:
+            self.token_cache.set(self.host, result["token"])
+        return result["token"]
+
+    async def _request(self, method, url, data=None):
+        """
+        发送请求并解析 JSON 响应; 提供了密码时, stok 过期 (3001) 会自动重新登录并重发一次
+        """
+        result = self.json.loads(await self._send(method, url, data))
+        if self.password and url.startswith(self.base_url) \
+                and isinstance(result, dict) and result.get("code") == 3001:
+            old_base = self.base_url
+            if self.token_cache:
+                self.token_cache.invalidate(self.host)
+            self._set_token(await self.login())
+            result = self.json.loads(await self._send(method, self.base_url + url[len(old_base):], data))
+        return result
+
+    async def _send(self, method, url, data=None):
+        """
+        发送请求, 返回响应内容
+        """
+        session = self._client()
+        timeout = self._client_timeout()
+        endpoint = (url[len(self.base_url):] if url.startswith(self.base_url) else url).split('?')[0]
+        if self.pacer is not None:
+            delay = self.pacer.reserve()
+            if delay > 0:
+                with self.trace("pace", "wait", rate=round(self.pacer.rate, 2)):
+                    await self.deadline.sleep_async(delay)
+        with self.trace(f"{method} {endpoint}", "http", method=method) as span:
+            started = self.time.monotonic()
+            try:
+                async with session.request(method, url, data=data, timeout=timeout) as response:
+                    body = await response.read()
+            except self._timeout_errors:
+                if self.pacer is not None:
+                    self.pacer.congested()
+                if self.metrics is not None:
+                    self.metrics.request_error(method, endpoint)
+                # 超时被收紧到剩余预算时, 按超出预算处理
+                self.deadline.check()
+                raise
+            seconds = self.time.monotonic() - started
+            span["status"] = response.status
+            span["bytes"] = len(body)
+            if self.pacer is not None or self.metrics is not None:
+                try:
+                    code = self.json.loads(body).get("code")
+                except (ValueError, AttributeError):
+                    code = None
+                if self.pacer is not None:
+                    self.pacer.observe(endpoint, seconds, congested=code == -101)
+                if self.metrics is not None:
+                    self.metrics.response(method, endpoint, seconds, code)
+            return body
+
+    async def sample_load(self):
+        """
+        读取 /api/misystem/status 中的 CPU 负载并交给 pacer, 与 RouterHack.sample_load 相同
+        """
+        try:
+            async with self._client().get(f"{self.base_url}/api/misystem/status",
+                                          timeout=self._client_timeout()) as response:
+                load = cpu_load(self.json.loads(await response.read()))
+        except (self.aiohttp.ClientError, self.asyncio.TimeoutError, ValueError):
+            load = None
+        self.pacer.observe_load(load)
+        if load is not None:
+            self._say(f"路由器 CPU 负载: {load:.0%}, 请求速率上限: {self.pacer.rate:.1f} 次/秒")
+
+    async def ssh_port_open(self):
+        """
+        探测路由器 SSH 端口是否已经可以连接
+        """
+        try:
+            _, writer = await self.asyncio.wait_for(
+                self.asyncio.open_connection(self.host.split(':')[0], self.ssh_port),
+                self.deadline.clamp(self.timeout[0]))
+        except (OSError, self.asyncio.TimeoutError):
+            return False
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return True
+
+    async def fetch_fac_info(self):
+        return await self._drive(self._flow_fetch_fac_info())
+
+    async def plan_recovery(self):
+        return await self._drive(self._flow_plan_recovery())
+
+    async def preflight(self):
+        """
+        第1步补充: 兼容性预检
+        """
+        return await self._drive(self._flow_preflight())
+
+    async def load_checkpoints(self):
+        """
+        第1步补充: 识别路由器并读取步骤检查点
+        """
+        return await self._drive(self._flow_load_checkpoints())
+
+    async def clear_checkpoints(self):
+        await self._drive(self._flow_clear_checkpoints())
+
+    async def record_capability(self, ssh):
+        await self._drive(self._flow_record_capability(ssh))
+
+    async def set_system_time(self):
+        """
+        第2步: 设置系统时间
+        """
+        return await self._drive(self._flow_set_system_time())
+
+    async def unlock_dropbear(self):
+        """
+        第3步: 解锁dropbear配置
+        """
+        return await self._drive(self._flow_run_scenes("unlock_dropbear", "解锁dropbear配置"))
+
+    async def activate_ssh(self):
+        """
+        第4步: 使用 nvram 激活 ssh_en 配置项
+        """
+        return await self._drive(self._flow_run_scenes("activate_ssh", "使用 nvram 激活 ssh_en 配置项"))
+
+    async def start_dropbear(self):
+        """
+        第5步: 启动 dropbear 服务
+        """
+        return await self._drive(self._flow_run_scenes("start_dropbear", "启动 dropbear 服务"))
+
+    async def run_batch(self, steps=None, slot=None):
+        return await self._drive(self._flow_run_batch(steps, slot))
+
+    async def verify_ssh(self):
+        """
+        第6步: 验证 SSH 连接; paramiko 是阻塞库, 握手在默认线程池中执行
+        """
+        return await self._drive(self._flow_verify_ssh())
+
+    async def deploy(self):
+        """
+        第6步补充: 上传部署清单中的文件
+        """
+        return await self._drive(self._flow_deploy())
+
+    async def run_ssh_commands(self):
+        """
+        第6步补充: 通过 SSH 执行 ssh_commands
+        """
+        return await self._drive(self._flow_run_ssh_commands())
+
+    async def reset_system_time(self):
+        """
+        第8步: 重置路由器时间为当前时间
+        """
+        return await self._drive(self._flow_reset_system_time())
+
+    async def cleanup_scenes(self):
+        return await self._drive(self._flow_cleanup_scenes())
+
+    async def close(self):
+        """
+        关闭自行创建的 aiohttp 会话
+        """
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self._ssh_executor is not None:
+            self._ssh_executor.close()
+
+def provision_steps(router, batch=False):
+    """
+    返回配置流程(第2~5步)的步骤列表
+    :param router: RouterHack 实例
+    :param batch: 是否使用批量模式
+    """
+    if batch:
+        steps = [
+            ("设置系统时间", router.set_system_time),
+            ("批量执行root命令", router.run_batch)
+        ]
+    else:
+        steps = [
+            ("设置系统时间", router.set_system_time),
+            ("解锁dropbear配置", router.unlock_dropbear),
+            ("激活SSH", router.activate_ssh),
+            ("启动dropbear服务", router.start_dropbear)
+        ]
+    if router.checkpoints is not None and router.resume:
+        steps.insert(0, ("读取检查点", router.load_checkpoints))
+    if router.ssh_verify:
+        steps.append(("验证SSH连接", router.verify_ssh))
+    if router.deploy_manifest:
+        steps.append(("上传文件", router.deploy))
+    if router.ssh_commands:
+        steps.append(("执行SSH命令", router.run_ssh_commands))
+    return steps
+
+def load_inventory(path):
+    """
+    读取路由器清单文件
+    支持 CSV (表头: host,token,password) 与 JSON (对象列表) 两种格式
+    :return: [{"host": ..., "token": ..., "password": ...}, ...]
+    """
+    import csv
+    import json
+
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith(".json"):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+
+    inventory = []
+    for row in rows:
+        host = (row.get("host") or "").strip()
+        if not host:
+            continue
+        inventory.append({
+            "host": host,
+            "token": (row.get("token") or row.get("stok") or "").strip() or None,
+            "password": (row.get("password") or "").strip() or None,
+        })
+    return inventory
+
+class _ThreadOutput:
+    """
+    按线程分流的 stdout: 工作线程的输出写入各自的缓冲区, 其余线程照常输出
+    """
+    def __init__(self, stream):
+        import threading
+        self.stream = stream
+        self.local = threading.local()
+
+    def capture(self):
+        import io
+        self.local.buffer = io.StringIO()
+        return self.local.buffer
+
+    def release(self):
+        self.local.buffer = None
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is not None:
+            return buffer.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+def provision_host(entry, batch=False, output=None, router_options=None):
+    """
+    在一台路由器上执行完整的配置流程, 不做任何交互
+    :param entry: 清单中的一项; 可包含 cassette (Cassette 实例), 录制或回放本次运行;
+                  recover 为真时 (看门狗) 先读取 fac_info, 只执行重启后失效的步骤
+    :param output: _ThreadOutput, 用于收集该主机的输出
+    :param router_options: 传给 RouterHack 的其他参数
+    :return: 结果 dict
+    """
+    import time
+
+    result = {"host": entry["host"], "ok": False, "failed_step": None, "failure": None,
+              "error": None, "steps": []}
+    log = output.capture() if output else None
+    started = time.monotonic()
+    router = None
+    try:
+        if not (entry.get("token") or entry.get("password")):
+            result["error"] = "缺少 stok 或管理后台密码"
+            result["failure"] = "usage"
+            return result
+        router = RouterHack(entry["host"], entry.get("token"), password=entry.get("password"),
+                            cassette=entry.get("cassette"), **(router_options or {}))
+        steps = provision_steps(router, batch) + [("重置路由器时间", router.reset_system_time)]
+        if entry.get("recover"):
+            steps.insert(0, ("确认需要恢复的步骤", router.plan_recovery))
+        if router.capability_cache is not None:
+            steps.insert(0, ("兼容性检查", router.preflight))
+        for step_name, step_func in steps:
+            step_started = time.monotonic()
+            router.deadline.start_step()
+            with router.trace(step_name) as span:
+                ok = span["ok"] = step_func()
+            result["steps"].append({"name": step_name, "ok": ok,
+                                    "seconds": round(time.monotonic() - step_started, 3)})
+            if router.metrics is not None:
+                router.metrics.step(step_func.__name__, time.monotonic() - step_started,
+                                    (router.fingerprint or {}).get("hardware"))
+            if not ok:
+                result["failed_step"] = step_name
+                result["failure"] = router.failure or "error"
+                return result
+        result["ok"] = True
+        router.clear_checkpoints()
+        return result
+    except Exception as e:
+        result["error"] = str(e)
+        result["failure"] = classify_exception(e)
+        return result
+    finally:
+        if router:
+            if result["failure"] == "timeout":
+                # 超出时间预算: 在宽限时间内仍把路由器时间改回来, 并清理场景
+                router.deadline.grace()
+                ran = {step["name"] for step in result["steps"]}
+                if "设置系统时间" in ran and "重置路由器时间" not in ran:
+                    result["time_reset"] = router.reset_system_time()
+            # 成功与失败都清理本次注册的场景
+            result["cleanup"] = router.cleanup_scenes()
+            router.close()
+            result["ssh_ready_seconds"] = router.ssh_ready_seconds
+            if router.pacer is not None:
+                result["request_rate"] = round(router.pacer.rate, 2)
+            if router.command_results is not None:
+                result["commands"] = router.command_results
+            if router.deploy_results is not None:
+                result["deploy"] = router.deploy_results
+        result["seconds"] = round(time.monotonic() - started, 3)
+        metrics = (router_options or {}).get("metrics")
+        if metrics is not None:
+            metrics.run(result, ((router and router.fingerprint) or {}).get("hardware"))
+        if router and router.cassette is not None and not router.cassette.replaying:
+            router.cassette.finish(router, batch, result)
+        if output:
+            result["log"] = log.getvalue()
+            output.release()
+
+def cassette_paths(paths):
+    """
+    展开 --replay 的参数: 目录替换为其中的 .jsonl / .jsonl.gz 文件
+    """
+    import os
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.endswith((".jsonl", ".jsonl.gz")))
+        else:
+            files.append(path)
+    return files
+
+def replay_cassette(path, output=None):
+    """
+    按录制时的参数, 在录制的会话上重新运行配置流程 (不连接路由器)
+    :return: (本次结果, 录制时的结果)
+    """
+    import os
+    import tempfile
+
+    cassette = Cassette.load(path)
+    options = cassette.meta.get("options", {})
+    entry = {
+        "host": cassette.meta.get("host", "127.0.0.1"),
+        "token": None if options.get("login") else "<stok>",
+        "password": "<redacted>" if options.get("password") else None,
+        "cassette": cassette,
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        router_options = {
+            "ssh_port": options.get("ssh_port", 22),
+            "settle_delay": options.get("settle_delay", 0.5),
+            "ready_timeout": options.get("ready_timeout", 30),
+            "ssh_verify": options.get("ssh_verify", False),
+            "ssh_password": "<redacted>" if options.get("ssh_password") else None,
+            "ssh_commands": options.get("ssh_commands"),
+            # 上传结果已录制, 回放时不需要文件内容
+            "deploy_manifest": options.get("deploy"),
+            "run_timeout": options.get("run_timeout"),
+            "step_timeout": options.get("step_timeout"),
+            # 兼容性结论已录制, 回放产生的检测结果写入临时文件
+            "capability_cache": CapabilityCache(os.path.join(tmp, "capabilities.json"))
+                                if options.get("preflight") else None,
+            # 检查点同样写入临时数据库, 读取检查点与识别路由器的请求与录制时一致
+            "checkpoints": CheckpointStore(os.path.join(tmp, "checkpoints.db"))
+                           if options.get("checkpoints") else None,
+            "pacing": False,
+        }
+        # 使用录制时的型号参数, 不受本机 --profiles 与内置参数后来的调整影响
+        fingerprint = cassette.meta.get("fingerprint") or {}
+        if options.get("profile") and fingerprint.get("hardware"):
+            router_options["profile_overrides"] = {
+                f"{fingerprint['hardware']}/{fingerprint.get('rom')}": options["profile"]}
+        result = provision_host(entry, options.get("batch", False), output, router_options)
+    return result, cassette.meta.get("result")
+
+def run_replay(paths):
+    """
+    回放全部录制文件, 比较结果是否与录制时一致
+    :return: 进程退出码, 全部一致时为 0
+    """
+    import time
+
+    files = cassette_paths(paths)
+    output = _ThreadOutput(sys.stdout)
+    sys.stdout = output
+    mismatched = 0
+    started = time.monotonic()
+    try:
+        for path in files:
+            try:
+                result, expected = replay_cassette(path, output)
+            except (OSError, ValueError) as e:
+                mismatched += 1
+                print(f"✗ {path}: 无法读取回放记录: {e}")
+                continue
+            actual = replay_outcome(result)
+            if actual == expected:
+                status = "成功" if actual["ok"] else f"失败于 {actual['failed_step']} ({actual['failure']})"
+                print(f"✓ {path}: 与录制一致, {status}")
+                continue
+            mismatched += 1
+            print(f"✗ {path}: 与录制不一致")
+            print(f"  录制: {expected}")
+            print(f"  回放: {actual}")
+            for line in result.get("log", "").splitlines():
+                print(f"  | {line}")
+    finally:
+        sys.stdout = output.stream
+    print(f"\n回放 {len(files)} 个记录, {len(files) - mismatched} 个一致, "
+          f"耗时 {time.monotonic() - started:.3f}s")
+    return 0 if files and not mismatched else 1
+
+def run_fleet(inventory, workers=16, batch=False, report=None, router_options=None):
+    """
+    并发配置清单中的所有路由器
+    :param inventory: load_inventory() 的返回值
+    :param workers: 最大并发数
+    :param report: 汇总报告(JSON)的保存路径
+    :param router_options: 传给 RouterHack 的其他参数
+    :return: 每台路由器的结果列表
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    output = _ThreadOutput(sys.stdout)
+    sys.stdout = output
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(provision_host, entry, batch, output, router_options) for entry in inventory]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                results.append(result)
+                mark = "✓" if result["ok"] else "✗"
+                print(f"[{done}/{len(futures)}] {mark} {result['host']} ({result['seconds']}s)")
+    finally:
+        sys.stdout = output.stream
+
+    print_fleet_summary(results, report)
+    return results
+
+def print_fleet_summary(results, report=None):
+    """
+    打印清单模式的结果汇总, 并按需保存 JSON 报告
+    """
+    import json
+
+    succeeded = [r for r in results if r["ok"]]
+    failed = [r for r in results if not r["ok"]]
+    print("\n=== 批量配置结果 ===")
+    print(f"成功: {len(succeeded)}  失败: {len(failed)}  共计: {len(results)}")
+    for r in sorted(failed, key=lambda r: r["host"]):
+        print(f"✗ {r['host']}: {r['failed_step'] or r['error']}")
+    ready = sorted(r["ssh_ready_seconds"] for r in succeeded if r.get("ssh_ready_seconds") is not None)
+    if ready:
+        print(f"SSH 就绪耗时: 中位 {ready[len(ready) // 2]}s  最长 {ready[-1]}s")
+
+    if report:
+        with open(report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"详细报告已保存到: {report}")
+
+async def provision_host_async(entry, session, semaphore, router_options=None):
+    """
+    provision_host 的 asyncio 版本
+    """
+    import asyncio
+    import time
+
+    result = {"host": entry["host"], "ok": False, "failed_step": None, "failure": None,
+              "error": None, "steps": []}
+    started = time.monotonic()
+    router = None
+    try:
+        async with semaphore:
+            if not (entry.get("token") or entry.get("password")):
+                result["error"] = "缺少 stok 或管理后台密码"
+                result["failure"] = "usage"
+                return result
+            router = AsyncRouterHack(entry["host"], entry.get("token"), session=session, verbose=False,
+                                     password=entry.get("password"), **(router_options or {}))
+            await asyncio.wait_for(router.ensure_token(), router.deadline.remaining())
+            steps = [
+                ("设置系统时间", router.set_system_time),
+                ("解锁dropbear配置", router.unlock_dropbear),
+                ("激活SSH", router.activate_ssh),
+                ("启动dropbear服务", router.start_dropbear),
+            ]
+            if router.ssh_verify:
+                steps.append(("验证SSH连接", router.verify_ssh))
+            if router.deploy_manifest:
+                steps.append(("上传文件", router.deploy))
+            if router.ssh_commands:
+                steps.append(("执行SSH命令", router.run_ssh_commands))
+            steps.append(("重置路由器时间", router.reset_system_time))
+            if router.checkpoints is not None and router.resume:
+                steps.insert(0, ("读取检查点", router.load_checkpoints))
+            if router.capability_cache is not None:
+                steps.insert(0, ("兼容性检查", router.preflight))
+            for step_name, step_func in steps:
+                step_started = time.monotonic()
+                router.deadline.start_step()
+                with router.trace(step_name) as span:
+                    try:
+                        # 超出预算时取消正在执行的步骤
+                        ok = span["ok"] = await asyncio.wait_for(step_func(), router.deadline.remaining())
+                    except asyncio.TimeoutError:
+                        ok = span["ok"] = False
+                        router._fail("timeout")
+                result["steps"].append({"name": step_name, "ok": ok,
+                                        "seconds": round(time.monotonic() - step_started, 3)})
+                if router.metrics is not None:
+                    router.metrics.step(step_func.__name__, time.monotonic() - step_started,
+                                        (router.fingerprint or {}).get("hardware"))
+                if not ok:
+                    result["failed_step"] = step_name
+                    result["failure"] = router.failure or "error"
+                    return result
+            result["ok"] = True
+            await router.clear_checkpoints()
+            return result
+    except asyncio.TimeoutError:
+        result["error"] = "登录超出时间预算"
+        result["failure"] = "timeout"
+        return result
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+        result["failure"] = classify_exception(e)
+        return result
+    finally:
+        if router:
+            grace = None
+            if result["failure"] == "timeout":
+                grace = DEADLINE_GRACE
+                router.deadline.grace(grace)
+                ran = {step["name"] for step in result["steps"]}
+                if "设置系统时间" in ran and "重置路由器时间" not in ran:
+                    try:
+                        result["time_reset"] = await asyncio.wait_for(router.reset_system_time(), grace)
+                    except asyncio.TimeoutError:
+                        result["time_reset"] = False
+            try:
+                result["cleanup"] = await asyncio.wait_for(router.cleanup_scenes(), grace)
+            except asyncio.TimeoutError:
+                result["cleanup"] = False
+            await router.close()
+            result["ssh_ready_seconds"] = router.ssh_ready_seconds
+            if router.pacer is not None:
+                result["request_rate"] = round(router.pacer.rate, 2)
+            if router.command_results is not None:
+                result["commands"] = router.command_results
+            if router.deploy_results is not None:
+                result["deploy"] = router.deploy_results
+        result["seconds"] = round(time.monotonic() - started, 3)
+        metrics = (router_options or {}).get("metrics")
+        if metrics is not None:
+            metrics.run(result, ((router and router.fingerprint) or {}).get("hardware"))
+
+async def run_fleet_async(inventory, concurrency=1000, report=None, router_options=None):
+    """
+    在单个事件循环中并发配置清单中的所有路由器
+    :param concurrency: 同时进行配置的路由器数量上限
+    :param router_options: 传给 AsyncRouterHack 的其他参数
+    """
+    import asyncio
+    import aiohttp
+
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=4)
+    results = []
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [asyncio.ensure_future(provision_host_async(entry, session, semaphore, router_options))
+                 for entry in inventory]
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            result = await task
+            results.append(result)
+            mark = "✓" if result["ok"] else "✗"
+            print(f"[{done}/{len(tasks)}] {mark} {result['host']} ({result['seconds']}s)")
+    print_fleet_summary(results, report)
+    return results
+
+def run_watch(inventory, interval=15, workers=16, batch=False, router_options=None, metrics_file=None):
+    """
+    看门狗模式: 持续探测清单中路由器的 SSH 端口, 路由器重启导致 SSH 失效时自动恢复
+
+    探测只建立一次 TCP 连接, 由单个事件循环完成, 每台路由器的探测间隔带随机抖动,
+    数千台路由器的探测均匀分散开; 连续两次探测失败才视为失效。随后按较短的间隔探测 fac_info,
+    路由器启动完成、Web 服务响应后立即在线程池中执行 provision_host (recover=True),
+    只重新执行重启后失效的步骤。按 Ctrl+C 退出。
+    :param interval: 探测间隔(秒), 实际间隔在 0.8~1.2 倍之间随机
+    :param workers: 同时进行恢复的路由器数量上限
+    :param metrics_file: 每次恢复后写入指标的文件
+    :return: 进程退出码
+    """
+    import asyncio
+    import random
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    # 续跑的检查点记录的是重启之前的状态, 恢复时不能使用
+    router_options = dict(router_options or {}, resume=False)
+    metrics = router_options.get("metrics")
+    ssh_port = router_options.get("ssh_port", 22)
+    probe_timeout = 3
+    stats = {"outages": 0, "recovered": [], "failed": 0}
+    output = _ThreadOutput(sys.stdout)
+
+    def event(host, message):
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {host} {message}")
+        output.flush()
+
+    async def port_open(address, semaphore):
+        async with semaphore:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(address, ssh_port), probe_timeout)
+            except (OSError, asyncio.TimeoutError):
+                return False
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+            return True
+
+    async def web_up(entry, semaphore):
+        """
+        请求 fac_info, 返回路由器的 Web 服务是否已经响应; 重启后 stok 失效, 不要求请求成功
+        """
+        address, _, port = entry["host"].partition(":")
+        path = f"/cgi-bin/luci/;stok={entry.get('token') or ''}/api/xqsystem/fac_info"
+        async with semaphore:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(address, int(port or 80)), probe_timeout)
+            except (OSError, asyncio.TimeoutError):
+                return False
+            try:
+                writer.write(f"GET {path} HTTP/1.0\r\nHost: {entry['host']}\r\n\r\n".encode())
+                await writer.drain()
+                return (await asyncio.wait_for(reader.readline(), probe_timeout)).startswith(b"HTTP/")
+            except (OSError, asyncio.TimeoutError):
+                return False
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+
+    async def watch_host(entry, semaphore, pool):
+        loop = asyncio.get_running_loop()
+        host = entry["host"]
+        address = host.split(":")[0]
+        failures = 0
+        # 启动时把各台路由器的首次探测分散到一个间隔内
+        await asyncio.sleep(random.uniform(0, interval))
+        while True:
+            if await port_open(address, semaphore):
+                failures = 0
+                await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+                continue
+            detected = time.monotonic()
+            # 再确认一次, 避免偶发的连接失败触发恢复
+            await asyncio.sleep(2)
+            if await port_open(address, semaphore):
+                continue
+
+            if failures == 0:
+                stats["outages"] += 1
+                event(host, "SSH 端口无法连接, 开始恢复")
+            # 路由器仍在启动时恢复必然失败, 还会拉长退避; 等 fac_info 有响应再开始
+            booting = False
+            while not await web_up(entry, semaphore):
+                if not booting:
+                    booting = True
+                    event(host, "路由器无响应, 等待启动完成")
+                await asyncio.sleep(min(interval, 5) * random.uniform(0.8, 1.2))
+            result = await loop.run_in_executor(pool, provision_host, dict(entry, recover=True),
+                                                batch, output, router_options)
+            seconds = time.monotonic() - detected
+            if metrics is not None:
+                metrics.recovery(result, seconds)
+                if metrics_file:
+                    metrics.write(metrics_file)
+            if result["ok"]:
+                failures = 0
+                stats["recovered"].append(seconds)
+                event(host, f"✓ SSH 已恢复, 耗时 {seconds:.1f}s")
+                await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+                continue
+
+            failures += 1
+            stats["failed"] += 1
+            event(host, f"✗ 恢复失败: {result['failed_step'] or result['error']}")
+            if result["failure"] in ("usage", "unsupported"):
+                # 重试也无法成功, 不再看守这台路由器
+                event(host, "停止看守")
+                return
+            await asyncio.sleep(retry_delay(failures, base=5, cap=max(interval * 20, 60)))
+
+    async def watch_all(pool):
+        # 限制同时进行的探测数量, 避免超出文件描述符上限
+        semaphore = asyncio.Semaphore(512)
+        await asyncio.gather(*(watch_host(entry, semaphore, pool) for entry in inventory))
+
+    print(f"看门狗已启动: {len(inventory)} 台路由器, 探测间隔约 {interval}s, 按 Ctrl+C 退出")
+    pool = ThreadPoolExecutor(max_workers=workers)
+    sys.stdout = output
+    try:
+        asyncio.run(watch_all(pool))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout = output.stream
+        print("\n等待进行中的恢复完成...")
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    recovered = sorted(stats["recovered"])
+    print("\n=== 看门狗汇总 ===")
+    print(f"SSH 失效: {stats['outages']} 次  已恢复: {len(recovered)} 次  恢复失败: {stats['failed']} 次")
+    if recovered:
+        print(f"恢复耗时: 中位 {recovered[len(recovered) // 2]:.1f}s  最长 {recovered[-1]:.1f}s")
+    return 0
+
 def show_welcome_banner():
     """
     显示欢迎界面并等待用户确认
@@ -614,26 +3967,325 @@ def show_welcome_banner():
         else:
             print("无效的输入，请输入 Y 或 n")
 
+def load_commands(path):
+    """
+    读取命令文件, 每行一条, 忽略空行与 # 开头的行
+    """
+    if not path:
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+def load_manifest(path):
+    """
+    读取部署清单 (JSON): [{"src": 本地文件, "dest": 路由器上的绝对路径, "mode": "755"}, ...]
+    src 为相对路径时相对清单文件所在目录; mode 为八进制字符串, 默认 644
+    :return: [{"src", "dest", "mode", "data", "md5"}, ...], 文件内容与 md5 只读取、计算一次
+    """
+    import hashlib
+    import json
+    import os
+    if not path:
+        return []
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    files, seen = [], set()
+    for entry in entries:
+        if not entry.get("src") or not str(entry.get("dest", "")).startswith("/"):
+            raise ValueError(f"{path}: 每一项都需要 src 与以 / 开头的 dest: {entry}")
+        if entry["dest"] in seen:
+            raise ValueError(f"{path}: dest 重复: {entry['dest']}")
+        seen.add(entry["dest"])
+        src = os.path.join(base, entry["src"])
+        with open(src, "rb") as f:
+            data = f.read()
+        files.append({"src": src, "dest": entry["dest"], "mode": int(str(entry.get("mode", "644")), 8),
+                      "data": data, "md5": hashlib.md5(data).hexdigest()})
+    return files
+
+def dependency_extras(args):
+    """
+    命令行参数启用的功能额外需要的依赖包
+    """
+    extra = []
+    if not args.no_ssh_verify or args.ssh_command or args.ssh_commands or args.deploy:
+        extra.append('paramiko')
+    if args.inventory and args.use_async:
+        extra.append('aiohttp')
+    return tuple(extra)
+
 def main():
     """
     主函数 - 按引导步骤执行
     """
+    import argparse
+    import os
+    parser = argparse.ArgumentParser(description="小米/红米路由器SSH开启工具")
+    parser.add_argument("--batch", action="store_true",
+                        help="批量模式: 将全部 root 命令合并为一个场景执行")
+    parser.add_argument("--inventory", metavar="FILE",
+                        help="路由器清单文件 (CSV/JSON), 并发配置清单中的全部路由器")
+    parser.add_argument("--workers", type=int, default=16,
+                        help="清单模式下的最大并发数 (默认 16)")
+    parser.add_argument("--report", metavar="FILE",
+                        help="清单模式下保存 JSON 汇总报告的路径")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="清单模式下使用 asyncio 引擎, 单线程处理全部路由器 (--workers 为并发上限)")
+    parser.add_argument("--watch", action="store_true",
+                        help="看门狗模式: 持续探测清单中路由器的 SSH 端口, 路由器重启后自动重新开启 SSH "
+                             "(需要 --inventory)")
+    parser.add_argument("--watch-interval", type=float, default=15,
+                        help="看门狗模式下每台路由器的探测间隔(秒), 带随机抖动 (默认 15)")
+    parser.add_argument("--ssh-port", type=int, default=22,
+                        help="路由器 SSH 端口, 用于确认 dropbear 已启动 (默认 22)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="记录每个步骤与 HTTP 请求的耗时, 以 JSON Lines 格式保存")
+    parser.add_argument("--chrome-trace", metavar="FILE",
+                        help="以 Chrome trace-event 格式保存追踪记录, 可在 Perfetto 中打开")
+    parser.add_argument("--skip-preflight", action="store_true",
+                        help="跳过修改路由器之前的兼容性预检")
+    parser.add_argument("--capability-cache", metavar="FILE",
+                        help="兼容性检测结果缓存文件 (默认 ~/.cache/xiaomi-router-ssh/capabilities.json)")
+    parser.add_argument("--resume", action="store_true",
+                        help="续跑: 跳过之前运行中已确认生效的步骤")
+    parser.add_argument("--checkpoint-db", metavar="FILE",
+                        help="步骤检查点数据库 (默认 ~/.cache/xiaomi-router-ssh/checkpoints.db)")
+    parser.add_argument("--password", default=os.environ.get("MIWIFI_PASSWORD"),
+                        help="管理后台密码, 用于自动登录获取 stok 及过期后续期; "
+                             "清单中未填写密码的路由器也使用它 (默认读取环境变量 MIWIFI_PASSWORD)")
+    parser.add_argument("--token-cache", metavar="FILE",
+                        help="登录得到的 stok 缓存文件 (默认 ~/.cache/xiaomi-router-ssh/tokens.json)")
+    parser.add_argument("--no-ssh-verify", action="store_true",
+                        help="启动 dropbear 后不通过 SSH 握手验证 (不需要 paramiko)")
+    parser.add_argument("--ssh-password", default=os.environ.get("MIWIFI_SSH_PASSWORD"),
+                        help="root 的 SSH 密码, 提供时验证能否登录 (默认读取环境变量 MIWIFI_SSH_PASSWORD)")
+    parser.add_argument("--ssh-command", action="append", default=[], metavar="CMD",
+                        help="SSH 开启后通过 SSH 执行的命令, 可重复指定; 全部命令共用一条连接并行执行 "
+                             "(需要 --ssh-password)")
+    parser.add_argument("--ssh-commands", metavar="FILE",
+                        help="从文件读取要执行的命令, 每行一条, 忽略空行与 # 开头的行")
+    parser.add_argument("--deploy", metavar="FILE",
+                        help="部署清单 (JSON), SSH 开启后通过 SFTP 上传其中的文件, 路由器上 md5 一致的文件跳过 "
+                             "(需要 --ssh-password)")
+    parser.add_argument("--deploy-compress", action="store_true",
+                        help="上传文件时请求 SSH zlib 压缩, 适合脚本、配置等文本文件")
+    parser.add_argument("--retries", type=int,
+                        help="smartcontroller 繁忙 (-101) 与请求超时的最多重试次数 (默认分别为 "
+                             f"{RETRY_POLICY[-101]} 与 {RETRY_POLICY['timeout']}), 0 表示不重试")
+    parser.add_argument("--breaker-threshold", type=int, default=5,
+                        help="同一路由器连续失败多少次后熔断, 0 表示不熔断 (默认 5)")
+    parser.add_argument("--breaker-cooldown", type=float, default=30,
+                        help="熔断持续时间(秒), 期间对该路由器的请求直接失败 (默认 30)")
+    parser.add_argument("--max-rate", type=float,
+                        help="向每台路由器发送请求的最高速率(次/秒); 出现 -101、超时或延迟升高时自动减半, "
+                             "恢复正常后逐步加回 (默认按型号配置, 未知型号为 50)")
+    parser.add_argument("--pace-load", action="store_true",
+                        help="每 5 秒读取一次路由器 CPU 负载, 负载过高时同样放慢请求")
+    parser.add_argument("--no-pace", action="store_true", help="不限制请求速率")
+    parser.add_argument("--run-timeout", type=float, metavar="SECONDS",
+                        help="每台路由器整个配置流程的时间预算(秒), 用尽时取消并仍尝试重置路由器时间, "
+                             "以退出码 11 (timeout) 报告")
+    parser.add_argument("--step-timeout", type=float, metavar="SECONDS",
+                        help="每个步骤的时间预算(秒), 用尽时同样取消本次运行")
+    parser.add_argument("--profiles", metavar="FILE",
+                        help="自定义型号参数 (JSON), 按 \"型号\" 或 \"型号/ROM\" 覆盖内置的等待时间、"
+                             "请求速率与需要执行的步骤")
+    parser.add_argument("--record", metavar="PATH",
+                        help="录制本次运行的全部 HTTP 请求与响应 (stok、密码等替换为占位符); "
+                             "以 .gz 结尾时压缩保存; 清单模式下为目录, 每台路由器一个文件")
+    parser.add_argument("--replay", nargs="+", metavar="FILE",
+                        help="不连接路由器, 在录制文件 (或目录中的全部录制文件) 上回放配置流程, "
+                             "检查结果是否与录制时一致")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="在该端口提供 Prometheus/OpenMetrics 抓取接口 (/metrics), 统计运行结果、"
+                             "smartcontroller 响应码与各步骤、各接口的耗时分布")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help="运行结束时将指标写入文件 (Prometheus 文本格式), 供 node_exporter textfile 采集")
+    parser.add_argument("--no-dep-check", action="store_true",
+                        help="跳过启动时的依赖检查")
+    parser.add_argument("--url", help="无人值守模式: 管理后台链接 (含 stok)")
+    parser.add_argument("--host", help="无人值守模式: 路由器地址, 配合 --token 或 --password 使用")
+    parser.add_argument("--token", help="无人值守模式: 管理后台 stok")
+    parser.add_argument("--yes", "-y", action="store_true",
+                        help="无人值守、清单与回放模式: 不询问, 缺少依赖时自动安装")
+    parser.add_argument("--json", action="store_true",
+                        help="无人值守模式: 向标准输出打印 JSON 结果, 过程信息改为输出到标准错误")
+    args = parser.parse_args()
+    if args.inventory and (args.url or args.host):
+        parser.error("--inventory 不能与 --url/--host 同时使用")
+    if args.url and (args.host or args.token):
+        parser.error("--url 不能与 --host/--token 同时使用")
+    if args.token and not args.host:
+        parser.error("--token 需要配合 --host 使用")
+    if args.replay and (args.inventory or args.url or args.host or args.record):
+        parser.error("--replay 不能与 --inventory/--url/--host/--record 同时使用")
+    if args.record and not (args.inventory or args.url or args.host):
+        parser.error("--record 需要配合 --url/--host 或 --inventory 使用")
+    if args.use_async and not args.inventory:
+        parser.error("--async 需要配合 --inventory 使用")
+    if args.use_async and args.batch:
+        parser.error("--async 不支持 --batch")
+    if args.record and (args.use_async or args.resume):
+        parser.error("--record 不能与 --async/--resume 同时使用")
+    if args.watch and not args.inventory:
+        parser.error("--watch 需要配合 --inventory 使用")
+    if args.watch and (args.use_async or args.record or args.resume):
+        parser.error("--watch 不能与 --async/--record/--resume 同时使用")
+    if args.watch_interval <= 0:
+        parser.error("--watch-interval 必须大于 0")
+    if (args.run_timeout or args.step_timeout) and not (args.inventory or args.url or args.host):
+        parser.error("--run-timeout/--step-timeout 需要配合 --url/--host 或 --inventory 使用")
+    if any(value is not None and value <= 0 for value in (args.run_timeout, args.step_timeout)):
+        parser.error("--run-timeout/--step-timeout 必须大于 0")
+    if (args.metrics_port or args.metrics_file) and not (args.inventory or args.url or args.host):
+        parser.error("--metrics-port/--metrics-file 需要配合 --url/--host 或 --inventory 使用")
+    metrics = Metrics() if args.metrics_port or args.metrics_file else None
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    tracer = Tracer() if args.trace or args.chrome_trace else None
+    router_options = {
+        "ssh_port": args.ssh_port,
+        "tracer": tracer,
+        "resume": args.resume,
+        "ssh_verify": not args.no_ssh_verify,
+        "ssh_password": args.ssh_password,
+        "ssh_commands": args.ssh_command + load_commands(args.ssh_commands),
+        "retry_policy": None if args.retries is None else {kind: args.retries for kind in RETRY_POLICY},
+        "circuit_breaker": CircuitBreaker(args.breaker_threshold, args.breaker_cooldown)
+                           if args.breaker_threshold > 0 else None,
+        "pacing": False if args.no_pace else dict(
+            {"load_interval": 5 if args.pace_load else None},
+            **({"max_rate": args.max_rate} if args.max_rate else {})),
+        "metrics": metrics,
+        "run_timeout": args.run_timeout,
+        "step_timeout": args.step_timeout,
+    }
+    try:
+        router_options["profile_overrides"] = load_profiles(args.profiles)
+    except (OSError, ValueError) as e:
+        parser.error(f"无法读取 --profiles: {e}")
+    if router_options["ssh_commands"] and not args.ssh_password:
+        parser.error("--ssh-command/--ssh-commands 需要配合 --ssh-password 使用")
+    if args.deploy and not args.ssh_password:
+        parser.error("--deploy 需要配合 --ssh-password 使用")
+    try:
+        router_options["deploy_manifest"] = load_manifest(args.deploy)
+    except (OSError, ValueError) as e:
+        parser.error(f"无法读取 --deploy: {e}")
+    router_options["deploy_compress"] = args.deploy_compress
+
+    try:
+        # 回放模式: 只需要 requests
+        if args.replay:
+            if not args.no_dep_check and not install_dependencies(assume_yes=args.yes):
+                sys.exit(EXIT_CODES["dependency"])
+            sys.exit(run_replay(args.replay))
+
+        # 缓存与检查点只在会连接路由器的模式下创建, 回放与参数错误不会在本机留下文件
+        router_options.update({
+            "capability_cache": None if args.skip_preflight else CapabilityCache(args.capability_cache),
+            "checkpoints": CheckpointStore(args.checkpoint_db),
+            "token_cache": TokenCache(args.token_cache),
+        })
+
+        # 清单模式: 无人值守, 不显示欢迎界面
+        if args.inventory:
+            if not args.no_dep_check and not install_dependencies(dependency_extras(args), assume_yes=args.yes):
+                sys.exit(EXIT_CODES["dependency"])
+            inventory = load_inventory(args.inventory)
+            for entry in inventory:
+                entry["password"] = entry["password"] or args.password
+                if args.record:
+                    entry["cassette"] = Cassette(
+                        os.path.join(args.record, entry["host"].replace(":", "_") + ".jsonl.gz"))
+            if args.watch:
+                missing = [entry["host"] for entry in inventory if not entry["password"]]
+                if missing:
+                    print(f"[!] {len(missing)} 台路由器没有管理后台密码, 重启后 stok 失效将无法恢复: "
+                          f"{', '.join(missing[:5])}{' ...' if len(missing) > 5 else ''}")
+                sys.exit(run_watch(inventory, args.watch_interval, args.workers, args.batch,
+                                   router_options, args.metrics_file))
+            if args.use_async:
+                import asyncio
+                results = asyncio.run(run_fleet_async(inventory, args.workers, args.report, router_options))
+            else:
+                results = run_fleet(inventory, args.workers, args.batch, args.report, router_options)
+            sys.exit(0 if all(r["ok"] for r in results) else 1)
+
+        # 无人值守模式: 不显示欢迎界面与引导, 以退出码表示结果
+        if args.url or args.host:
+            sys.exit(run_headless(args, router_options))
+
+        run_interactive(args, router_options)
+    finally:
+        if tracer and args.trace:
+            tracer.write_jsonl(args.trace)
+        if tracer and args.chrome_trace:
+            tracer.write_chrome(args.chrome_trace)
+        if metrics and args.metrics_file:
+            metrics.write(args.metrics_file)
+
+def run_headless(args, router_options):
+    """
+    无人值守模式 - 按命令行参数配置一台路由器, 不读取标准输入
+    :return: 进程退出码, 见 EXIT_CODES
+    """
+    import json
+    # --json 时标准输出只保留 JSON 结果
+    out = sys.stdout
+    if args.json:
+        sys.stdout = sys.stderr
+
+    def finish(result):
+        result["exit_code"] = EXIT_CODES[result["failure"] or "ok"]
+        if args.json:
+            json.dump(result, out, ensure_ascii=False, indent=2)
+            out.write("\n")
+            out.flush()
+        return result["exit_code"]
+
+    try:
+        if args.url:
+            host, token = extract_host_token(args.url)
+        else:
+            host, token = args.host, args.token
+        result = {"host": host, "ok": False, "failed_step": None, "failure": None,
+                  "error": None, "steps": [], "seconds": 0}
+        if not host or not (token or args.password):
+            print("\n错误: 需要提供有效的 --url, 或 --host 加 --token/--password")
+            result["failure"] = "usage"
+            result["error"] = "missing host/token"
+            return finish(result)
+
+        if not args.no_dep_check and not install_dependencies(dependency_extras(args), assume_yes=args.yes):
+            result["failure"] = "dependency"
+            result["error"] = "missing dependencies"
+            return finish(result)
+
+        entry = {"host": host, "token": token, "password": args.password}
+        if args.record:
+            entry["cassette"] = Cassette(args.record)
+        result = provision_host(entry, args.batch, router_options=router_options)
+        result.pop("log", None)
+        if not result["ok"]:
+            print(f"\n✗ 配置失败: {result['failed_step'] or result['error']}")
+        else:
+            print(f"\n✓ 配置完成, 耗时 {result['seconds']}s")
+        return finish(result)
+    finally:
+        sys.stdout = out
+
+def run_interactive(args, router_options):
+    """
+    交互模式 - 按引导步骤配置一台路由器
+    """
     # 显示欢迎界面并等待用户确认
     if not show_welcome_banner():
         return
     
     # 首先检查并安装依赖
-    if not install_dependencies():
-        return
-    
-    # 在依赖安装完成后再导入所需模块
-    try:
-        import requests
-        import paramiko
-        import time
-        from datetime import datetime
-    except ImportError as e:
-        print(f"导入模块失败: {str(e)}")
+    if not args.no_dep_check and not install_dependencies(dependency_extras(args)):
         return
 
     print("\n开始执行自动化配置流程...")
@@ -677,45 +4329,54 @@ def main():
                 return
 
     # 创建RouterHack实例
-    router = RouterHack(host, token)
+    router = RouterHack(host, token, password=args.password, **router_options)
+
+    # 修改路由器之前先做兼容性检查
+    if router.capability_cache is not None and not router.preflight():
+        print("\n配置过程已终止")
+        return
     
     # 执行配置步骤
-    steps = [
-        ("设置系统时间", router.set_system_time),
-        ("解锁dropbear配置", router.unlock_dropbear),
-        ("激活SSH", router.activate_ssh),
-        ("启动dropbear服务", router.start_dropbear)
-    ]
+    steps = provision_steps(router, args.batch)
     
     # 按顺序执行步骤
-    for i, (step_name, step_func) in enumerate(steps, 2):
-        print(f"\n第{i}步: {step_name}")
-        print("-" * 40)
-        
-        if step_func():
-            print(f"✓ {step_name}执行成功")
-        else:
-            print(f"✗ {step_name}执行失败")
-            print("\n配置过程已终止")
-            print("\n获取帮助：")
-            print("-" * 40)
-            print("1. 请访问以下链接查看常见问题与解决方案：")
-            print("   https://www.right.com.cn/forum/thread-8348455-1-1.html")
-            print("2. 在页面中搜索遇到的错误信息")
-            print("3. 如果问题仍未解决，可以在帖子中留言求助")
+    try:
+        for i, (step_name, step_func) in enumerate(steps, 2):
+            print(f"\n第{i}步: {step_name}")
             print("-" * 40)
-            return
 
-    # 第6步: 显示SSH连接说明
+            with router.trace(step_name) as span:
+                ok = span["ok"] = step_func()
+            if ok:
+                print(f"✓ {step_name}执行成功")
+            else:
+                print(f"✗ {step_name}执行失败")
+                print("\n配置过程已终止")
+                print("\n获取帮助：")
+                print("-" * 40)
+                print("1. 请访问以下链接查看常见问题与解决方案：")
+                print("   https://www.right.com.cn/forum/thread-8348455-1-1.html")
+                print("2. 在页面中搜索遇到的错误信息")
+                print("3. 如果问题仍未解决，可以在帖子中留言求助")
+                print("-" * 40)
+                return
+        router.clear_checkpoints()
+    finally:
+        # 成功与失败都清理本次注册的场景
+        print()
+        router.cleanup_scenes()
+
+    # 第7步: 显示SSH连接说明
     if not router.show_ssh_guide():
         return
             
-    # 第7步: 重置路由器时间
+    # 第8步: 重置路由器时间
     if not router.reset_system_time():
         return
             
-    # 第8步: 显示硬固化提示
+    # 第9步: 显示硬固化提示
     router.show_hardening_notice()
+    router.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import socket
+import sys
+
+import pytest
+
+# main.py 与 fake_router.py 是仓库根目录下的脚本, 不是包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fake_router import FakeRouter  # noqa: E402
+
+
+# 同时覆盖同步与 asyncio 两个引擎的测试参数
+ENGINES = ["sync", "async"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    """
+    默认缓存路径指向临时目录, 测试不会读写 ~/.cache
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def fake():
+    """
+    启动模拟路由器: fake(**FakeRouter 参数), 测试结束后关闭
+    """
+    routers = []
+
+    def start(**kwargs):
+        router = FakeRouter(host="127.0.0.1", port=0, ssh_port=free_port(), **kwargs)
+        router.start()
+        routers.append(router)
+        return router
+
+    yield start
+    for router in routers:
+        router.stop()
+
+
+def provision(engine, router, batch=False, password=None, **options):
+    """
+    用同步 (provision_host) 或 asyncio (provision_host_async) 引擎配置一台模拟路由器
+    :param password: 提供时用管理后台密码登录, 否则使用固定的 stok
+    :param options: 传给 RouterHack/AsyncRouterHack 的参数, 覆盖测试用的默认值
+    """
+    entry = {"host": f"127.0.0.1:{router.port}"}
+    if password:
+        entry["password"] = password
+    else:
+        entry["token"] = "stok"
+    options = dict({"ssh_port": router.ssh_port, "ssh_verify": False, "pacing": False,
+                    "settle_delay": 0.05}, **options)
+    if engine == "sync":
+        return main.provision_host(entry, batch, router_options=options)
+
+    import aiohttp
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await main.provision_host_async(entry, session, asyncio.Semaphore(1), options)
+    return asyncio.run(run())
@@ -0,0 +1,68 @@
+import pytest
+
+import main
+from conftest import ENGINES, provision
+
+
+def mark_all(store, key):
+    for step in main.SCENE_STEPS:
+        if step["checkpoint"]:
+            store.mark(key, step["id"])
+
+
+# 回归: 路由器重启后 /etc 被还原, 续跑曾直接跳过检查点中的 dropbear 解锁
+@pytest.mark.parametrize("engine", ENGINES)
+def test_resume_reexecutes_steps_lost_on_reboot(fake, tmp_path, engine):
+    router = fake()
+    state = router.router("127.0.0.1")
+    store = main.CheckpointStore(str(tmp_path / "checkpoints.db"))
+    mark_all(store, state.router_id)
+    router.reboot(state)
+
+    result = provision(engine, router, checkpoints=store, resume=True, ready_timeout=3)
+    assert result["ok"], result
+    assert any(command.startswith("sed ") for command in state.executed)
+    assert "nvram commit" in state.executed
+    # 成功后清除检查点
+    assert store.completed(state.router_id) == set()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_resume_skips_steps_that_survived_reboot(fake, tmp_path, engine):
+    router = fake()
+    state = router.router("127.0.0.1")
+    state.nvram["ssh_en"] = state.committed["ssh_en"] = "1"
+    store = main.CheckpointStore(str(tmp_path / "checkpoints.db"))
+    mark_all(store, state.router_id)
+    router.reboot(state)
+
+    result = provision(engine, router, checkpoints=store, resume=True)
+    assert result["ok"], result
+    assert "nvram commit" not in state.executed
+    assert any(command.startswith("sed ") for command in state.executed)
+
+
+def test_checkpoints_are_keyed_by_router_id(fake, tmp_path):
+    router = fake()
+    state = router.router("127.0.0.1")
+    store = main.CheckpointStore(str(tmp_path / "checkpoints.db"))
+    # 同一 IP 上之前是另一台路由器
+    mark_all(store, "127.0.0.1")
+    mark_all(store, "another-router")
+
+    result = provision("sync", router, checkpoints=store, resume=True, ready_timeout=3)
+    assert result["ok"], result
+    assert "nvram commit" in state.executed
+    assert store.completed("another-router")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_failed_run_keeps_checkpoints(fake, tmp_path, engine):
+    router = fake(ssh_supported=False, rom="9.9.9")
+    state = router.router("127.0.0.1")
+    store = main.CheckpointStore(str(tmp_path / "checkpoints.db"))
+    result = provision(engine, router, checkpoints=store, ready_timeout=1)
+    assert not result["ok"]
+    # 不续跑时不读取检查点, 但仍然记录
+    assert "读取检查点" not in [step["name"] for step in result["steps"]]
+    assert store.completed(state.router_id) == {"dropbear_unlock", "ssh_en"}
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import main
+from conftest import ENGINES, provision
+
+
+# 回归: nvram commit 慢于 settle_delay 时, 曾在 ready_at 就停止轮询并判定 ROM 不支持
+@pytest.mark.parametrize("engine", ENGINES)
+def test_slow_commit_is_not_reported_unsupported(fake, tmp_path, engine):
+    router = fake(scene_delay=0.6)
+    cache = main.CapabilityCache(str(tmp_path / "capabilities.json"))
+    result = provision(engine, router, capability_cache=cache)
+    assert result["ok"], result
+    assert cache.get("RM1800", "1.0.399")["ssh"] is True
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_unsupported_rom_needs_corroboration(fake, tmp_path, engine):
+    router = fake(ssh_supported=False, rom="9.9.9")
+    path = tmp_path / "capabilities.json"
+    cache = main.CapabilityCache(str(path))
+
+    result = provision(engine, router, capability_cache=cache, ready_timeout=1)
+    assert result["failure"] == "unsupported"
+    assert result["failed_step"] == "激活SSH"
+    # 只有一次检测, 下次运行仍然尝试
+    assert json.loads(path.read_text())["RM1800/9.9.9"]["failures"] == 1
+    assert cache.get("RM1800", "9.9.9") is None
+
+    result = provision(engine, router, capability_cache=cache, ready_timeout=1)
+    assert result["failed_step"] == "激活SSH"
+    result = provision(engine, router, capability_cache=cache, ready_timeout=1)
+    assert result["failure"] == "unsupported"
+    assert result["failed_step"] == "兼容性检查"
+
+
+# 回归: 一次误判写入的 "不支持" 曾长期拦截内置列表中已验证的 ROM
+def test_verified_rom_wins_over_negative_cache(fake, tmp_path):
+    cache = main.CapabilityCache(str(tmp_path / "capabilities.json"))
+    cache.set("RM1800", "1.0.399", False)
+    cache.set("RM1800", "1.0.399", False)
+    result = provision("sync", fake(), capability_cache=cache)
+    assert result["ok"], result
+    assert cache.get("RM1800", "1.0.399")["ssh"] is True
+
+
+# 回归: 批量流程中 && 之前的命令失败时, 曾把 ssh=false 写入缓存
+def test_batch_failure_is_not_cached(fake, tmp_path):
+    router = fake(ssh_supported=False, rom="9.9.9")
+    path = tmp_path / "capabilities.json"
+    result = provision("sync", router, batch=True, ready_timeout=1,
+                       capability_cache=main.CapabilityCache(str(path)))
+    assert not result["ok"]
+    assert "RM1800/9.9.9" not in (json.loads(path.read_text()) if path.exists() else {})
+
+
+def test_negative_cache_expires(tmp_path):
+    cache = main.CapabilityCache(str(tmp_path / "capabilities.json"), negative_ttl=0)
+    cache.set("RM1800", "9.9.9", False)
+    cache.set("RM1800", "9.9.9", False)
+    assert cache.get("RM1800", "9.9.9") is None
+    verdict, _ = main.compatibility_verdict({"hardware": "RM1800", "rom": "9.9.9"}, cache)
+    assert verdict == "untested"
@@ -0,0 +1,70 @@
+import pytest
+
+import main
+from conftest import ENGINES, provision
+
+
+class Clock:
+    """
+    sleep 只推进时间的 monotonic 时钟
+    """
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_nearest_limit_wins():
+    clock = Clock()
+    deadline = main.Deadline(run_timeout=10, step_timeout=3, clock=clock)
+    assert deadline.remaining() == 10
+    deadline.start_step()
+    assert deadline.remaining() == 3
+    assert deadline.clamp((5, 30)) == (3, 3)
+    assert deadline.clamp(1) == 1
+    clock.now += 3
+    with pytest.raises(main.DeadlineExceeded) as info:
+        deadline.check()
+    assert info.value.scope == "step"
+    # 新步骤重新计时, 但不超过整体预算
+    deadline.start_step()
+    clock.now += 2.5
+    assert deadline.remaining() == 0.5
+    assert main.Deadline(clock=clock).clamp(5) == 5
+
+
+def test_sleep_stops_at_deadline():
+    clock = Clock()
+    deadline = main.Deadline(run_timeout=2, clock=clock)
+    deadline.sleep(1)
+    with pytest.raises(main.DeadlineExceeded) as info:
+        deadline.sleep(5)
+    assert info.value.scope == "run"
+    assert clock.now == 102
+    # 超时后留给收尾操作的时间
+    deadline.grace(15)
+    deadline.sleep(10)
+    deadline.check()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_deadline_exceeded(fake, engine):
+    router = fake(scene_delay=1.0)
+    result = provision(engine, router, run_timeout=1)
+    assert not result["ok"]
+    assert result["failure"] == "timeout"
+    assert router.router("127.0.0.1").scenes == {}
+
+
+def test_step_deadline_exceeded(fake):
+    router = fake(scene_delay=1.0)
+    result = provision("sync", router, step_timeout=0.5)
+    assert result["failure"] == "timeout"
+    # 每个步骤单独计时, 失败的步骤只用了自己的预算
+    failed = [step for step in result["steps"] if step["name"] == result["failed_step"]]
+    assert failed and failed[0]["seconds"] < 1.5
+    assert router.router("127.0.0.1").scenes == {}
@@ -0,0 +1,66 @@
+import hashlib
+import json
+
+import pytest
+
+import main
+from conftest import ENGINES, provision
+
+pytest.importorskip("paramiko")
+
+
+def manifest(tmp_path):
+    (tmp_path / "files").mkdir()
+    (tmp_path / "files" / "hello.sh").write_bytes(b"#!/bin/sh\necho hello\n")
+    (tmp_path / "files" / "blob.bin").write_bytes(bytes(range(256)) * 4096)
+    path = tmp_path / "deploy.json"
+    path.write_text(json.dumps([
+        {"src": "files/hello.sh", "dest": "/data/bin/hello.sh", "mode": "755"},
+        {"src": "files/blob.bin", "dest": "/data/blob.bin"},
+    ]))
+    return main.load_manifest(str(path))
+
+
+def test_load_manifest(tmp_path):
+    files = manifest(tmp_path)
+    assert [(file["dest"], file["mode"]) for file in files] == [("/data/bin/hello.sh", 0o755), ("/data/blob.bin", 0o644)]
+    assert files[0]["md5"] == hashlib.md5(b"#!/bin/sh\necho hello\n").hexdigest()
+
+    path = tmp_path / "bad.json"
+    path.write_text(json.dumps([{"src": "files/hello.sh", "dest": "relative"}]))
+    with pytest.raises(ValueError):
+        main.load_manifest(str(path))
+    path.write_text(json.dumps([{"src": "files/hello.sh", "dest": "/a"}, {"src": "files/blob.bin", "dest": "/a"}]))
+    with pytest.raises(ValueError, match="重复"):
+        main.load_manifest(str(path))
+
+
+# 上传后 md5 一致, 再次运行时全部跳过; 没有 sftp-server 时改用 cat 写入
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("sftp", [True, False])
+def test_deploy_uploads_then_skips(fake, tmp_path, engine, sftp):
+    router = fake(sftp=sftp)
+    state = router.router("127.0.0.1")
+    files = manifest(tmp_path)
+
+    result = provision(engine, router, ssh_password="admin", deploy_manifest=files)
+    assert result["ok"], result
+    assert [item["status"] for item in result["deploy"]] == ["uploaded", "uploaded"]
+    for file in files:
+        assert state.files[file["dest"]] == {"data": file["data"], "mode": file["mode"]}
+
+    result = provision(engine, router, ssh_password="admin", deploy_manifest=files)
+    assert result["ok"], result
+    assert [item["status"] for item in result["deploy"]] == ["skipped", "skipped"]
+
+    # 只重新上传路由器上内容不同的文件
+    state.files["/data/blob.bin"]["data"] = b"stale"
+    result = provision(engine, router, ssh_password="admin", deploy_manifest=files)
+    assert [item["status"] for item in result["deploy"]] == ["skipped", "uploaded"]
+    assert state.files["/data/blob.bin"]["data"] == files[1]["data"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_deploy_requires_ssh_password(fake, tmp_path, engine):
+    result = provision(engine, fake(), deploy_manifest=manifest(tmp_path))
+    assert result["failure"] == "usage"
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+from conftest import free_port
+from fake_router import FakeRouter
+
+import main
+
+
+def test_load_inventory_csv(tmp_path):
+    path = tmp_path / "routers.csv"
+    path.write_text("host,stok,password\n 192.168.31.1 ,abc,\n,ignored,\n192.168.31.2,,admin\n")
+    assert main.load_inventory(str(path)) == [
+        {"host": "192.168.31.1", "token": "abc", "password": None},
+        {"host": "192.168.31.2", "token": None, "password": "admin"},
+    ]
+
+
+def test_load_inventory_json(tmp_path):
+    path = tmp_path / "routers.json"
+    path.write_text(json.dumps([{"host": "192.168.31.1", "token": "abc"}, {"host": " "}]))
+    assert main.load_inventory(str(path)) == [
+        {"host": "192.168.31.1", "token": "abc", "password": None},
+    ]
+
+
+def fleet():
+    """
+    两台正常的路由器 (同一个 FakeRouter 监听 0.0.0.0, 按地址区分), 一台不支持 SSH 的 ROM,
+    一台缺少凭据, 一台端口不通; 所有路由器共用同一个 SSH 端口
+    """
+    ssh_port = free_port()
+    good = FakeRouter(host="0.0.0.0", port=0, ssh_port=ssh_port)
+    bad = FakeRouter(host="127.0.0.1", port=0, ssh_port=ssh_port, ssh_supported=False, rom="9.9.9")
+    good.start()
+    bad.start()
+    inventory = [
+        {"host": f"127.0.0.2:{good.port}", "token": "stok"},
+        {"host": f"127.0.0.3:{good.port}", "password": "admin"},
+        {"host": f"127.0.0.1:{bad.port}", "token": "stok"},
+        {"host": f"127.0.0.4:{good.port}"},
+        {"host": f"127.0.0.1:{free_port()}", "token": "stok"},
+    ]
+    options = {"ssh_port": ssh_port, "ssh_verify": False, "pacing": False, "settle_delay": 0.05,
+               "ready_timeout": 1, "run_timeout": 30}
+    return (good, bad), inventory, options
+
+
+def check_results(results, inventory):
+    by_host = {result["host"]: result for result in results}
+    assert sorted(by_host) == sorted(entry["host"] for entry in inventory)
+    assert by_host[inventory[0]["host"]]["ok"], by_host[inventory[0]["host"]]
+    assert by_host[inventory[1]["host"]]["ok"], by_host[inventory[1]["host"]]
+    assert by_host[inventory[2]["host"]]["failure"] == "unsupported"
+    assert by_host[inventory[3]["host"]]["failure"] == "usage"
+    assert by_host[inventory[4]["host"]]["failure"] == "network"
+
+
+# 单台路由器失败不影响其他路由器, 汇总与报告覆盖全部主机
+def test_run_fleet_isolates_failures(tmp_path, capsys):
+    routers, inventory, options = fleet()
+    report = tmp_path / "report.json"
+    try:
+        results = main.run_fleet(inventory, workers=4, report=str(report), router_options=options)
+    finally:
+        for router in routers:
+            router.stop()
+    check_results(results, inventory)
+    assert routers[0].router("127.0.0.2").dropbear_enabled
+    assert routers[0].router("127.0.0.3").dropbear_enabled
+
+    output = capsys.readouterr().out
+    assert "=== 批量配置结果 ===" in output
+    assert "成功: 2  失败: 3  共计: 5" in output
+    assert f"✗ {inventory[3]['host']}: 缺少 stok 或管理后台密码" in output
+    assert sorted(result["host"] for result in json.loads(report.read_text())) == sorted(
+        entry["host"] for entry in inventory)
+
+
+def test_run_fleet_async_isolates_failures(tmp_path):
+    routers, inventory, options = fleet()
+    try:
+        results = asyncio.run(main.run_fleet_async(inventory, concurrency=8, router_options=options))
+    finally:
+        for router in routers:
+            router.stop()
+    check_results(results, inventory)
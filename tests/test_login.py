@@ -0,0 +1,55 @@
+import json
+import os
+
+import pytest
+
+import main
+from conftest import ENGINES, provision
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("new_encrypt_mode", [False, True])
+def test_password_login_caches_token(fake, tmp_path, engine, new_encrypt_mode):
+    router = fake(token="valid", new_encrypt_mode=new_encrypt_mode)
+    path = tmp_path / "tokens.json"
+    result = provision(engine, router, password="admin", token_cache=main.TokenCache(str(path)))
+    assert result["ok"], result
+    assert len(router.issued_tokens) == 1
+    token, = router.issued_tokens
+    assert json.loads(path.read_text())[f"127.0.0.1:{router.port}"]["token"] == token
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+    # 缓存中的 stok 未过期时不再登录
+    result = provision(engine, router, password="admin", token_cache=main.TokenCache(str(path)))
+    assert result["ok"], result
+    assert len(router.issued_tokens) == 1
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_wrong_password_is_auth_failure(fake, engine):
+    result = provision(engine, fake(token="valid"), password="wrong")
+    assert not result["ok"]
+    assert result["failure"] == "auth"
+
+
+# stok 在运行中途过期 (3001) 时重新登录并重发请求
+@pytest.mark.parametrize("engine", ENGINES)
+def test_expired_token_triggers_relogin(fake, tmp_path, engine):
+    router = fake(token="valid", token_ttl=0.2, scene_delay=0.3)
+    path = tmp_path / "tokens.json"
+    result = provision(engine, router, password="admin", token_cache=main.TokenCache(str(path)))
+    assert result["ok"], result
+    assert len(router.issued_tokens) >= 2
+    # 缓存中是最后一次登录得到的 stok
+    cached = json.loads(path.read_text())[f"127.0.0.1:{router.port}"]["token"]
+    assert cached in router.issued_tokens
+
+
+def test_expired_cached_token_is_not_used(tmp_path):
+    cache = main.TokenCache(str(tmp_path / "tokens.json"), ttl=0)
+    cache.set("192.168.31.1", "old")
+    assert cache.get("192.168.31.1") is None
+    cache = main.TokenCache(str(tmp_path / "tokens.json"))
+    cache.set("192.168.31.1", "new")
+    cache.invalidate("192.168.31.1")
+    assert cache.get("192.168.31.1") is None
@@ -0,0 +1,52 @@
+import threading
+
+import main
+from conftest import provision
+
+
+def test_render_counters_and_histograms():
+    metrics = main.Metrics()
+    endpoint = "/api/xqsmarthome/request_smartcontroller"
+    metrics.response("POST", endpoint, 0.03, -101)
+    metrics.response("POST", endpoint, 0.2, 0)
+    metrics.response("POST", endpoint, 0.2, 1523)
+    text = metrics.render()
+    assert 'miwifi_smartcontroller_responses_total{code="-101"} 1' in text
+    assert 'miwifi_smartcontroller_responses_total{code="other"} 1' in text
+    labels = f'endpoint="{endpoint}",method="POST"'
+    assert f'miwifi_request_duration_seconds_bucket{{{labels},le="0.05"}} 1' in text
+    assert f'miwifi_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert f'miwifi_request_duration_seconds_count{{{labels}}} 3' in text
+    assert "# TYPE miwifi_runs_total counter" in text
+
+    openmetrics = metrics.render(openmetrics=True)
+    assert "# TYPE miwifi_runs counter" in openmetrics
+    assert openmetrics.endswith("# EOF\n")
+
+
+# 回归: 导出时其他线程新增指标, 合并曾反复重试直到复制成功
+def test_render_while_threads_record():
+    metrics = main.Metrics()
+
+    def record(index):
+        for i in range(2000):
+            metrics.inc("miwifi_request_errors", (("endpoint", f"/{index}/{i % 50}"), ("method", "GET")))
+            metrics.observe("miwifi_run_duration_seconds", 0.01)
+
+    threads = [threading.Thread(target=record, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        metrics.render()
+    counters, histograms = metrics._merged()
+    assert sum(counters.values()) == 8 * 2000
+    assert sum(histograms[("miwifi_run_duration_seconds", ())][0]) == 8 * 2000
+
+
+def test_provision_records_runs_and_steps(fake):
+    metrics = main.Metrics()
+    result = provision("sync", fake(), metrics=metrics)
+    assert result["ok"], result
+    text = metrics.render()
+    assert 'miwifi_runs_total{hardware="unknown",outcome="ok"} 1' in text
+    assert 'miwifi_step_duration_seconds_count{hardware="unknown",step="activate_ssh"} 1' in text
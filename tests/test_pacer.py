@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+from conftest import ENGINES
+
+
+class Clock:
+    """
+    手动推进的 monotonic 时钟, 替换 Pacer.time
+    """
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+def pacer(**kwargs):
+    pacer = main.Pacer(**kwargs)
+    pacer.time = Clock()
+    return pacer
+
+
+def test_reserve_spaces_requests_at_rate():
+    p = pacer(max_rate=10)
+    assert [round(p.reserve(), 3) for _ in range(3)] == [0, 0.1, 0.2]
+    # 空闲之后不累积额度
+    p.time.now += 5
+    assert p.reserve() == 0
+
+
+def test_congestion_halves_actual_rate():
+    p = pacer(max_rate=50, min_rate=0.5)
+    for _ in range(4):
+        p.reserve()
+    # 顺序执行时实际只发送了 4 次, 以实际速率为基准减速
+    p.congested()
+    assert p.rate == 2
+    for _ in range(10):
+        p.congested()
+    assert p.rate == 0.5
+
+
+def test_observe_increases_additively_and_detects_slow_responses():
+    p = pacer(max_rate=10, increase=0.5)
+    p.rate = 2
+    p.observe("/a", 0.01)
+    assert p.rate == 2.25
+    # 高于历史最低延迟的 slow_factor 倍, 但没有超过 slow_margin: 视为正常抖动
+    p.observe("/a", 0.05)
+    assert p.rate > 2.25
+    p.reserve()
+    p.observe("/a", 0.5)
+    assert p.rate < 2.25
+    # 各接口分别统计最低延迟
+    rate = p.rate
+    p.observe("/b", 0.5)
+    assert p.rate > rate
+
+
+def test_busy_response_is_congestion():
+    p = pacer(max_rate=10)
+    p.reserve()
+    p.observe("/a", 0.01, congested=True)
+    assert p.rate == 0.5
+
+
+def test_high_load_is_congestion():
+    p = pacer(max_rate=10, load_interval=2, high_load=0.8)
+    assert p.load_due()
+    p.observe_load(0.5)
+    assert p.rate == 10
+    assert not p.load_due()
+    p.time.now += 2
+    assert p.load_due()
+    p.reserve()
+    p.observe_load(0.9)
+    assert p.rate == 0.5
+    # 读取失败不影响速率
+    p.observe_load(None)
+    assert p.load is None and p.rate == 0.5
+
+
+def test_cpu_load():
+    assert main.cpu_load({"cpu": {"load": "0.25"}}) == 0.25
+    assert main.cpu_load({"code": 401}) is None
+    assert main.cpu_load(None) is None
+
+
+# 回归: asyncio 引擎在会话创建之前采样负载曾抛出 AttributeError
+def test_async_sample_load_without_session(fake):
+    router = fake()
+
+    async def run():
+        hack = main.AsyncRouterHack(f"127.0.0.1:{router.port}", "stok", pacing={"load_interval": 0})
+        try:
+            await hack.sample_load()
+        finally:
+            await hack.close()
+        return hack.pacer.load
+    assert asyncio.run(run()) is not None
+
+
+# 路由器报告的负载过高时降低请求速率
+@pytest.mark.parametrize("engine", ENGINES)
+def test_sample_load_slows_down_busy_router(fake, engine):
+    router = fake(capacity=2)
+    state = router.router("127.0.0.1")
+    state.recent.extend([time.monotonic()] * 4)
+    host, pacing = f"127.0.0.1:{router.port}", {"max_rate": 20, "load_interval": 0}
+
+    if engine == "sync":
+        hack = main.RouterHack(host, "stok", pacing=pacing)
+        try:
+            hack.sample_load()
+        finally:
+            hack.close()
+    else:
+        async def run():
+            hack = main.AsyncRouterHack(host, "stok", pacing=pacing)
+            try:
+                await hack.sample_load()
+            finally:
+                await hack.close()
+            return hack
+        hack = asyncio.run(run())
+    assert hack.pacer.load == 1
+    assert hack.pacer.rate < 20
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+import main
+from conftest import ENGINES, provision
+
+
+def test_model_profile_precedence():
+    assert main.model_profile()["name"] == "default"
+    assert main.model_profile("UNKNOWN", "1.0")["settle_delay"] == main.DEFAULT_PROFILE["settle_delay"]
+
+    fast = main.model_profile("RM1800", "1.0.399")
+    assert fast["settle_delay"] == main.PROFILE_TIERS["fast"]["settle_delay"]
+    assert fast["max_rate"] == main.DEFAULT_PROFILE["max_rate"]
+    safe = main.model_profile("R2100", "2.0.7")
+    assert safe["max_rate"] == main.PROFILE_TIERS["safe"]["max_rate"]
+
+    # "型号/ROM" 优先于 "型号"
+    overrides = {"RM1800": {"settle_delay": 0.1, "max_rate": 5}, "RM1800/1.0.399": {"settle_delay": 0.2}}
+    profile = main.model_profile("RM1800", "1.0.399", overrides)
+    assert (profile["settle_delay"], profile["max_rate"]) == (0.2, 5)
+    assert "自定义" in profile["name"]
+    assert main.model_profile("RM1800", "1.0.400", overrides)["settle_delay"] == 0.1
+
+
+def test_load_profiles_rejects_unknown_keys(tmp_path):
+    assert main.load_profiles(None) == {}
+    path = tmp_path / "profiles.json"
+    path.write_text(json.dumps({"RM1800": {"ready_timeout": 10}}))
+    assert main.load_profiles(str(path)) == {"RM1800": {"ready_timeout": 10}}
+    path.write_text(json.dumps({"RM1800": {"ready_timeot": 10}}))
+    with pytest.raises(ValueError, match="ready_timeot"):
+        main.load_profiles(str(path))
+
+
+# 出厂时 dropbear 已解锁的固件可以跳过解锁场景
+@pytest.mark.parametrize("engine", ENGINES)
+def test_profile_skips_scene(fake, tmp_path, engine):
+    router = fake(dropbear_unlocked=True)
+    state = router.router("127.0.0.1")
+    result = provision(engine, router, profile_overrides={"RM1800": {"skip": ["dropbear_unlock"]}},
+                       capability_cache=main.CapabilityCache(str(tmp_path / "capabilities.json")))
+    assert result["ok"], result
+    assert not any(command.startswith("sed ") for command in state.executed)
+    assert "nvram commit" in state.executed
+    assert state.scenes == {}
+
+
+# 显式传入的参数优先于型号配置
+def test_explicit_options_win_over_profile(fake, tmp_path):
+    router = fake()
+    hack = main.RouterHack(f"127.0.0.1:{router.port}", "stok", settle_delay=0.05, pacing={"max_rate": 7},
+                           profile_overrides={"RM1800": {"settle_delay": 2, "ready_timeout": 9, "max_rate": 3}},
+                           capability_cache=main.CapabilityCache(str(tmp_path / "capabilities.json")))
+    try:
+        assert hack.preflight()
+    finally:
+        hack.close()
+    assert (hack.settle_delay, hack.ready_timeout, hack.pacer.max_rate) == (0.05, 9, 7)
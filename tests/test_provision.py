@@ -0,0 +1,22 @@
+import pytest
+
+from conftest import ENGINES, provision
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_provision_enables_ssh(fake, engine):
+    router = fake()
+    result = provision(engine, router)
+    assert result["ok"], result
+    state = router.router("127.0.0.1")
+    assert state.committed.get("ssh_en") == "1"
+    assert state.dropbear_enabled
+    # 注入的场景全部清理
+    assert state.scenes == {}
+
+
+def test_batch_provision_enables_ssh(fake):
+    router = fake()
+    result = provision("sync", router, batch=True)
+    assert result["ok"], result
+    assert router.router("127.0.0.1").dropbear_enabled
@@ -0,0 +1,39 @@
+import pytest
+
+import main
+
+
+def record(router, tmp_path, **options):
+    """
+    按命令行的默认参数 (兼容性缓存、检查点) 录制一次运行
+    """
+    path = str(tmp_path / "run.jsonl.gz")
+    entry = {"host": f"127.0.0.1:{router.port}", "token": "stok", "cassette": main.Cassette(path)}
+    options = dict({"ssh_port": router.ssh_port, "ssh_verify": False, "settle_delay": 0.05,
+                    "capability_cache": main.CapabilityCache(str(tmp_path / "capabilities.json")),
+                    "checkpoints": main.CheckpointStore(str(tmp_path / "checkpoints.db"))}, **options)
+    return path, main.provision_host(entry, router_options=options)
+
+
+# 回归: 录制时总会读取检查点, 回放时没有检查点数据库, 步骤列表不一致
+def test_replay_matches_recording(fake, tmp_path):
+    pytest.importorskip("paramiko")
+    router = fake(error_rate=0.2)
+    path, recorded = record(router, tmp_path, ssh_verify=True, ssh_password="admin",
+                            ssh_commands=["echo hi"])
+    assert recorded["ok"], recorded
+    router.stop()
+
+    result, expected = main.replay_cassette(path)
+    assert expected == main.replay_outcome(recorded)
+    assert main.replay_outcome(result) == expected
+    assert result["commands"][0]["stdout"] == "hi\n"
+
+
+def test_replay_matches_failed_recording(fake, tmp_path):
+    router = fake(ssh_supported=False, rom="9.9.9")
+    path, recorded = record(router, tmp_path, ready_timeout=1)
+    assert recorded["failure"] == "unsupported"
+
+    result, expected = main.replay_cassette(path)
+    assert main.replay_outcome(result) == expected == main.replay_outcome(recorded)
@@ -0,0 +1,82 @@
+import pytest
+
+import main
+from conftest import ENGINES, provision
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """
+    重试前不等待, 测试只关心重试次数
+    """
+    monkeypatch.setattr(main, "retry_delay", lambda attempt: 0.01)
+
+
+def busy_responses(metrics):
+    text = metrics.render()
+    label = 'miwifi_smartcontroller_responses_total{code="-101"} '
+    return sum(int(line[len(label):]) for line in text.splitlines() if line.startswith(label))
+
+
+def test_busy_smartcontroller_exhausts_retries(fake, no_backoff):
+    router = fake(error_rate=1.0)
+    metrics = main.Metrics()
+    hack = main.RouterHack(f"127.0.0.1:{router.port}", "stok", retry_policy={-101: 2}, metrics=metrics,
+                           pacing=False)
+    try:
+        assert not hack.unlock_dropbear()
+    finally:
+        hack.close()
+    assert hack.failure == "smartcontroller"
+    # 读取场景列表与注册场景各 1 次请求 + 2 次重试
+    assert busy_responses(metrics) == 6
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_busy_smartcontroller_is_retried(fake, no_backoff, engine):
+    router = fake(error_rate=0.5)
+    metrics = main.Metrics()
+    result = provision(engine, router, retry_policy={-101: 20}, metrics=metrics)
+    assert result["ok"], result
+    assert busy_responses(metrics) > 0
+
+
+# 回归: ssh 明确为 false 时曾一直轮询到 ready_timeout
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("batch", [False, True])
+def test_unsupported_rom_fails_fast(fake, tmp_path, engine, batch):
+    if engine == "async" and batch:
+        pytest.skip("asyncio 引擎不支持批量模式")
+    router = fake(ssh_supported=False, rom="9.9.9")
+    overrides = {"RM1800": {"commit_delay": 0.5}}
+    result = provision(engine, router, batch=batch, ready_timeout=30, profile_overrides=overrides,
+                       capability_cache=main.CapabilityCache(str(tmp_path / "capabilities.json")))
+    # 批量模式下无法排除之前的命令失败
+    assert result["failure"] == ("not_ready" if batch else "unsupported")
+    assert result["seconds"] < 10
+
+
+def test_circuit_breaker_opens_and_reports_kind():
+    breaker = main.CircuitBreaker(threshold=2, cooldown=60)
+    breaker.check("router")
+    breaker.failure("router", "network")
+    breaker.failure("router", "network")
+    with pytest.raises(main.CircuitOpenError) as info:
+        breaker.check("router")
+    assert "network" in str(info.value)
+    breaker.success("router")
+    breaker.check("router")
+
+
+# 回归: 不重试的错误码曾被记为成功, 熔断计数一直被重置
+def test_circuit_breaker_counts_error_codes(fake):
+    router = fake(token="valid")
+    breaker = main.CircuitBreaker(threshold=2, cooldown=60)
+    hack = main.RouterHack(f"127.0.0.1:{router.port}", "expired", circuit_breaker=breaker, pacing=False)
+    try:
+        assert not hack.unlock_dropbear()
+        assert not hack.unlock_dropbear()
+        with pytest.raises(main.CircuitOpenError):
+            breaker.check(hack.host)
+    finally:
+        hack.close()
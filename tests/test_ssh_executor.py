@@ -0,0 +1,57 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import main
+
+
+# 回归: 先读完 stdout 再读 stderr, 大量 stderr 会占满接收窗口导致死锁
+def test_ssh_executor_reads_large_stderr(fake):
+    pytest.importorskip("paramiko")
+    router = fake()
+    router.open_ssh(router.router("127.0.0.1"))
+    executor = main.SSHExecutor("127.0.0.1", router.ssh_port, password="admin", timeout=10)
+    try:
+        result = executor.run("head -c 3000000 /dev/zero >&2 && echo done")
+    finally:
+        executor.close()
+    assert result["error"] is None
+    assert result["exit_code"] == 0
+    assert result["stdout"] == "done\n"
+    assert len(result["stderr"]) == 3000000
+
+
+class StubChannel:
+    """
+    只实现 SSHExecutor._drain 用到的部分 paramiko.Channel 接口
+    :param trickle: 是否一直有输出; 否则立即 EOF, 但永远不发送退出状态
+    """
+    def __init__(self, trickle=False):
+        self.trickle = trickle
+        self.eof_received = not trickle
+        self.closed = False
+        self.status_event = threading.Event()
+
+    def recv_ready(self):
+        return self.trickle
+
+    def recv(self, size):
+        time.sleep(0.01)
+        return b"."
+
+    def recv_stderr_ready(self):
+        return False
+
+    def exit_status_ready(self):
+        return False
+
+
+# 回归: timeout 只限制两次输出之间的间隔, recv_exit_status() 不限时
+@pytest.mark.parametrize("trickle", [False, True])
+def test_drain_enforces_total_deadline(trickle):
+    started = time.monotonic()
+    with pytest.raises(socket.timeout):
+        main.SSHExecutor._drain(StubChannel(trickle), started + 0.3)
+    assert time.monotonic() - started < 2
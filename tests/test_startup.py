@@ -0,0 +1,30 @@
+import importlib.metadata
+import os
+import subprocess
+import sys
+
+import benchmark
+import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_dependency_check_does_not_scan_distributions(monkeypatch):
+    def scan(*args, **kwargs):
+        raise AssertionError("依赖检查不应扫描已安装包的元数据")
+    monkeypatch.setattr(importlib.metadata, "distributions", scan)
+    monkeypatch.setattr(importlib.metadata, "version", scan)
+    assert main.install_dependencies(("paramiko",), assume_yes=False)
+
+
+def test_dependency_check_imports_nothing():
+    code = ("import sys; before = set(sys.modules); import main; main.install_dependencies(assume_yes=False); "
+            "print(sorted(name for name in set(sys.modules) - before if '.' not in name))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == "['main']"
+
+
+# 与 README 中 benchmark.py --max-startup-ms 150 的上限相同
+def test_startup_overhead():
+    assert benchmark.bench_startup(5)["overhead_ms"] < 150
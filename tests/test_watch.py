@@ -0,0 +1,76 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from conftest import free_port
+from fake_router import FakeRouter
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+class Watch:
+    """
+    以看门狗模式运行 main.py, 清单中只有一台路由器; 输出逐行收集到 lines
+    """
+    def __init__(self, tmp_path, http_port, ssh_port):
+        inventory = tmp_path / "routers.csv"
+        inventory.write_text(f"host,password\n127.0.0.1:{http_port},admin\n")
+        self.process = subprocess.Popen(
+            [sys.executable, MAIN, "--no-dep-check", "--inventory", str(inventory), "--watch",
+             "--watch-interval", "1", "--ssh-port", str(ssh_port), "--no-ssh-verify"],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+            env=dict(os.environ, PYTHONUNBUFFERED="1"))
+        self.lines = []
+        self.reader = threading.Thread(target=lambda: self.lines.extend(self.process.stdout), daemon=True)
+        self.reader.start()
+
+    def count(self, text):
+        return sum(text in line for line in list(self.lines))
+
+    def stop(self):
+        self.process.send_signal(signal.SIGINT)
+        self.process.wait(timeout=30)
+        self.reader.join(timeout=5)
+        return "".join(self.lines)
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.1)
+
+
+def test_watch_recovers_after_reboot(fake, tmp_path):
+    router = fake()
+    state = router.router("127.0.0.1")
+    watch = Watch(tmp_path, router.port, router.ssh_port)
+    try:
+        # 启动时 SSH 尚未开启, 同样按失效处理
+        wait_for(lambda: watch.count("SSH 已恢复") == 1)
+        router.reboot(state)
+        wait_for(lambda: watch.count("SSH 已恢复") == 2)
+    finally:
+        output = watch.stop()
+    assert "已恢复: 2 次" in output, output
+    # ssh_en 已提交, 重启后只重新启动 dropbear
+    assert state.executed.count("nvram commit") == 1
+
+
+def test_watch_waits_for_router_to_boot(tmp_path):
+    http_port, ssh_port = free_port(), free_port()
+    watch = Watch(tmp_path, http_port, ssh_port)
+    router = None
+    try:
+        wait_for(lambda: watch.count("等待启动完成") == 1)
+        router = FakeRouter(host="127.0.0.1", port=http_port, ssh_port=ssh_port)
+        router.start()
+        wait_for(lambda: watch.count("SSH 已恢复") == 1)
+    finally:
+        output = watch.stop()
+        if router is not None:
+            router.stop()
+    assert "恢复失败: 0 次" in output, output